@@ -1,7 +1,20 @@
-import blitzcurve.utils
-import blitzcurve.fit
-import blitzcurve.compare
-import blitzcurve.test
-from blitzcurve.fit import run_fit
-from blitzcurve.compare import run_compare
-from blitzcurve.test import run_test
\ No newline at end of file
+__version__ = "0.0.2"
+
+import importlib
+
+# The submodules and the run_* functions are imported on first access (e.g. blitzcurve.run_fit or
+# blitzcurve.calc), so that "import blitzcurve" does not load matplotlib, pandas and scipy.
+# This keeps the start of worker processes and command-line jobs fast.
+_submodules = ["estimate", "utils", "load", "metrics", "uncertainty", "weights", "calc", "decimate", "profiles", "plot", "render",
+               "batch", "globalfit", "bench", "cache", "store", "summary", "fit", "compare", "watch", "test", "cli"]
+_functions = {"run_fit": "fit", "run_compare": "compare", "run_watch": "watch", "run_test": "test"}
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("blitzcurve." + name)
+    if name in _functions:
+        return getattr(importlib.import_module("blitzcurve." + _functions[name]), name)
+    raise AttributeError("module 'blitzcurve' has no attribute '{}'".format(name))
+
+def __dir__():
+    return sorted(list(globals()) + _submodules + list(_functions))
@@ -0,0 +1,4 @@
+import sys
+from blitzcurve.cli import main
+
+sys.exit(main())
@@ -0,0 +1,265 @@
+import numpy as np
+import blitzcurve.utils as utils
+from blitzcurve.calc import FitSettings, STAGES, estimated_guess, find_r_max, find_start_seg1, find_end_seg1, resolve_stages, robust_curve_fit
+from blitzcurve.weights import trace_sigma
+
+def fit_batch(time, anisotropy, settings=None, chunk_size=64):
+    """Fits many anisotropy traces that share the same time axis in one call.
+
+    Gives the same parameters as blitzcurve.calc.fit_curves for each sample, but all traces are fitted together
+    with a stacked Levenberg-Marquardt solver (see levenberg_marquardt), using vectorised residuals and
+    analytic Jacobians of the utils.FitModel objects. This avoids thousands of separate optimiser setups for large batches.
+    As in fit_curves, each trace starts from its own initial guess estimated from the data (see calc.estimated_guess),
+    and traces where a fit does not converge are fitted again separately with the fallback strategies
+    of calc.robust_curve_fit (see settings.initial_guess and settings.fallback).
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Shared time axis in nanoseconds, shape (n_timepoints,).
+    anisotropy : np.ndarray
+        Anisotropy of all samples, shape (n_samples, n_timepoints).
+    settings : FitSettings
+        Settings for the fits. Default is None, which uses FitSettings().
+        settings.weighting "wres" is not available, as the stacked array only contains the anisotropy.
+    chunk_size : int
+        Number of traces that are fitted together. Chunks of around 64 traces keep the
+        arrays small enough to stay in the CPU cache, which is faster than fitting everything at once.
+
+    Returns
+    -------
+    results : dict
+        Dictionary with the same keys as the summ_dict of fit_curves (r_max, a_seg1, r_inf, Kfast, etc.).
+        Each value is an array with one value per sample.
+        The standard errors ("<key>_se") are always NaN, as the stacked solver does not calculate the covariance.
+        Use fit_curves for the standard errors of single samples.
+        results["converged"] is a boolean array, False for samples where any of the fits failed, including the fallback strategies.
+
+    Usage
+    -----
+    from blitzcurve.batch import fit_batch
+    results = fit_batch(time, anisotropy_2d)
+    df = pd.DataFrame(results, index=filenames)
+    """
+    if settings is None:
+        settings = FitSettings()
+    if settings.weighting == "wres":
+        raise ValueError("fit_batch does not support weighting 'wres'. Use weighting 'noise', or fit_curves with the wres column.")
+    x = np.asarray(time, dtype=float)
+    Y = np.atleast_2d(np.asarray(anisotropy, dtype=float))
+    chunks = [_fit_batch_chunk(x, Y[i:i + chunk_size], settings) for i in range(0, Y.shape[0], chunk_size)]
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+def _fit_batch_chunk(x, Y, settings):
+    """Fits a chunk of traces for fit_batch."""
+    n_samples, n_timepoints = Y.shape
+    index = np.arange(n_timepoints)
+
+    #########################################################################
+    #                         Savitzky-Golay fit                            #
+    #########################################################################
+    y_fit_savgol, r_max, r_max_index, r_max_time = find_r_max(x, Y, settings.savgol_window, settings.savgol_order, settings.refine_peak)
+    # as in fit_curves, the fits of stages that are not selected give NaN. r_max and the segments are always needed.
+    enabled = resolve_stages(settings.stages)
+    results = {key: np.full(n_samples, np.nan) for stage in STAGES.values() for key in stage.outputs}
+    results["r_max_index"] = r_max_index
+    results["r_max"] = r_max
+    results["r_max_time"] = r_max_time
+
+    converged = np.ones(n_samples, dtype=bool)
+
+    # as in fit_curves, the noise of each datapoint is calculated once, and weights all fits
+    sigma = trace_sigma(Y, settings.weighting, y_fit_savgol, window=settings.noise_window)
+
+    # boolean masks of the datapoints in each segment, shape (n_samples, n_timepoints)
+    start_seg1 = find_start_seg1(x, results["r_max_index"], settings)
+    mask_seg1_seg2 = index >= start_seg1[:, None]
+    two_phase_popt = None
+    if settings.segment_mode == "auto":
+        # as in fit_curves, the boundary between the segments is derived from the two phase exponential decay
+        p0 = np.tile(settings.two_phase_guess, (n_samples, 1))
+        two_phase_popt, two_phase_conv = _fit_traces(utils.two_phase_exp_decay_model, x, Y, p0, mask_seg1_seg2, sigma, "2phasedecay", settings)
+    end_seg1 = find_end_seg1(x, start_seg1, settings, two_phase_popt)
+    start_seg2 = end_seg1
+    mask_seg1 = (index >= start_seg1[:, None]) & (index <= end_seg1[:, None])
+    mask_seg2 = index >= start_seg2[:, None]
+    results["start_seg1_time"] = np.where(start_seg1 < n_timepoints, x[np.minimum(start_seg1, n_timepoints - 1)], np.nan)
+    results["end_seg1_time"] = np.where(end_seg1 < n_timepoints, x[np.minimum(end_seg1, n_timepoints - 1)], np.nan)
+
+    # segment 1 exponential fit
+    if "seg1" in enabled:
+        p0 = np.tile(settings.seg1_guess, (n_samples, 1))
+        popt, conv = _fit_traces(utils.exp_model, x, Y, p0, mask_seg1, sigma, "seg1", settings)
+        results["a_seg1"], results["b_seg1"], results["c_seg1"] = popt.T
+        converged &= conv
+
+    # segment 2 exponential fit
+    if "seg2" in enabled:
+        p0 = np.tile(settings.seg2_guess, (n_samples, 1))
+        popt, conv = _fit_traces(utils.exp_model, x, Y, p0, mask_seg2, sigma, "seg2", settings)
+        results["a_seg2"], results["b_seg2"], results["r_inf"] = popt.T
+        converged &= conv
+
+    # 2-phase exponential decay fit to segments 1 & 2
+    if "2phasedecay" in enabled:
+        if two_phase_popt is None:
+            p0 = np.tile(settings.two_phase_guess, (n_samples, 1))
+            two_phase_popt, two_phase_conv = _fit_traces(utils.two_phase_exp_decay_model, x, Y, p0, mask_seg1_seg2, sigma, "2phasedecay", settings)
+        popt, conv = two_phase_popt, two_phase_conv
+        results["plateau"], results["SpanFast"], results["Kfast"], results["SpanSlow"], results["Kslow"] = popt.T
+        converged &= conv
+
+    # time resolved anisotropy decay fit, with r0 fixed to r_max of each sample
+    # as in fit_curves, r_inf from this fit replaces r_inf from segment 2
+    if "anisotropy_decay" in enabled:
+        p0 = np.column_stack([results["r_max"], np.ones((n_samples, 2))])
+        popt, conv = _fit_traces(utils.time_resolved_anisotropy_decay_model, x, Y, p0, mask_seg1_seg2, sigma, "anisotropy_decay", settings, fixed=[0])
+        results["r_inf"], results["transfer_rate"] = popt[:, 1], popt[:, 2]
+        converged &= conv
+
+    results["converged"] = converged
+    return results
+
+def _fit_traces(model, x, Y, P0, segments, sigma, name, settings, fixed=None):
+    """Fits a model to the datapoints in the segment of each trace, in the same way as calc.robust_curve_fit.
+
+    The stacked fit starts from the estimated guess of each trace (if settings.initial_guess is "estimate").
+    Traces where it does not converge are fitted again separately with robust_curve_fit (if settings.fallback is True),
+    which tries the same strategies as fit_curves. P0 holds the guess from the settings, and the values of the fixed parameters.
+    Returns the fitted parameters, shape (n_samples, n_params), and a boolean array that is False for failed fits.
+    """
+    P0 = np.array(P0, dtype=float)
+    sigma = None if sigma is None else np.broadcast_to(sigma, Y.shape)
+    free = [i for i in range(P0.shape[1]) if fixed is None or i not in fixed]
+    traces = [_get_trace(model, x, Y, P0, segments, sigma, fixed, i) for i in range(Y.shape[0])]
+    P_start = P0.copy()
+    if settings.initial_guess == "estimate":
+        # the estimators are not iterative, so estimating each trace separately costs much less than the fit
+        for i, (trace_model, x_seg, y_seg, sigma_seg) in enumerate(traces):
+            P_start[i, free] = estimated_guess(trace_model, x_seg, y_seg, P0[i, free], sigma_seg)
+    # the masks of levenberg_marquardt multiply the residuals, so the weighted masks are multiplied by 1 / sigma
+    mask = segments if sigma is None else segments / sigma
+    P, converged = levenberg_marquardt(model, x, Y, P_start, mask=mask, fixed=fixed)
+    if settings.fallback:
+        for i in np.flatnonzero(~converged):
+            trace_model, x_seg, y_seg, sigma_seg = traces[i]
+            popt, pcov, status = robust_curve_fit(trace_model, x_seg, y_seg, P0[i, free], name, settings, sigma=sigma_seg)
+            if not status.startswith("failed"):
+                P[i, free] = popt
+                converged[i] = True
+    return P, converged
+
+def _get_trace(model, x, Y, P0, segments, sigma, fixed, i):
+    """Model (with the fixed parameters of that trace), x, y and sigma of the segment of a single trace."""
+    if fixed is not None:
+        model = model.fix(**{model.param_names[j]: P0[i, j] for j in fixed})
+    segment = segments[i]
+    return model, x[segment], Y[i, segment], None if sigma is None else sigma[i, segment]
+
+def levenberg_marquardt(model, x, Y, P0, mask=None, fixed=None, max_iter=200, ftol=1.49012e-08, xtol=1.49012e-08):
+    """Stacked Levenberg-Marquardt least-squares fit of a model to many traces at once.
+
+    Each sample has its own parameters and damping factor, but residuals, Jacobians and the normal equations
+    of all samples are computed together as arrays. Samples are dropped from the iteration as soon as they converge.
+
+    Parameters
+    ----------
+    model : utils.FitModel
+        Model with analytic Jacobian, e.g. utils.exp_model.
+    x : np.ndarray
+        Shared x values, shape (n_timepoints,).
+    Y : np.ndarray
+        y values of all samples, shape (n_samples, n_timepoints).
+    P0 : np.ndarray
+        Initial parameters, shape (n_samples, n_params).
+    mask : np.ndarray
+        Boolean array of shape (n_samples, n_timepoints). Only datapoints where mask is True are fitted.
+        A float array weights the residual of each datapoint, e.g. with 1 / sigma for weighted fits.
+        Default is None, which fits all datapoints.
+    fixed : list
+        Indices of parameters that are held constant at their value in P0 (e.g. r0 in the anisotropy decay fit).
+    max_iter : int
+        Maximum number of iterations.
+    ftol : float
+        Relative tolerance in the sum of squares. Same default as scipy.optimize.curve_fit.
+    xtol : float
+        Relative tolerance in the parameters. Same default as scipy.optimize.curve_fit.
+
+    Returns
+    -------
+    P : np.ndarray
+        Fitted parameters, shape (n_samples, n_params).
+    converged : np.ndarray
+        Boolean array, True for samples that converged within max_iter, i.e. the relative reduction of the sum of
+        squares was below ftol, the relative step was below xtol, or the gradient was zero.
+        False for samples that exceeded max_iter, or stalled because no step reduced the sum of squares.
+    """
+    P = np.array(P0, dtype=float)
+    n_samples, n_params = P.shape
+    weights = np.ones(Y.shape) if mask is None else np.asarray(mask, dtype=float)
+    # drop timepoints that are outside the mask in all samples
+    columns = np.any(weights != 0, axis=0)
+    x, Y, weights = x[columns], Y[:, columns], weights[:, columns]
+    free = np.setdiff1d(np.arange(n_params), [] if fixed is None else fixed)
+
+    # large steps can overflow the exponential in the models. These give a non-finite cost and are rejected.
+    with np.errstate(over="ignore", invalid="ignore"):
+        resid = (Y - model.batch_func(x, P)) * weights
+    cost = np.sum(resid ** 2, axis=1)
+    cost[~np.isfinite(cost)] = np.inf
+
+    # normal equations J.T @ J and J.T @ resid, only recalculated for samples where the parameters changed
+    A = np.zeros((n_samples, free.size, free.size))
+    g = np.zeros((n_samples, free.size))
+    stale = np.ones(n_samples, dtype=bool)
+    # damping factor for each sample
+    lam = np.full(n_samples, 1e-3)
+    converged = np.zeros(n_samples, dtype=bool)
+    active = np.arange(n_samples)
+
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        update = active[stale[active]]
+        with np.errstate(over="ignore", invalid="ignore"):
+            J = model.batch_jac(x, P[update])[:, free, :] * weights[update, None, :]
+            A[update] = np.einsum("spt,sqt->spq", J, J)
+            g[update] = np.einsum("spt,st->sp", J, resid[update])
+        stale[update] = False
+        # no step can reduce the cost at a stationary point
+        stationary = ~np.any(g[active], axis=1)
+        converged[active[stationary]] = True
+        active = active[~stationary]
+
+        # damped Gauss-Newton step, with Marquardt scaling of the damping by the diagonal of J.T @ J
+        A_a, g_a, lam_a = A[active], g[active], lam[active]
+        diag = np.maximum(np.einsum("spp->sp", A_a), 1e-12)
+        A_damped = A_a + lam_a[:, None, None] * diag[:, :, None] * np.eye(free.size)
+        delta = np.linalg.solve(A_damped, g_a[:, :, None])[:, :, 0]
+        P_new = P[active]
+        P_new[:, free] += delta
+        with np.errstate(over="ignore", invalid="ignore"):
+            resid_new = (Y[active] - model.batch_func(x, P_new)) * weights[active]
+            cost_new = np.sum(resid_new ** 2, axis=1)
+
+        reduction = cost[active] - cost_new
+        improved = np.isfinite(cost_new) & (reduction > 0)
+
+        # accept improved steps and reduce damping, otherwise increase damping
+        acc = active[improved]
+        P[acc] = P_new[improved]
+        resid[acc] = resid_new[improved]
+        cost[acc] = cost_new[improved]
+        stale[acc] = True
+        lam[acc] *= 0.1
+        lam[active[~improved]] *= 10
+
+        step_small = np.linalg.norm(delta, axis=1) <= xtol * (np.linalg.norm(P_new, axis=1) + xtol)
+        cost_small = improved & (reduction <= ftol * cost_new)
+        # samples where no step reduced the cost before the damping exceeded 1e16 have stalled, and are not converged
+        stalled = ~improved & ~step_small & (lam[active] > 1e16)
+        done = cost_small | step_small | stalled
+        converged[active[done]] = (cost_small | step_small)[done]
+        active = active[~done]
+
+    return P, converged
@@ -0,0 +1,603 @@
+import datetime
+import glob
+import json
+import os
+import pickle
+import platform
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+from scipy.signal import savgol_filter
+import blitzcurve
+import blitzcurve.utils as utils
+from blitzcurve.calc import fit_curves, FitSettings, estimated_guess
+from blitzcurve.load import read_anisotropy_file, load_directory
+from blitzcurve.store import FitDataStore
+
+# default cases of run_bench: the example data has ~1200 timepoints, with moderate noise
+BENCH_CASES = [{"n_samples": 20, "n_timepoints": 1200, "noise": 0.01},
+               {"n_samples": 20, "n_timepoints": 600, "noise": 0.01},
+               {"n_samples": 20, "n_timepoints": 2400, "noise": 0.01},
+               {"n_samples": 20, "n_timepoints": 1200, "noise": 0.03},
+               {"n_samples": 100, "n_timepoints": 1200, "noise": 0.01}]
+
+def run_bench(out_json=None, cases=None, n_render=2, seed=0):
+    """Benchmark suite that times each stage of the analysis on synthetic anisotropy traces.
+
+    For each case (number of samples, trace length and noise), synthetic input files are written
+    to a temporary directory with make_synthetic_data. The following stages are then timed separately:
+        "load" = reading the input text files (blitzcurve.load.read_anisotropy_file)
+        "savgol" = Savitzky-Golay filter
+        "fit_curves" = all fits of a sample (blitzcurve.calc.fit_curves)
+        "fit_failures" = not a time, but the number of samples where fit_curves failed (in total_ms).
+            These samples are excluded from the following stages.
+        "fit_seg1", "fit_seg2", "fit_2phasedecay", "fit_anisotropy_decay" = each curve_fit, with the analytic Jacobian
+        "render" = all figures of a sample (only the first n_render samples, as this is slow)
+        "pickle_write" = saving the fitdata pickle
+        "compare_load_pickle" = loading all fitdata pickles, as in run_compare
+        "store_write" = writing the FitDataStore of all samples
+        "compare_load_store" = loading the FitDataStore and iterating over all samples, as in run_compare
+
+    Parameters
+    ----------
+    out_json : str
+        Path of a json file for the results, for comparison between releases with compare_bench_results.
+        Default is None, which does not save the results.
+    cases : list
+        List of dictionaries with n_samples, n_timepoints and noise. Default is None, which uses BENCH_CASES.
+    n_render : int
+        Number of samples in each case for which the figures are rendered. Use 0 to skip rendering.
+    seed : int
+        Seed for the random noise of the synthetic data.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per case and stage, with the total time and the mean time per sample in ms.
+
+    Usage
+    -----
+    from blitzcurve.bench import run_bench, compare_bench_results
+    run_bench(r"D:\data\bench\blitzcurve_0.0.2.json")
+    compare_bench_results(r"D:\data\bench\blitzcurve_0.0.1.json", r"D:\data\bench\blitzcurve_0.0.2.json")
+    """
+    if cases is None:
+        cases = BENCH_CASES
+    rows = []
+    for case in cases:
+        with tempfile.TemporaryDirectory() as data_dir:
+            make_synthetic_data(data_dir, seed=seed, **case)
+            for stage, n, ms in _bench_stages(data_dir, n_render):
+                rows.append(dict(case, stage=stage, n=n, total_ms=ms, ms_per_sample=ms / n))
+    df = pd.DataFrame(rows)
+    print(df.to_string())
+
+    if out_json is not None:
+        results = {"blitzcurve_version": blitzcurve.__version__,
+                   "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "numpy": np.__version__,
+                   "pandas": pd.__version__,
+                   "results": df.to_dict(orient="records")}
+        with open(out_json, "w") as f:
+            json.dump(results, f, indent=2)
+    return df
+
+def _bench_stages(data_dir, n_render):
+    """Times each stage of the analysis for the input files in data_dir. Yields (stage, n, total time in ms) tuples."""
+    settings = FitSettings()
+    csv_files = _get_input_files(data_dir)
+
+    start = time.perf_counter()
+    data_list = [read_anisotropy_file(csv) for csv in csv_files]
+    yield "load", len(csv_files), (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for data in data_list:
+        savgol_filter(data.anisotropy, settings.savgol_window, settings.savgol_order)
+    yield "savgol", len(data_list), (time.perf_counter() - start) * 1000
+
+    # all fits of each sample. Samples where a fit fails (fit_status "failed") are timed, but excluded from the following stages.
+    # the first sample is fitted once before timing, so that one-off setup costs of scipy are not included.
+    fit_curves(data_list[0].time, data_list[0].anisotropy, settings=settings)
+    fits, ok_data, ok_csv_files = [], [], []
+    start = time.perf_counter()
+    for csv, data in zip(csv_files, data_list):
+        summ_dict, fd = fit_curves(data.time, data.anisotropy, fit=data.fit, settings=settings, filename=data.filename, wres=data.wres)
+        if summ_dict["fit_status"] == "failed":
+            continue
+        fits.append((summ_dict, fd))
+        ok_data.append(data)
+        ok_csv_files.append(csv)
+    yield "fit_curves", len(data_list), (time.perf_counter() - start) * 1000
+    yield "fit_failures", len(data_list), float(len(data_list) - len(fits))
+    csv_files = ok_csv_files
+
+    # each curve_fit separately, with the data and initial guesses used in fit_curves: the guess estimated from the data,
+    # or the settings guess if it is closer to the data (see calc.estimated_guess). The time includes the estimate.
+    # a single fit that does not converge is timed, but does not abort the benchmark.
+    fit_ms = {}
+    for data in ok_data:
+        for fit_name, model, x, y, p0 in _get_fits(data.time, data.anisotropy, settings):
+            start = time.perf_counter()
+            if settings.initial_guess == "estimate":
+                p0 = estimated_guess(model, x, y, p0)
+            try:
+                with np.errstate(over="ignore", invalid="ignore"):
+                    model.curve_fit(x, y, p0=p0)
+            except (RuntimeError, ValueError):
+                pass
+            fit_ms[fit_name] = fit_ms.get(fit_name, 0) + (time.perf_counter() - start) * 1000
+    for fit_name, ms in fit_ms.items():
+        yield "fit_" + fit_name, len(ok_data), ms
+
+    if n_render > 0:
+        # matplotlib is only imported if figures are timed
+        import matplotlib.pyplot as plt
+        from blitzcurve.plot import plot_single_sample
+        utils.setup_matplotlib_dark_background(plt)
+        fc = utils.FlourescentColours()
+        start = time.perf_counter()
+        for csv, (summ_dict, fd) in zip(csv_files[:n_render], fits[:n_render]):
+            plot_single_sample(summ_dict, fd, fc, utils.FitFilePaths(data_dir, csv))
+        yield "render", min(n_render, len(fits)), (time.perf_counter() - start) * 1000
+
+    dirs = utils.OutDirPaths(data_dir)
+    pickles = [utils.FitFilePaths(data_dir, csv).fitdata_pickle for csv in csv_files]
+    start = time.perf_counter()
+    for fitdata_pickle, (summ_dict, fd) in zip(pickles, fits):
+        with open(fitdata_pickle, "wb") as pic:
+            pickle.dump(fd, pic, protocol=pickle.HIGHEST_PROTOCOL)
+    yield "pickle_write", len(fits), (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for fitdata_pickle in pickles:
+        with open(fitdata_pickle, "rb") as pic:
+            pickle.load(pic)
+    yield "compare_load_pickle", len(pickles), (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    FitDataStore.write(dirs.fitdata_store_dir, [fd for summ_dict, fd in fits])
+    yield "store_write", len(fits), (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for fd in FitDataStore(dirs.fitdata_store_dir):
+        pass
+    yield "compare_load_store", len(fits), (time.perf_counter() - start) * 1000
+
+def compare_bench_results(baseline_json, current_json, threshold=1.2):
+    """Compares two json files from run_bench, e.g. from two releases.
+
+    Parameters
+    ----------
+    baseline_json : str
+        Path of the run_bench results that are used as reference.
+    current_json : str
+        Path of the new run_bench results.
+    threshold : float
+        Stages that are slower than the baseline by more than this factor are marked as a regression.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per case and stage, with the ms_per_sample of both runs, their ratio and a regression column.
+    """
+    keys = ["n_samples", "n_timepoints", "noise", "stage"]
+    dfs = []
+    for results_json in [baseline_json, current_json]:
+        with open(results_json) as f:
+            dfs.append(pd.DataFrame(json.load(f)["results"]).set_index(keys)["ms_per_sample"])
+    df = pd.concat(dfs, axis=1, keys=["baseline_ms", "current_ms"]).dropna()
+    df["ratio"] = df["current_ms"] / df["baseline_ms"]
+    df["regression"] = df["ratio"] > threshold
+    print(df.to_string())
+    return df
+
+def make_synthetic_data(data_dir, n_samples=20, n_timepoints=1200, noise=0.01, seed=0):
+    """Writes synthetic anisotropy traces as input text files, for benchmarks and tests.
+
+    The traces resemble the example data: a fast rise to a peak of about 0.5 within the first ns,
+    followed by a two phase exponential decay towards a plateau, with noise that increases with time
+    as the fluorescence decays. The decay parameters vary between samples.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory for the input text files.
+    n_samples : int
+        Number of input text files.
+    n_timepoints : int
+        Number of timepoints in each trace, with a spacing of 0.016 ns as in the example data.
+        Should be larger than FitSettings().end_seg1.
+    noise : float
+        Standard deviation of the noise at the start of the trace. It increases 5-fold towards the end.
+    seed : int
+        Seed for the random generator.
+
+    Returns
+    -------
+    params : pd.DataFrame
+        True plateau, SpanFast, Kfast, SpanSlow and Kslow of each sample, with the filename as index.
+    """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    time_ns, anisotropy, sigma, params = _synthetic_traces(n_samples, n_timepoints, noise, seed)
+    for filename, y in zip(params.index, anisotropy):
+        df = pd.DataFrame({"time_ns": time_ns, "anisotropy": y})
+        df.to_csv(os.path.join(data_dir, filename), float_format="%.6f")
+    return params
+
+def _synthetic_traces(n_samples, n_timepoints, noise, seed):
+    """Synthetic traces of make_synthetic_data, as arrays.
+
+    Returns
+    -------
+    time_ns : np.ndarray
+        Time axis, shape (n_timepoints,).
+    anisotropy : np.ndarray
+        Traces with noise, shape (n_samples, n_timepoints).
+    sigma : np.ndarray
+        Standard deviation of the noise at each timepoint, shape (n_timepoints,).
+    params : pd.DataFrame
+        True parameters of the two phase exponential decay of each trace, with the filename as index.
+    """
+    rng = np.random.default_rng(seed)
+    time_ns = np.arange(n_timepoints) * 0.016
+    sigma = noise * (1 + 4 * time_ns / time_ns[-1])
+    rise = 1 - np.exp(-time_ns / 0.15)
+    anisotropy = np.empty((n_samples, n_timepoints))
+    params = {}
+    for i in range(n_samples):
+        # parameters in the range of the two phase exponential decay fits of the example data
+        p = {"plateau": rng.uniform(0.08, 0.15), "SpanFast": rng.uniform(0.45, 0.55), "Kfast": rng.uniform(0.9, 1.3),
+             "SpanSlow": rng.uniform(0.2, 0.32), "Kslow": rng.uniform(0.13, 0.18)}
+        anisotropy[i] = utils.two_phase_exp_decay_func(time_ns, *p.values()) * rise + rng.normal(size=n_timepoints) * sigma
+        params["synthetic_{:04d}.txt".format(i)] = p
+    return time_ns, anisotropy, sigma, pd.DataFrame(params).T
+
+def bench_jacobians(data_dir=None, n_repeats=20):
+    """Compares curve_fit with finite-difference derivatives to curve_fit with the analytic Jacobians of the models.
+
+    Each fit in fit_curves (seg1, seg2, two phase exponential decay and anisotropy decay) is repeated
+    with and without the analytic Jacobian, on the same data and initial guesses.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with input text files. Default is None, which uses the bundled example data.
+    n_repeats : int
+        Number of times each fit is repeated, to get a stable time per fit.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per sample and fit, with the number of function evaluations (nfev), Jacobian evaluations (njev)
+        and time per fit in ms, with and without the analytic Jacobian.
+        max_rel_diff_popt is the largest relative difference between the fitted parameters of the two methods.
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_jacobians
+    df = bench_jacobians()
+    """
+    rows = []
+    for csv in _get_input_files(data_dir):
+        data = read_anisotropy_file(csv)
+        for fit_name, model, x, y, p0 in _get_fits(data.time, data.anisotropy):
+            row = {"sample": os.path.basename(csv), "fit": fit_name}
+            # finite difference derivatives, as in curve_fit without jac
+            popt_fd, row["fd_nfev"], row["fd_ms"] = _time_curve_fit(n_repeats, model.func, x, y, p0)
+            # analytic Jacobian
+            popt_jac, (row["jac_nfev"], row["jac_njev"]), row["jac_ms"] = _time_curve_fit(n_repeats, model.func, x, y, p0, jac=model.jac)
+            # both methods should find the same parameters
+            row["max_rel_diff_popt"] = np.max(np.abs(popt_jac - popt_fd) / np.abs(popt_fd))
+            rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df["fd_nfev"] = df["fd_nfev"].str[0]
+    # total model evaluations, where a Jacobian evaluation is counted as one evaluation
+    df["jac_total_evals"] = df["jac_nfev"] + df["jac_njev"]
+    df["speedup"] = df["fd_ms"] / df["jac_ms"]
+    print(df.to_string())
+    return df
+
+def bench_loading(data_dir=None, n_repeats=50):
+    """Compares the pandas-based reading of input files to the NumPy reader in blitzcurve.load.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with input text files. Default is None, which uses the bundled example data.
+    n_repeats : int
+        Number of times each file or directory is loaded, to get a stable time.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per input file, plus a row for loading the whole directory into a stacked array,
+        with the time in ms for the pandas path and for blitzcurve.load.
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_loading
+    df = bench_loading()
+    """
+    csv_files = _get_input_files(data_dir)
+    rows = []
+    for csv in csv_files:
+        row = {"input": os.path.basename(csv)}
+        # previous path in fit_single_sample: full DataFrame, then two columns as arrays
+        row["pandas_ms"] = _time_function(n_repeats, lambda: _read_with_pandas(csv))
+        row["numpy_ms"] = _time_function(n_repeats, lambda: read_anisotropy_file(csv))
+        rows.append(row)
+
+    # whole directory into one stacked (n_samples, n_timepoints) array
+    row = {"input": "directory ({} files, stacked)".format(len(csv_files))}
+    row["pandas_ms"] = _time_function(n_repeats, lambda: np.vstack([_read_with_pandas(csv)[1] for csv in csv_files]))
+    row["numpy_ms"] = _time_function(n_repeats, lambda: load_directory(os.path.dirname(csv_files[0])))
+    rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df["speedup"] = df["pandas_ms"] / df["numpy_ms"]
+    print(df.to_string())
+    return df
+
+def bench_rendering(data_dir=None, n_repeats=3, out_dir=None):
+    """Compares the time to plot all figures of a sample, with new figures or with reused template figures.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with input text files. Default is None, which uses the bundled example data.
+    n_repeats : int
+        Number of times the figures of each sample are plotted.
+    out_dir : str
+        Directory for the figures. Default is None, which uses a temporary directory that is deleted afterwards.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per sample, with the time in ms to plot all figures of that sample in each render_mode.
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_rendering
+    df = bench_rendering()
+    """
+    import matplotlib.pyplot as plt
+    from blitzcurve.plot import plot_single_sample
+    utils.setup_matplotlib_dark_background(plt)
+    fc = utils.FlourescentColours()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if out_dir is None:
+            out_dir = tmp_dir
+        rows = []
+        for csv in _get_input_files(data_dir):
+            data = read_anisotropy_file(csv)
+            summ_dict, fd = fit_curves(data.time, data.anisotropy, fit=data.fit)
+            row = {"sample": os.path.basename(csv)}
+            for render_mode in ["new", "reuse"]:
+                p = utils.FitFilePaths(out_dir, csv)
+                # the first call creates the template figures, and is not timed
+                plot_single_sample(summ_dict, fd, fc, p, render_mode=render_mode)
+                row[render_mode + "_ms"] = _time_function(n_repeats, lambda: plot_single_sample(summ_dict, fd, fc, p, render_mode=render_mode))
+            rows.append(row)
+    df = pd.DataFrame(rows)
+    df["speedup"] = df["new_ms"] / df["reuse_ms"]
+    print(df.to_string())
+    return df
+
+def bench_initial_guess(data_dir=None, n_samples=20, n_timepoints=1200, noise=0.01, seed=0):
+    """Compares the evaluation counts of the fits starting from the guesses in the settings and from estimated guesses.
+
+    Each fit in fit_curves is carried out twice on the same data, with the Levenberg-Marquardt algorithm:
+        "settings" = starting from the initial guess in FitSettings (FitSettings(initial_guess="settings"))
+        "estimated" = starting from the initial guess estimated from the data (blitzcurve.estimate), as in fit_curves
+    A fit that raises an error is counted as failed, and excluded from the mean evaluation counts.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with input text files. Default is None, which uses synthetic traces from make_synthetic_data.
+    n_samples, n_timepoints, noise, seed
+        Settings of make_synthetic_data, used if data_dir is None.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per fit, with the mean number of function evaluations (nfev) and Jacobian evaluations (njev,
+        equal to the number of iterations), and the number of failed fits, for each initial guess.
+        estimate_ms is the mean time of the estimate, and estimate_used is the fraction of fits where the estimate
+        was closer to the data than the guess in the settings.
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_initial_guess
+    df = bench_initial_guess(noise=0.03)
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if data_dir is None:
+            data_dir = tmp_dir
+            make_synthetic_data(data_dir, n_samples=n_samples, n_timepoints=n_timepoints, noise=noise, seed=seed)
+        data_list = [read_anisotropy_file(csv) for csv in _get_input_files(data_dir)]
+
+    rows = []
+    for data in data_list:
+        for fit_name, model, x, y, p0 in _get_fits(data.time, data.anisotropy):
+            start = time.perf_counter()
+            p0_estimated = estimated_guess(model, x, y, p0)
+            row = {"fit": fit_name, "estimate_ms": (time.perf_counter() - start) * 1000,
+                   "estimate_used": float(not np.array_equal(p0_estimated, p0))}
+            for guess_name, guess in [("settings", p0), ("estimated", p0_estimated)]:
+                try:
+                    with np.errstate(over="ignore", invalid="ignore"):
+                        popt, pcov, infodict, mesg, ier = model.curve_fit(x, y, p0=guess, full_output=True)
+                except (RuntimeError, ValueError):
+                    row[guess_name + "_failed"] = 1
+                    continue
+                row[guess_name + "_failed"] = 0
+                row[guess_name + "_nfev"] = infodict["nfev"]
+                row[guess_name + "_njev"] = infodict["njev"]
+            rows.append(row)
+
+    df = pd.DataFrame(rows)
+    columns = ["settings_nfev", "estimated_nfev", "settings_njev", "estimated_njev", "estimate_ms", "estimate_used"]
+    df = df.groupby("fit", sort=False)[columns].mean().join(df.groupby("fit", sort=False)[["settings_failed", "estimated_failed"]].sum())
+    df.loc["all fits"] = df.mean()
+    df.loc["all fits", ["settings_failed", "estimated_failed"]] = df[["settings_failed", "estimated_failed"]].iloc[:-1].sum()
+    print(df.to_string())
+    return df
+
+def bench_weighting(n_samples=100, n_timepoints=1200, noise=0.01, seed=0):
+    """Compares unweighted and weighted fits on synthetic traces with known noise.
+
+    The synthetic traces of make_synthetic_data have noise that increases 5-fold from the start to the end of the trace.
+    Each trace is fitted with fit_curves in three ways:
+        "none" = unweighted fits (FitSettings(weighting="none"))
+        "noise" = fits weighted with the noise estimated from the data (FitSettings(weighting="noise"))
+        "true" = fits weighted with the true sigma of the synthetic noise (fit_curves(..., sigma=sigma))
+    The two phase exponential decay fit uses the same model as the synthetic traces, so its parameters
+    can be compared to the true values. r_inf of segment 2 is compared to the true plateau.
+    Medians are used, as a few noisy traces give fits with extreme parameters.
+
+    Parameters
+    ----------
+    n_samples, n_timepoints, noise, seed
+        Settings of make_synthetic_data.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        One row per weighting, with the bias (median error) and mae (median absolute error) of each parameter,
+        the mean number of function evaluations of each fit (nfev), and the mean time of fit_curves in ms.
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_weighting
+    df = bench_weighting(n_samples=200)
+    """
+    from blitzcurve.metrics import StageMetrics
+    time_ns, anisotropy, sigma, params = _synthetic_traces(n_samples, n_timepoints, noise, seed)
+    rows = {}
+    for weighting in ["none", "noise", "true"]:
+        settings = FitSettings(weighting="none" if weighting == "true" else weighting)
+        summaries, nested_metrics = [], []
+        start = time.perf_counter()
+        for y in anisotropy:
+            metrics = StageMetrics()
+            summ_dict, fd = fit_curves(time_ns, y, settings=settings, metrics=metrics, sigma=sigma if weighting == "true" else None)
+            # r_inf of the summary is replaced by the anisotropy decay fit, so r_inf of segment 2 is taken from fd
+            summaries.append(dict(summ_dict, r_inf_seg2=getattr(fd, "r_inf_seg2", np.nan)))
+            nested_metrics.append(metrics.values)
+        ms = (time.perf_counter() - start) / n_samples * 1000
+        df = pd.DataFrame(summaries, index=params.index)
+        df_metrics = pd.DataFrame(nested_metrics, index=params.index)
+        row = {}
+        for key, true_key in [("plateau", "plateau"), ("Kfast", "Kfast"), ("Kslow", "Kslow"), ("r_inf_seg2", "plateau")]:
+            error = df[key].astype(float) - params[true_key]
+            row[key + "_bias"] = error.median()
+            row[key + "_mae"] = error.abs().median()
+        for fit_name in ["seg1", "seg2", "2phasedecay", "anisotropy_decay"]:
+            row[fit_name + "_nfev"] = df_metrics[fit_name + "_nfev"].mean()
+        row["fit_curves_ms"] = ms
+        rows[weighting] = row
+    df = pd.DataFrame(rows).T
+    print(df.to_string())
+    return df
+
+def bench_peaks(n_samples=2000, n_timepoints=1200, n_repeats=3, seed=0):
+    """Compares finding r_max trace by trace with the batched Savitzky-Golay filter and peak detection of find_r_max.
+
+    "per_file" = savgol_filter and argmax for each trace separately, as in fit_curves
+    "batch" = find_r_max on the 2-D array of all traces
+    "batch_refine" = find_r_max with quadratic refinement of the peak
+
+    Parameters
+    ----------
+    n_samples, n_timepoints, seed
+        Settings of make_synthetic_data.
+    n_repeats : int
+        Number of times each method is repeated, to get a stable time.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Time in ms for all traces and per trace, for each method. max_diff_r_max_index is the
+        largest difference of r_max_index to the per_file method (should be 0).
+
+    Usage
+    -----
+    from blitzcurve.bench import bench_peaks
+    df = bench_peaks(n_samples=5000)
+    """
+    from blitzcurve.calc import find_r_max
+    settings = FitSettings()
+    with tempfile.TemporaryDirectory() as data_dir:
+        make_synthetic_data(data_dir, n_samples=n_samples, n_timepoints=n_timepoints, seed=seed)
+        data_list = [read_anisotropy_file(csv) for csv in _get_input_files(data_dir)]
+    x = data_list[0].time
+    Y = np.array([data.anisotropy for data in data_list])
+
+    def per_file():
+        return np.array([savgol_filter(y, settings.savgol_window, settings.savgol_order).argmax() for y in Y])
+
+    methods = {"per_file": per_file,
+               "batch": lambda: find_r_max(x, Y, settings.savgol_window, settings.savgol_order)[2],
+               "batch_refine": lambda: find_r_max(x, Y, settings.savgol_window, settings.savgol_order, refine=True)[2]}
+    reference = per_file()
+    rows = []
+    for method, function in methods.items():
+        ms = _time_function(n_repeats, function)
+        rows.append({"method": method, "total_ms": ms, "ms_per_trace": ms / n_samples,
+                     "max_diff_r_max_index": np.abs(function() - reference).max()})
+    df = pd.DataFrame(rows).set_index("method")
+    df["speedup"] = df.loc["per_file", "total_ms"] / df["total_ms"]
+    print(df.to_string())
+    return df
+
+def _read_with_pandas(csv):
+    df = pd.read_csv(csv)
+    return df.time_ns.values, df.anisotropy.values
+
+def _time_function(n_repeats, function):
+    """Returns the mean time in ms of n_repeats calls of a function without arguments."""
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        function()
+    return (time.perf_counter() - start) / n_repeats * 1000
+
+def _get_input_files(data_dir):
+    """Returns the input text files in data_dir, or the bundled example files if data_dir is None."""
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+    return sorted(glob.glob(os.path.join(data_dir, "*.txt")))
+
+def _get_fits(x, y, settings=None):
+    """Returns the data and initial guess from the settings for each of the curve_fit calls in fit_curves, as (name, model, x, y, p0) tuples.
+
+    fit_curves starts from the guess estimated from the data, calc.estimated_guess(model, x, y, p0), unless
+    FitSettings.initial_guess is "settings". The settings guess is returned here, so that both can be compared.
+    """
+    if settings is None:
+        settings = FitSettings()
+    summ_dict, fd = fit_curves(x, y, settings=settings)
+    r0 = summ_dict["r_max"]
+    seg1 = slice(fd.start_seg1, fd.end_seg1 + 1)
+    seg2 = slice(fd.start_seg2, None)
+    seg1_seg2 = slice(fd.start_seg1, None)
+    return [("seg1", utils.exp_model, x[seg1], y[seg1], settings.seg1_guess),
+            ("seg2", utils.exp_model, x[seg2], y[seg2], settings.seg2_guess),
+            ("2phasedecay", utils.two_phase_exp_decay_model, x[seg1_seg2], y[seg1_seg2], settings.two_phase_guess),
+            ("anisotropy_decay", utils.time_resolved_anisotropy_decay_model.fix(r0=r0), x[seg1_seg2], y[seg1_seg2], (1, 1))]
+
+def _time_curve_fit(n_repeats, func, x, y, p0, jac=None):
+    """Runs curve_fit n_repeats times, returning the fitted parameters, evaluation counts and the mean time per fit in ms."""
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        popt, pcov, infodict, mesg, ier = curve_fit(func, x, y, p0=p0, jac=jac, full_output=True)
+    ms = (time.perf_counter() - start) / n_repeats * 1000
+    counts = (infodict["nfev"], infodict.get("njev", 0))
+    return popt, counts, ms
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+
+import blitzcurve
+
+class FitCache:
+    """
+    Persistent cache of the fit results, so that unchanged input files are not fitted again by run_fit.
+
+    The cache is a json file in the fits/fitdata directory. For each input file it holds the summary dictionary
+    and a key, which is a hash of the input file contents, the fit settings, the selected figures, the render profile,
+    the decimation and render mode of the figures, and the blitzcurve version. A sample is only taken from the cache
+    if the key is unchanged. run_fit additionally checks that the fitdata of the sample still exists.
+
+    Parameters
+    ----------
+    fitdata_dir : str
+        Path to the fits/fitdata directory, e.g. utils.OutDirPaths(data_dir).fitdata_dir
+
+    Usage
+    -----
+    cache = FitCache(p.fitdata_dir)
+    key = cache.get_key(csv, settings, figs_to_plot)
+    summ_dict = cache.get(p.filename, key)
+    if summ_dict is None:
+        ...
+        cache.set(p.filename, key, summ_dict)
+    cache.save()
+    """
+    def __init__(self, fitdata_dir):
+        self.fitdata_dir = fitdata_dir
+        self.cache_json = os.path.join(fitdata_dir, "fit_cache.json")
+        self.entries = {}
+        if os.path.isfile(self.cache_json):
+            try:
+                with open(self.cache_json) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # a corrupted cache is simply ignored, and all samples are fitted again
+                self.entries = {}
+
+    def get_key(self, csv, settings, figs_to_plot, render_profile="standard", decimate="minmax", render_mode="new"):
+        """Returns the cache key for an input file, as a sha256 hex digest.
+
+        render_profile, decimate and render_mode are the name of the render profile, the decimation method and the
+        render mode of run_fit, which change the saved figures.
+        """
+        h = hashlib.sha256()
+        with open(csv, "rb") as f:
+            h.update(f.read())
+        run_settings = {"settings": settings.as_dict(), "figs_to_plot": figs_to_plot, "version": blitzcurve.__version__}
+        # samples are replotted if the format, resolution or drawing of the figures changes. The defaults keep existing keys valid.
+        if render_profile != "standard":
+            run_settings["render_profile"] = render_profile
+        if decimate != "minmax":
+            run_settings["decimate"] = decimate
+        if render_mode != "new":
+            run_settings["render_mode"] = render_mode
+        h.update(json.dumps(run_settings, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, filename, key):
+        """Returns the cached summary dictionary for that sample, or None if it needs to be fitted."""
+        entry = self.entries.get(filename)
+        if entry is None or entry["key"] != key:
+            return None
+        return entry["summ_dict"]
+
+    def set(self, filename, key, summ_dict):
+        """Adds the summary dictionary of a freshly fitted sample to the cache."""
+        # convert numpy scalars to python types for json
+        summ_dict = {k: v.item() if hasattr(v, "item") else v for k, v in summ_dict.items()}
+        self.entries[filename] = {"key": key, "summ_dict": summ_dict}
+
+    def save(self):
+        """Writes the cache to the json file."""
+        tmp = self.cache_json + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.cache_json)
@@ -0,0 +1,715 @@
+import numpy as np
+from scipy.signal import savgol_filter
+import blitzcurve.utils as utils
+from blitzcurve.metrics import timed
+from blitzcurve.uncertainty import standard_errors, bootstrap_confidence_intervals
+from blitzcurve.weights import trace_sigma
+
+# tolerance for rounding errors when comparing times in ns
+_TIME_TOLERANCE_NS = 1e-6
+
+def fit_curves(time, anisotropy, fit=None, settings=None, filename=None, metrics=None, wres=None, sigma=None):
+    """Fits all curves to the anisotropy data of a single sample, without any plotting.
+
+    This is the pure numeric part of fit_single_sample. It does not use matplotlib,
+    and can be used to obtain r_max, r_inf, a_seg1, Kfast etc. directly from arrays.
+    The returned objects can be plotted afterwards with blitzcurve.plot.plot_single_sample.
+
+    The analysis consists of the stages in STAGES (see register_stage), which are run in order.
+    Only the stages in settings.stages and the stages they require are run. The summary values
+    of the other stages are NaN, so that the columns of the summary are always the same.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Time in nanoseconds (time_ns column of the input file).
+    anisotropy : np.ndarray
+        Anisotropy for each timepoint (anisotropy column of the input file).
+    fit : np.ndarray
+        Optional rotational correlation fit from the original input file (fit column).
+    settings : FitSettings
+        Settings for the fits. Default is None, which uses FitSettings().
+    filename : str
+        Optional sample filename, stored in the output fit data object.
+    metrics : metrics.StageMetrics
+        Optional object that records the wall time of each fit, and the evaluation counts of curve_fit.
+    wres : np.ndarray
+        Optional weighted residuals of the fit in the original input file (wres column).
+        Used to weight the fits if settings.weighting is "wres".
+    sigma : np.ndarray
+        Optional standard deviation of the noise of each datapoint, e.g. from photon counts.
+        If given, all fits are weighted by 1 / sigma ** 2, and settings.weighting is ignored.
+
+    Returns
+    -------
+    summ_dict : dict
+        Dictionary with summary data for that single sample.
+    fd : OutputFitData
+        Output fit data object, with the fitted curves.
+
+    Usage
+    -----
+    from blitzcurve.calc import fit_curves
+    summ_dict, fd = fit_curves(time, anisotropy)
+    print(summ_dict["r_max"], summ_dict["r_inf"])
+    # only the fits needed for r_inf from the anisotropy decay
+    summ_dict, fd = fit_curves(time, anisotropy, settings=FitSettings(stages=["anisotropy_decay"]))
+    """
+    if settings is None:
+        settings = FitSettings()
+    state = FitState(time, anisotropy, fit, settings, filename, metrics, wres, sigma)
+    enabled = resolve_stages(settings.stages)
+
+    # the summary contains the values of all stages, in the order of the stages, and NaN for stages that are not run
+    for stage in STAGES.values():
+        for key in stage.outputs:
+            state.summ_dict[key] = np.nan
+    for name, stage in STAGES.items():
+        if name in enabled:
+            stage.compute(state)
+
+    # overall status, and the strategy or error message of each fit that did not succeed at the first attempt
+    fit_status = state.fit_status
+    summ_dict = state.summ_dict
+    if not all(_fit_succeeded(status) for status in fit_status.values()):
+        summ_dict["fit_status"] = "failed"
+    elif any(status != "ok" for status in fit_status.values()):
+        summ_dict["fit_status"] = "fallback"
+    else:
+        summ_dict["fit_status"] = "ok"
+    summ_dict["fit_message"] = "; ".join("{}: {}".format(name, status) for name, status in fit_status.items() if status != "ok")
+
+    return summ_dict, state.fd
+
+class FitState:
+    """
+    Data of a single sample that is passed from stage to stage in fit_curves.
+
+    Attributes
+    ----------
+    x, y : np.ndarray
+        Time and anisotropy of the sample.
+    wres : np.ndarray
+        Weighted residuals from the input file, or None.
+    sigma : np.ndarray
+        Noise of each datapoint, used to weight all fits. Either given to fit_curves, or calculated
+        by the weights stage (see weights.trace_sigma). None for unweighted fits.
+    settings : FitSettings
+        Settings for the fits.
+    metrics : metrics.StageMetrics
+        Optional object that records the wall time of each stage. None if not recorded.
+    summ_dict : dict
+        Summary data, filled in by the stages.
+    fd : OutputFitData
+        Output fit data object, filled in by the stages.
+    fit_status : dict
+        "ok", the fallback strategy used for each fit (e.g. "bounded"), or the error messages if the fit failed.
+    two_phase_fit : tuple
+        (popt, pcov, status) of the two phase exponential decay fit, if it has already been carried out.
+    """
+    def __init__(self, time, anisotropy, fit=None, settings=None, filename=None, metrics=None, wres=None, sigma=None):
+        self.x = np.asarray(time, dtype=float)
+        self.y = np.asarray(anisotropy, dtype=float)
+        self.wres = None if wres is None else np.asarray(wres, dtype=float)
+        self.sigma = None if sigma is None else np.asarray(sigma, dtype=float)
+        self.settings = FitSettings() if settings is None else settings
+        self.metrics = metrics
+        self.summ_dict = {}
+        self.fit_status = {}
+        self.two_phase_fit = None
+        # initialise fit-data-object to hold fitted curves, and add filename and raw data
+        self.fd = OutputFitData()
+        self.fd.filename = filename
+        self.fd.time = self.x
+        self.fd.anisotropy = self.y
+        self.fd.rotat_fit = None if fit is None else np.asarray(fit, dtype=float)
+
+    def sigma_of(self, start, stop=None):
+        """Noise of the datapoints of a segment, or None for unweighted fits."""
+        return None if self.sigma is None else self.sigma[start:stop]
+
+class Stage:
+    """
+    A single stage of the analysis in fit_curves, e.g. the exponential fit to segment 1.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage. Stages that produce a figure use the same name in figs_to_plot.
+    compute : function
+        compute(state) carries out the stage for a FitState, and adds the results to state.summ_dict and state.fd.
+        None for stages that only plot data of the input file.
+    requires : list
+        Names of the stages whose results are needed by this stage, e.g. ["savgol"] for stages that use r_max.
+    outputs : list
+        Keys of the summary dictionary that are set by this stage.
+    """
+    def __init__(self, name, compute=None, requires=(), outputs=()):
+        self.name = name
+        self._compute = compute
+        self.requires = list(requires)
+        self.outputs = list(outputs)
+
+    def compute(self, state):
+        if self._compute is not None:
+            self._compute(state)
+
+# registry of the stages of fit_curves, in the order that they are run
+STAGES = {}
+
+def register_stage(name, requires=(), outputs=()):
+    """Decorator that adds a function compute(state) to STAGES. Stages are run in the order of registration.
+
+    Usage
+    -----
+    @register_stage("seg3", requires=["segments"], outputs=["a_seg3"])
+    def _fit_seg3(state):
+        state.summ_dict["a_seg3"] = ...
+    """
+    for required in requires:
+        if required not in STAGES:
+            raise ValueError("stage '{}' requires '{}', which has not been registered".format(name, required))
+
+    def decorator(compute):
+        STAGES[name] = Stage(name, compute, requires, outputs)
+        return compute
+    return decorator
+
+def resolve_stages(stages="all"):
+    """Returns the set of names of the selected stages, and all stages that they require.
+
+    Parameters
+    ----------
+    stages : str, list
+        "all", or a list of stage names (see STAGES).
+    """
+    if stages == "all" or stages is None:
+        return set(STAGES)
+    if isinstance(stages, str):
+        stages = [stages]
+    enabled = set()
+    to_check = list(stages)
+    while to_check:
+        name = to_check.pop()
+        if name not in STAGES:
+            raise ValueError("unknown stage '{}'. Available stages: {}".format(name, ", ".join(STAGES)))
+        if name not in enabled:
+            enabled.add(name)
+            to_check.extend(STAGES[name].requires)
+    return enabled
+
+#########################################################################
+#                 stages of fit_curves, in order                         #
+#########################################################################
+
+# rotation fit from the original input file, which is only plotted
+STAGES["rotat"] = Stage("rotat")
+
+@register_stage("savgol", outputs=["r_max", "r_max_index", "r_max_time"])
+def _savgol_stage(state):
+    """Savitzky-Golay fit, and r_max (the peak of the Savitzky-Golay fit)."""
+    settings = state.settings
+    # get fit using window of 51 residues, and polynomial degrees of 3
+    with timed(state.metrics, "savgol"):
+        y_fit_savgol, r_max, r_max_index, r_max_time = find_r_max(state.x, state.y, settings.savgol_window, settings.savgol_order, settings.refine_peak)
+    # save fit datapoints to output object
+    state.fd.y_fit_savgol = y_fit_savgol
+    state.summ_dict["r_max"] = r_max
+    state.summ_dict["r_max_index"] = r_max_index
+    state.summ_dict["r_max_time"] = r_max_time
+
+@register_stage("weights", requires=["savgol"])
+def _weights_stage(state):
+    """Noise of each datapoint, calculated once and used to weight all fits (see FitSettings.weighting)."""
+    settings = state.settings
+    if state.sigma is not None:
+        # sigma was given to fit_curves
+        return
+    with timed(state.metrics, "weights"):
+        state.sigma = trace_sigma(state.y, settings.weighting, state.fd.y_fit_savgol, state.fd.rotat_fit, state.wres, settings.noise_window)
+
+@register_stage("segments", requires=["savgol", "weights"], outputs=["start_seg1_time", "end_seg1_time"])
+def _segments_stage(state):
+    """Start and end of segment 1 and segment 2, as indices or times depending on settings.segment_mode."""
+    x, y, settings, fd = state.x, state.y, state.settings, state.fd
+    start_seg1 = int(find_start_seg1(x, state.summ_dict["r_max_index"], settings))
+    if settings.segment_mode == "auto":
+        # the boundary between the segments is derived from the two phase exponential decay, which is therefore fitted first
+        state.two_phase_fit = robust_curve_fit(utils.two_phase_exp_decay_model, x[start_seg1:], y[start_seg1:], settings.two_phase_guess, "2phasedecay", settings,
+                                                state.metrics, state.sigma_of(start_seg1))
+    end_seg1 = int(find_end_seg1(x, start_seg1, settings, None if state.two_phase_fit is None else state.two_phase_fit[0]))
+    start_seg2 = end_seg1
+    fd.start_seg1, fd.end_seg1, fd.start_seg2 = start_seg1, end_seg1, start_seg2
+    state.summ_dict["start_seg1_time"] = x[start_seg1] if start_seg1 < x.size else np.nan
+    state.summ_dict["end_seg1_time"] = x[end_seg1] if end_seg1 < x.size else np.nan
+
+@register_stage("seg1", requires=["segments"], outputs=["a_seg1", "b_seg1", "c_seg1", "a_seg1_se", "b_seg1_se", "c_seg1_se"])
+def _seg1_stage(state):
+    """Exponential fit to segment 1."""
+    x, fd = state.x, state.fd
+    # get x (time) and y (anisotropy) for only this segment. The end index is included.
+    x_seg = x[fd.start_seg1:fd.end_seg1 + 1]
+    y_seg = state.y[fd.start_seg1:fd.end_seg1 + 1]
+    sigma_seg = state.sigma_of(fd.start_seg1, fd.end_seg1 + 1)
+
+    # fit to exponential. Extract a, b and c from fitted exponential formula.
+    popt, pcov, state.fit_status["seg1"] = robust_curve_fit(utils.exp_model, x_seg, y_seg, state.settings.seg1_guess, "seg1", state.settings, state.metrics, sigma_seg)
+    state.summ_dict["a_seg1"], state.summ_dict["b_seg1"], state.summ_dict["c_seg1"] = popt
+    _add_uncertainties(state, ["a_seg1", "b_seg1", "c_seg1"], utils.exp_model, x_seg, y_seg, popt, pcov, sigma_seg)
+
+    # exponential curve from time 0 to the end of segment 1
+    if _fit_succeeded(state.fit_status["seg1"]):
+        fd.seg1_xfit = np.linspace(0, x[fd.end_seg1], 500)
+        fd.seg1_yfit = utils.exp_func(fd.seg1_xfit, *popt)
+
+@register_stage("seg2", requires=["segments"], outputs=["a_seg2", "b_seg2", "r_inf", "a_seg2_se", "b_seg2_se", "r_inf_se"])
+def _seg2_stage(state):
+    """Exponential fit to segment 2."""
+    fd = state.fd
+    x_seg = state.x[fd.start_seg2:]
+    y_seg = state.y[fd.start_seg2:]
+    sigma_seg = state.sigma_of(fd.start_seg2)
+
+    popt, pcov, state.fit_status["seg2"] = robust_curve_fit(utils.exp_model, x_seg, y_seg, state.settings.seg2_guess, "seg2", state.settings, state.metrics, sigma_seg)
+    state.summ_dict["a_seg2"], state.summ_dict["b_seg2"], state.summ_dict["r_inf"] = popt
+    _add_uncertainties(state, ["a_seg2", "b_seg2", "r_inf"], utils.exp_model, x_seg, y_seg, popt, pcov, sigma_seg)
+
+    if _fit_succeeded(state.fit_status["seg2"]):
+        # keep r_inf from segment 2 for plotting, as the summary r_inf is replaced by the anisotropy decay fit
+        fd.r_inf_seg2 = popt[2]
+        # exponential curve from time 0 to 3 ns after the last datapoint
+        fd.seg2_xfit = np.linspace(0, x_seg.max() + 3, 500)
+        fd.seg2_yfit = utils.exp_func(fd.seg2_xfit, *popt)
+
+@register_stage("2phasedecay", requires=["segments"], outputs=["plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow",
+                                                             "plateau_se", "SpanFast_se", "Kfast_se", "SpanSlow_se", "Kslow_se"])
+def _two_phase_exp_decay_stage(state):
+    """2-phase exponential decay fit to segments 1 & 2."""
+    fd = state.fd
+    x_seg = state.x[fd.start_seg1:]
+    y_seg = state.y[fd.start_seg1:]
+    sigma_seg = state.sigma_of(fd.start_seg1)
+
+    # guess = (plateau, SpanFast, Kfast, SpanSlow, Kslow)
+    if state.two_phase_fit is None:
+        state.two_phase_fit = robust_curve_fit(utils.two_phase_exp_decay_model, x_seg, y_seg, state.settings.two_phase_guess, "2phasedecay", state.settings,
+                                                state.metrics, sigma_seg)
+    popt, pcov, state.fit_status["2phasedecay"] = state.two_phase_fit
+    state.summ_dict["plateau"], state.summ_dict["SpanFast"], state.summ_dict["Kfast"], state.summ_dict["SpanSlow"], state.summ_dict["Kslow"] = popt
+    _add_uncertainties(state, ["plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow"], utils.two_phase_exp_decay_model, x_seg, y_seg, popt, pcov, sigma_seg)
+
+    if _fit_succeeded(state.fit_status["2phasedecay"]):
+        fd.tped_xfit = np.linspace(0, x_seg.max() + 3, 500)
+        fd.tped_yfit = utils.two_phase_exp_decay_func(fd.tped_xfit, *popt)
+
+@register_stage("anisotropy_decay", requires=["savgol", "segments"], outputs=["r_inf", "transfer_rate", "r_inf_se", "transfer_rate_se"])
+def _time_resolved_anisotropy_decay_stage(state):
+    """Time resolved anisotropy decay fit for slowly rotating dyes."""
+    fd = state.fd
+    # uses the same data as the 2-phase exponential decay fit
+    x_seg = state.x[fd.start_seg1:]
+    y_seg = state.y[fd.start_seg1:]
+    sigma_seg = state.sigma_of(fd.start_seg1)
+    # r0 is fixed to r_max. Note that r_inf from this fit replaces r_inf from segment 2 in the summary.
+    r0 = state.summ_dict["r_max"]
+    model = utils.time_resolved_anisotropy_decay_model.fix(r0=r0)
+    popt, pcov, state.fit_status["anisotropy_decay"] = robust_curve_fit(model, x_seg, y_seg, (1, 1), "anisotropy_decay", state.settings, state.metrics, sigma_seg)
+    state.summ_dict["r_inf"], state.summ_dict["transfer_rate"] = popt
+    _add_uncertainties(state, ["r_inf", "transfer_rate"], model, x_seg, y_seg, popt, pcov, sigma_seg)
+
+    if _fit_succeeded(state.fit_status["anisotropy_decay"]):
+        fd.trad_xfit = np.linspace(0, x_seg.max() + 3, 500)
+        fd.trad_yfit = utils.time_resolved_anisotropy_decay_func(fd.trad_xfit, r0, *popt)
+
+def _add_uncertainties(state, keys, model, x, y, popt, pcov, sigma=None):
+    """Adds the standard errors ("<key>_se") of fitted parameters to the summary, and the bootstrap confidence
+    intervals ("<key>_ci_low" and "<key>_ci_high") if settings.bootstrap_resamples is larger than 0.
+    sigma is the noise of each datapoint of a weighted fit, or None."""
+    settings = state.settings
+    for key, se in zip(keys, standard_errors(pcov)):
+        state.summ_dict[key + "_se"] = se
+    if settings.bootstrap_resamples > 0:
+        with timed(state.metrics, "bootstrap"):
+            ci_low, ci_high = bootstrap_confidence_intervals(model, x, y, popt, settings.bootstrap_resamples, settings.confidence, settings.bootstrap_seed, sigma)
+        for key, low, high in zip(keys, ci_low, ci_high):
+            state.summ_dict[key + "_ci_low"] = low
+            state.summ_dict[key + "_ci_high"] = high
+
+def find_r_max(time, anisotropy, window=51, order=3, refine=False):
+    """Smooths one or many anisotropy traces with a Savitzky-Golay filter, and finds the peak (r_max) of each trace.
+
+    The filter runs along the last axis, so a 2-D array of traces with the same time axis is smoothed in a single call.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Time in nanoseconds, shape (n_timepoints,).
+    anisotropy : np.ndarray
+        Anisotropy of one trace, shape (n_timepoints,), or of many traces, shape (n_samples, n_timepoints).
+    window : int
+        Window length (number of datapoints) of the Savitzky-Golay filter.
+    order : int
+        Order of the polynomial used in the Savitzky-Golay filter.
+    refine : bool
+        If True, r_max and r_max_time are refined between the datapoints, by the vertex of a parabola
+        through the smoothed peak and its two neighbours. r_max_index is always the index of the highest datapoint.
+
+    Returns
+    -------
+    y_fit_savgol : np.ndarray
+        Smoothed anisotropy, same shape as anisotropy.
+    r_max, r_max_index, r_max_time : float or np.ndarray
+        Peak anisotropy, index and time of each trace. Arrays of shape (n_samples,) for 2-D input.
+
+    Usage
+    -----
+    from blitzcurve.calc import find_r_max
+    y_fit_savgol, r_max, r_max_index, r_max_time = find_r_max(time, anisotropy_2d, refine=True)
+    """
+    x = np.asarray(time, dtype=float)
+    y_fit_savgol = savgol_filter(anisotropy, window, order, axis=-1)
+    r_max_index = y_fit_savgol.argmax(axis=-1)
+    r_max = np.take_along_axis(y_fit_savgol, np.expand_dims(r_max_index, -1), axis=-1)[..., 0]
+    r_max_time = x[r_max_index]
+    if refine:
+        # neighbours of the peak. At the first or last datapoint, the peak is not refined.
+        inner = (r_max_index > 0) & (r_max_index < x.size - 1)
+        left = np.take_along_axis(y_fit_savgol, np.expand_dims(np.maximum(r_max_index - 1, 0), -1), axis=-1)[..., 0]
+        right = np.take_along_axis(y_fit_savgol, np.expand_dims(np.minimum(r_max_index + 1, x.size - 1), -1), axis=-1)[..., 0]
+        curvature = left - 2 * r_max + right
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # offset of the vertex from the peak, in datapoints (between -0.5 and 0.5)
+            offset = np.where(inner & (curvature < 0), 0.5 * (left - right) / curvature, 0.0)
+        r_max = r_max - 0.25 * (left - right) * offset
+        step = (x[np.minimum(r_max_index + 1, x.size - 1)] - x[np.maximum(r_max_index - 1, 0)]) / 2
+        r_max_time = r_max_time + offset * step
+    if y_fit_savgol.ndim == 1:
+        return y_fit_savgol, r_max.item(), int(r_max_index), r_max_time.item()
+    return y_fit_savgol, r_max, r_max_index, r_max_time
+
+def find_start_seg1(x, r_max_index, settings):
+    """Index of the first datapoint of segment 1, for one sample or an array of samples.
+
+    For settings.segment_mode "index", segment 1 starts settings.datapoints_after_peak datapoints after r_max.
+    For "time" and "auto", it starts at the first datapoint that is at least settings.seg1_delay_ns after r_max,
+    which does not depend on the time resolution of the instrument.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Time in nanoseconds, shared by all samples.
+    r_max_index : int or np.ndarray
+        Index of r_max of each sample.
+    settings : FitSettings
+        Settings for the fits.
+
+    Returns
+    -------
+    start_seg1 : int or np.ndarray
+        Index of the start of segment 1, with the same shape as r_max_index.
+    """
+    r_max_index = np.asarray(r_max_index)
+    if settings.segment_mode == "index":
+        return r_max_index + settings.datapoints_after_peak
+    # the tolerance avoids skipping a datapoint due to rounding errors in the time axis
+    return np.searchsorted(x, x[r_max_index] + settings.seg1_delay_ns - _TIME_TOLERANCE_NS)
+
+def find_end_seg1(x, start_seg1, settings, two_phase_popt=None):
+    """Index of the last datapoint of segment 1 (which is also the first datapoint of segment 2), for one or more samples.
+
+    For settings.segment_mode "index", this is settings.end_seg1.
+    For "time", it is the last datapoint at or before settings.end_seg1_ns.
+    For "auto", the boundary is the time where the fast component of the two phase exponential decay has decayed
+    to settings.auto_fast_fraction of the slow component, i.e. where
+        SpanFast * exp(-Kfast * t) = auto_fast_fraction * SpanSlow * exp(-Kslow * t)
+    so that segment 1 contains the fast decay, and segment 2 is dominated by the slow decay.
+    Both segments are at least settings.min_segment_ns long. If the two phase decay fit failed, or does not
+    contain a fast and a slow component, settings.end_seg1_ns is used as in "time".
+    This only needs the parameters of the two phase decay fit, which is carried out anyway, so the search adds no fits.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Time in nanoseconds, shared by all samples.
+    start_seg1 : int or np.ndarray
+        Index of the start of segment 1 of each sample, from find_start_seg1.
+    settings : FitSettings
+        Settings for the fits.
+    two_phase_popt : np.ndarray
+        Fitted (plateau, SpanFast, Kfast, SpanSlow, Kslow), shape (5,) or (n_samples, 5). Only used for "auto".
+
+    Returns
+    -------
+    end_seg1 : int or np.ndarray
+        Index of the end of segment 1, with the same shape as start_seg1.
+    """
+    start_seg1 = np.asarray(start_seg1)
+    if settings.segment_mode == "index":
+        return np.full_like(start_seg1, settings.end_seg1)
+    end_time = np.full(start_seg1.shape, float(settings.end_seg1_ns))
+    if settings.segment_mode == "auto" and two_phase_popt is not None:
+        P = np.asarray(two_phase_popt, dtype=float).reshape(start_seg1.shape + (5,))
+        # the fitted components can be in either order
+        swap = P[..., 2] < P[..., 4]
+        SpanFast, Kfast = np.where(swap, P[..., 3], P[..., 1]), np.where(swap, P[..., 4], P[..., 2])
+        SpanSlow, Kslow = np.where(swap, P[..., 1], P[..., 3]), np.where(swap, P[..., 2], P[..., 4])
+        with np.errstate(all="ignore"):
+            boundary = np.log(SpanFast / (settings.auto_fast_fraction * SpanSlow)) / (Kfast - Kslow)
+        valid = (SpanFast > 0) & (SpanSlow > 0) & (Kfast > Kslow) & np.isfinite(boundary)
+        end_time = np.where(valid, boundary, end_time)
+        # keep a minimum length of both segments
+        end_time = np.clip(end_time, x[np.minimum(start_seg1, x.size - 1)] + settings.min_segment_ns, x[-1] - settings.min_segment_ns)
+    return np.searchsorted(x, end_time + _TIME_TOLERANCE_NS, side="right") - 1
+
+def robust_curve_fit(model, x, y, p0, name, settings, metrics=None, sigma=None):
+    """Fits a model with curve_fit, and retries with other strategies if the fit fails.
+
+    The strategies are tried in this order, until one succeeds:
+        "estimated" = Levenberg-Marquardt, starting from the initial guess estimated from the data by model.estimate
+                      (see blitzcurve.estimate), or from p0 if that is closer to the data
+        "settings" = Levenberg-Marquardt, starting from p0
+        "bounded" = trust region reflective fit within model.bounds, with at most settings.max_nfev evaluations
+    If settings.initial_guess is "settings", the "estimated" strategy is skipped.
+    A fit fails if curve_fit raises an error, or gives parameters that are not finite.
+    If settings.fallback is False, only the first strategy is used.
+
+    Parameters
+    ----------
+    model : utils.FitModel
+        Model to fit.
+    x, y : np.ndarray
+        Data to fit.
+    p0 : tuple
+        Initial guess from the settings, e.g. settings.seg1_guess.
+    name : str
+        Name of the fit, e.g. "seg1".
+    settings : FitSettings
+        Settings for the fits.
+    metrics : metrics.StageMetrics
+        Optional object that records the wall time, evaluation counts and number of attempts of the fit.
+    sigma : np.ndarray
+        Noise of each datapoint, for a weighted fit (see weights.trace_sigma). Default is None, for an unweighted fit.
+
+    Returns
+    -------
+    popt : np.ndarray
+        Fitted parameters. All NaN if every strategy failed.
+    pcov : np.ndarray
+        Covariance of the fitted parameters. All NaN if every strategy failed.
+    status : str
+        Strategy of the successful fit (e.g. "estimated"), or "failed: " followed by the error of each strategy.
+    """
+    strategies = ["estimated", "settings", "bounded"] if settings.initial_guess == "estimate" else ["settings", "bounded"]
+    if not settings.fallback:
+        strategies = strategies[:1]
+    errors = []
+    with timed(metrics, "fit_" + name):
+        p0_estimated = estimated_guess(model, x, y, p0, sigma)
+        for attempt, strategy in enumerate(strategies, start=1):
+            try:
+                kwargs = {}
+                start = p0
+                if strategy == "estimated":
+                    start = p0_estimated
+                elif strategy == "bounded":
+                    # the initial guess of a bounded fit has to lie within the bounds
+                    start = np.clip(p0_estimated, *model.bounds)
+                    kwargs = {"method": "trf", "bounds": model.bounds, "max_nfev": settings.max_nfev}
+                with np.errstate(over="ignore", invalid="ignore"):
+                    popt, pcov, infodict, mesg, ier = model.curve_fit(x, y, p0=start, sigma=sigma, full_output=True, **kwargs)
+            except (RuntimeError, ValueError, TypeError, IndexError, np.linalg.LinAlgError) as e:
+                # e.g. "Optimal parameters not found", or too few datapoints in the segment
+                errors.append("{} ({})".format(strategy, e))
+                continue
+            if not np.all(np.isfinite(popt)):
+                errors.append("{} (parameters not finite)".format(strategy))
+                continue
+            if metrics is not None:
+                metrics.record_fit(name, infodict)
+                metrics.values[name + "_attempts"] = attempt
+            if attempt == 1:
+                # the first strategy is the normal fit, rather than a fallback
+                strategy = "ok"
+            return popt, pcov, strategy
+
+    if metrics is not None:
+        metrics.values[name + "_attempts"] = len(strategies)
+    n_params = len(model.param_names)
+    return np.full(n_params, np.nan), np.full((n_params, n_params), np.nan), "failed: " + ", ".join(errors)
+
+def _fit_succeeded(status):
+    return not status.startswith("failed")
+
+def estimated_guess(model, x, y, p0, sigma=None):
+    """Initial guess estimated from the data, or p0 if the estimate failed or is further from the data than p0.
+
+    This is the initial guess of the fits in fit_curves (the "estimated" strategy of robust_curve_fit).
+    The comparison of the sum of squared residuals costs two model evaluations, which is much less than the
+    iterations saved by starting from the better guess.
+
+    Parameters
+    ----------
+    model : utils.FitModel
+        Model to fit, with an estimator (see blitzcurve.estimate).
+    x, y : np.ndarray
+        Data to fit.
+    p0 : tuple
+        Initial guess from the settings, e.g. settings.seg1_guess.
+    sigma : np.ndarray
+        Noise of each datapoint. For weighted fits, the distance to the data is weighted by 1 / sigma ** 2.
+        Default is None, for an unweighted fit.
+
+    Returns
+    -------
+    p0 : np.ndarray
+        Initial guess of the fit.
+    """
+    estimated = model.estimate(x, y)
+    if estimated is None:
+        return np.asarray(p0, dtype=float)
+    weights = 1 if sigma is None else sigma ** -2
+    with np.errstate(all="ignore"):
+        sse_estimated = np.sum(weights * (model(x, *estimated) - y) ** 2)
+        sse_p0 = np.sum(weights * (model(x, *p0) - y) ** 2)
+    # a NaN sse is never smaller, so p0 is kept
+    return estimated if sse_estimated < sse_p0 else np.asarray(p0, dtype=float)
+
+
+class FitSettings:
+    """
+    Settings for the fits in fit_curves.
+
+    Parameters
+    ----------
+    savgol_window : int
+        Window length (number of datapoints) of the Savitzky-Golay filter.
+    savgol_order : int
+        Order of the polynomial used in the Savitzky-Golay filter.
+    refine_peak : bool
+        If True, r_max and r_max_time are refined between the datapoints by quadratic interpolation (see find_r_max).
+    datapoints_after_peak : int
+        Segment 1 starts this many datapoints after r_max. Used if segment_mode is "index".
+    end_seg1 : int
+        Index of the last datapoint of segment 1, which is also the first datapoint of segment 2.
+        Used if segment_mode is "index".
+    seg1_guess : tuple
+        Initial guess (a, b, c) for the exponential fit to segment 1.
+    seg2_guess : tuple
+        Initial guess (a, b, c) for the exponential fit to segment 2.
+    two_phase_guess : tuple
+        Initial guess (plateau, SpanFast, Kfast, SpanSlow, Kslow) for the two phase exponential decay fit.
+    initial_guess : str
+        "estimate" (default) starts each fit from parameters estimated from the data without iteration
+        (see blitzcurve.estimate), or from the guess in the settings if that is closer to the data.
+        "settings" always starts from the guesses in the settings.
+    fallback : bool
+        If True, fits that fail are retried from the guess in the settings, and then with bounded parameters.
+        Fits that still fail give NaN parameters, and are reported in the fit_status and fit_message of the summary.
+    max_nfev : int
+        Maximum number of function evaluations of the bounded fallback fit.
+    segment_mode : str
+        How the segments are defined (see find_start_seg1 and find_end_seg1). The chosen boundaries are
+        given as start_seg1_time and end_seg1_time in the summary.
+        "index" (default) uses datapoints_after_peak and end_seg1, which depend on the time resolution of the instrument.
+        "time" uses seg1_delay_ns and end_seg1_ns.
+        "auto" starts segment 1 seg1_delay_ns after r_max, and ends it where the fast component
+        of the two phase exponential decay has decayed (see auto_fast_fraction).
+    seg1_delay_ns : float
+        Segment 1 starts this many ns after r_max. Used if segment_mode is "time" or "auto".
+    end_seg1_ns : float
+        Time in ns of the end of segment 1. Used if segment_mode is "time", and if the automatic search fails.
+    auto_fast_fraction : float
+        For segment_mode "auto", segment 1 ends where the fast component has decayed to this fraction of the slow component.
+    min_segment_ns : float
+        For segment_mode "auto", minimum length of each segment in ns.
+    weighting : str
+        Weighting of the datapoints in all fits, by 1 / sigma ** 2 (see weights.trace_sigma). sigma is calculated
+        once per sample, and used by every fit.
+        "none" (default) gives unweighted fits.
+        "noise" estimates sigma from the residuals of the Savitzky-Golay fit, which follows the increase
+        of the noise as the fluorescence decays.
+        "wres" derives sigma from the fit and wres columns of the input file.
+    noise_window : int
+        Number of datapoints over which the noise is averaged, for weighting "noise" or "wres".
+    bootstrap_resamples : int
+        Number of resamples for residual bootstrap confidence intervals of the fitted parameters
+        (see uncertainty.bootstrap_confidence_intervals). Default is 0, which only gives the standard errors
+        from the covariance matrix of each fit.
+    confidence : float
+        Confidence level of the bootstrap confidence intervals.
+    bootstrap_seed : int
+        Seed of the random number generator of the bootstrap, so that the intervals are reproducible.
+    stages : str, list
+        Stages of the analysis that are run (see STAGES), e.g. ["seg1", "anisotropy_decay"].
+        Stages required by the selected stages are also run. Default is "all".
+        This is independent of figs_to_plot in run_fit. Figures of stages that are not run are skipped.
+    """
+    def __init__(self, savgol_window=51, savgol_order=3, refine_peak=False, datapoints_after_peak=40, end_seg1=300,
+                 seg1_guess=(0.7, 0.7, 0.2), seg2_guess=(0.4, 0.2, 0.2), two_phase_guess=(0.1, 0.72, 0.65, 0.42, 0.15),
+                 initial_guess="estimate", fallback=True, max_nfev=1000,
+                 segment_mode="index", seg1_delay_ns=0.64, end_seg1_ns=4.8, auto_fast_fraction=0.05, min_segment_ns=1.0,
+                 bootstrap_resamples=0, confidence=0.95, bootstrap_seed=0, stages="all", weighting="none", noise_window=101):
+        self.savgol_window = savgol_window
+        self.savgol_order = savgol_order
+        self.refine_peak = refine_peak
+        self.datapoints_after_peak = datapoints_after_peak
+        self.end_seg1 = end_seg1
+        self.seg1_guess = seg1_guess
+        self.seg2_guess = seg2_guess
+        self.two_phase_guess = two_phase_guess
+        if initial_guess not in ("estimate", "settings"):
+            raise ValueError("initial_guess should be 'estimate' or 'settings', not '{}'".format(initial_guess))
+        self.initial_guess = initial_guess
+        self.fallback = fallback
+        self.max_nfev = max_nfev
+        if segment_mode not in ("index", "time", "auto"):
+            raise ValueError("segment_mode should be 'index', 'time' or 'auto', not '{}'".format(segment_mode))
+        self.segment_mode = segment_mode
+        self.seg1_delay_ns = seg1_delay_ns
+        self.end_seg1_ns = end_seg1_ns
+        self.auto_fast_fraction = auto_fast_fraction
+        self.min_segment_ns = min_segment_ns
+        if weighting not in ("none", "noise", "wres"):
+            raise ValueError("weighting should be 'none', 'noise' or 'wres', not '{}'".format(weighting))
+        self.weighting = weighting
+        self.noise_window = noise_window
+        self.bootstrap_resamples = bootstrap_resamples
+        self.confidence = confidence
+        self.bootstrap_seed = bootstrap_seed
+        # raises a ValueError for unknown stages
+        resolve_stages(stages)
+        self.stages = stages
+
+    def as_dict(self):
+        """Returns the settings as a dictionary, e.g. for the run_fit cache key."""
+        return dict(vars(self))
+
+
+class OutputFitData:
+    """
+
+    Object to hold the output fitted curves, which consists of arrays of different lengths.
+
+    I know this is probably easier to store in a dictionary, but I was having a little "OOP moment".
+
+    """
+
+    def __init__(self, name=None, time=None, y_fit_savgol=None, seg1_xfit=None, seg1_yfit=None, seg2_xfit=None, seg2_yfit=None):
+        self.name = name
+        self.filename = None
+        self.y_fit_savgol = y_fit_savgol
+        self.time = time
+        self.anisotropy = None
+        self.rotat_fit = None
+        self.seg1_xfit = seg1_xfit
+        self.seg1_yfit = seg1_yfit
+        self.seg2_xfit = seg2_xfit
+        self.seg2_yfit = seg2_yfit
+        self.tped_xfit = None
+        self.tped_yfit = None
+        self.trad_xfit = None
+        self.trad_yfit = None
+        self.r_inf_seg2 = None
+        self.start_seg1 = None
+        self.end_seg1 = None
+        self.start_seg2 = None
@@ -0,0 +1,192 @@
+import argparse
+import json
+import sys
+
+def main(argv=None):
+    """Command-line interface of blitzcurve, installed as the "blitzcurve" console script.
+
+    Subcommands
+    -----------
+    fit = run_fit on a directory of input files
+    compare = run_compare on a directory that has been fitted
+    bench = run_bench, optionally comparing the results to a baseline json
+    watch = run_watch on a directory that is being written by the instrument
+    global = run_global_fit, fitting all samples in a directory together with shared parameters
+
+    The blitzcurve modules are only imported by the subcommand that needs them, and matplotlib uses
+    the non-interactive Agg backend, so that jobs on headless cluster nodes do not need a display.
+
+    Usage
+    -----
+    blitzcurve fit D:\\data\\20180229_TRdata --workers 8 --format store --figs none
+    blitzcurve fit D:\\data\\20180229_TRdata --render-profile summary
+    blitzcurve compare D:\\data\\20180229_TRdata --names names.json
+    blitzcurve bench --out bench.json --baseline bench_0.0.2.json
+    blitzcurve watch D:\\data\\20180229_TRdata --interval 2
+    blitzcurve global D:\\data\\20180229_TRdata --fit 2phasedecay --shared Kslow
+    python -m blitzcurve fit --help
+
+    Returns
+    -------
+    exit_code : int
+        0 if successful, 1 if any input file could not be analysed (fit), or if a benchmark regression was found (bench).
+    """
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    return args.function(args)
+
+def _get_parser():
+    parser = argparse.ArgumentParser(prog="blitzcurve", description="Time-resolved fluorescence anisotropy analysis.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    fit = subparsers.add_parser("fit", help="fit all input files in a directory")
+    fit.add_argument("data_dir", help="directory with the input text files")
+    _add_fit_arguments(fit)
+    fit.add_argument("--testing", action="store_true", help="only analyse the first two input files")
+    fit.add_argument("--resume", action="store_true", help="do not refit samples that are in the summary of an interrupted run")
+    fit.add_argument("--async-render", action="store_true", help="plot figures in background processes (with --workers 1)")
+    fit.add_argument("--render-workers", type=int, default=1, help="number of background rendering processes")
+    fit.add_argument("--render-mode", choices=["new", "reuse"], default="new", help="create figures from scratch, or reuse template figures")
+    fit.add_argument("--profile-dir", help="save cProfile stats of each sample in this directory")
+    fit.add_argument("--compare", action="store_true", help="run compare after fitting")
+    fit.add_argument("--names", help="json file with a dictionary of filename: short name, for --compare")
+    fit.set_defaults(function=_fit)
+
+    compare = subparsers.add_parser("compare", help="compare the fitted samples in a directory")
+    compare.add_argument("data_dir", help="directory with the input text files, which has been fitted")
+    compare.add_argument("--names", help="json file with a dictionary of filename: short name, for plotting")
+    _add_figure_arguments(compare)
+    compare.set_defaults(function=_compare)
+
+    bench = subparsers.add_parser("bench", help="benchmark each stage of the analysis on synthetic traces")
+    bench.add_argument("--out", help="save the results as json")
+    bench.add_argument("--baseline", help="json of an earlier bench run, to check the results for regressions")
+    bench.add_argument("--threshold", type=float, default=1.2, help="stages slower than the baseline by this factor are regressions")
+    bench.add_argument("--n-render", type=int, default=2, help="number of samples whose figures are timed")
+    bench.add_argument("--seed", type=int, default=0, help="seed of the synthetic traces")
+    bench.set_defaults(function=_bench)
+
+    watch = subparsers.add_parser("watch", help="fit new files as they are written to a directory")
+    watch.add_argument("data_dir", help="directory with the input text files")
+    _add_fit_arguments(watch)
+    watch.add_argument("--interval", type=float, default=5.0, help="seconds between checks of the directory")
+    watch.add_argument("--no-compare", action="store_true", help="do not update the compare figures after each fit")
+    watch.add_argument("--names", help="json file with a dictionary of filename: short name, for the compare figures")
+    watch.add_argument("--max-polls", type=int, help="stop after this number of checks")
+    watch.set_defaults(function=_watch)
+
+    global_fit = subparsers.add_parser("global", help="fit all samples in a directory together, with shared parameters")
+    global_fit.add_argument("data_dir", help="directory with the input text files")
+    global_fit.add_argument("--fit", choices=["seg1", "seg2", "2phasedecay", "anisotropy_decay"], default="2phasedecay", help="fit that is carried out globally")
+    global_fit.add_argument("--shared", nargs="*", default=["Kslow"], help="parameters shared by all samples, e.g. Kslow or r_inf")
+    global_fit.add_argument("--segment-mode", choices=["index", "time", "auto"], default="index", help="how the segments are defined")
+    global_fit.set_defaults(function=_global_fit)
+    return parser
+
+def _add_fit_arguments(parser):
+    """Arguments shared by the fit and watch subcommands."""
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU core for fit, 1 for watch)")
+    parser.add_argument("--no-cache", action="store_true", help="refit all samples, rather than taking unchanged samples from the cache")
+    parser.add_argument("--format", choices=["pickle", "store", "both"], default="pickle", help="format of the output fit data")
+    parser.add_argument("--figs", nargs="+", default=["all"],
+                        help="figures to plot: all, none, or any of rotat savgol seg1 seg2 2phasedecay anisotropy_decay")
+    parser.add_argument("--stages", nargs="+", default=["all"],
+                        help="stages to compute: all, or any of savgol seg1 seg2 2phasedecay anisotropy_decay")
+    parser.add_argument("--segment-mode", choices=["index", "time", "auto"], default="index", help="how the segments are defined")
+    parser.add_argument("--bootstrap", type=int, default=0, help="number of bootstrap resamples for confidence intervals")
+    parser.add_argument("--weighting", choices=["none", "noise", "wres"], default="none", help="weighting of the datapoints in the fits")
+    _add_figure_arguments(parser)
+
+def _add_figure_arguments(parser):
+    """Arguments for the format of the figures, shared by the fit, watch and compare subcommands."""
+    parser.add_argument("--decimate", choices=["minmax", "lttb", "none"], default="minmax",
+                        help="decimation of long traces to the figure resolution before plotting (none plots all datapoints)")
+    parser.add_argument("--render-profile", choices=["standard", "preview", "publication", "svg", "pdf", "summary"], default="standard",
+                        help="format and resolution of the figures. summary only saves the figures of samples flagged as outliers")
+
+def _get_settings(args):
+    from blitzcurve.calc import FitSettings
+    stages = "all" if "all" in args.stages else args.stages
+    return FitSettings(segment_mode=args.segment_mode, bootstrap_resamples=args.bootstrap, stages=stages, weighting=args.weighting)
+
+def _get_figs_to_plot(args):
+    if "none" in args.figs:
+        return []
+    return "all" if "all" in args.figs else args.figs
+
+def _read_names(names_json):
+    if names_json is None:
+        return None
+    with open(names_json) as f:
+        return json.load(f)
+
+def _use_agg_backend(required=True):
+    """Uses the non-interactive Agg backend, which only saves figures and does not need a display.
+
+    matplotlib is only imported if figures are plotted (required is True), so that headless fits start quickly.
+    """
+    if not required:
+        return
+    import matplotlib
+    matplotlib.use("Agg")
+
+def _fit(args):
+    # with the "summary" render profile, the figures of outliers are plotted after fitting, so this also depends only on --figs
+    _use_agg_backend(bool(_get_figs_to_plot(args)) or args.compare)
+    from blitzcurve.fit import run_fit
+    failed = []
+
+    def callback(filename, metrics):
+        if metrics.get("failed"):
+            failed.append(filename)
+
+    run_fit(args.data_dir, figs_to_plot=_get_figs_to_plot(args), testing_mode=args.testing, workers=args.workers,
+            cache=not args.no_cache, settings=_get_settings(args), fitdata_format=args.format, async_render=args.async_render,
+            render_workers=args.render_workers, render_mode=args.render_mode, profile_dir=args.profile_dir,
+            callback=callback, resume=args.resume, decimate=args.decimate, render_profile=args.render_profile)
+    if args.compare:
+        from blitzcurve.compare import run_compare
+        run_compare(args.data_dir, name_dict=_read_names(args.names), decimate=args.decimate, render_profile=args.render_profile)
+    return 1 if failed else 0
+
+def _compare(args):
+    _use_agg_backend()
+    from blitzcurve.compare import run_compare
+    run_compare(args.data_dir, name_dict=_read_names(args.names), decimate=args.decimate, render_profile=args.render_profile)
+    return 0
+
+def _bench(args):
+    _use_agg_backend(args.n_render > 0)
+    import os
+    import tempfile
+    from blitzcurve.bench import run_bench, compare_bench_results
+    out_json = args.out
+    if out_json is None and args.baseline is not None:
+        # the results have to be saved to compare them with the baseline
+        out_json = os.path.join(tempfile.mkdtemp(), "bench.json")
+    run_bench(out_json=out_json, n_render=args.n_render, seed=args.seed)
+    if args.baseline is not None:
+        df = compare_bench_results(args.baseline, out_json, threshold=args.threshold)
+        return 1 if df["regression"].any() else 0
+    return 0
+
+def _watch(args):
+    _use_agg_backend(bool(_get_figs_to_plot(args)) or not args.no_compare)
+    from blitzcurve.watch import run_watch
+    run_watch(args.data_dir, poll_interval=args.interval, figs_to_plot=_get_figs_to_plot(args), compare=not args.no_compare,
+              name_dict=_read_names(args.names), workers=1 if args.workers is None else args.workers,
+              settings=_get_settings(args), fitdata_format=args.format, max_polls=args.max_polls,
+              decimate=args.decimate, render_profile=args.render_profile)
+    return 0
+
+def _global_fit(args):
+    from blitzcurve.calc import FitSettings
+    from blitzcurve.globalfit import run_global_fit
+    run_global_fit(args.data_dir, fit=args.fit, shared=args.shared, settings=FitSettings(segment_mode=args.segment_mode))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
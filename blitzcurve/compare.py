@@ -2,14 +2,20 @@ import glob
 import os
 import pickle
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
+from blitzcurve.decimate import decimate_for_axes
+from blitzcurve.metrics import StageMetrics, write_metrics_csv
+from blitzcurve.profiles import get_render_profile
+from blitzcurve.store import FitDataStore
 from blitzcurve.utils import setup_matplotlib_dark_background
 import blitzcurve.utils as utils
 import sys
 import blitzcurve
 
-def run_compare(data_dir, file_list="all", name_dict= None):
+def run_compare(data_dir, file_list="all", name_dict= None, decimate="minmax", render_profile="standard"):
     """
 
     Parameters
@@ -22,6 +28,13 @@ def run_compare(data_dir, file_list="all", name_dict= None):
         Default is "all", which analyses all files in folder
     name_dict : dict
         Dictionary to rename long filenames for plotting.
+    decimate : str
+        Decimation of the overlaid curves to the resolution of the line charts (see blitzcurve.decimate).
+        "minmax" keeps the lowest and highest point of each pixel column, so that peaks stay visible (default).
+        "lttb" uses the largest triangle three buckets algorithm, and "none" plots all datapoints.
+        Curves that are short compared with the figure width are always plotted in full.
+    render_profile : str or profiles.RenderProfile
+        Format and resolution of the figures, e.g. "preview", "svg" or "pdf". See run_fit and profiles.RENDER_PROFILES.
 
     Returns
     -------
@@ -37,10 +50,14 @@ def run_compare(data_dir, file_list="all", name_dict= None):
     blitzcurve.run_compare(data_dir, name_dict=name_dict)
     """
 
+    # wall time of each stage, saved in summary/compare_metrics.csv
+    metrics = StageMetrics()
+
     # create object with the compare file paths
-    cfp = utils.CompareFilePaths(data_dir)
+    profile = get_render_profile(render_profile)
+    cfp = utils.CompareFilePaths(data_dir, profile.fmt)
 
-    setup_matplotlib_dark_background(plt)
+    setup_matplotlib_dark_background(plt, profile.dpi)
 
     fc = utils.FlourescentColours()
     csv_files = glob.glob(os.path.join(data_dir, "*.txt"))
@@ -53,193 +70,355 @@ def run_compare(data_dir, file_list="all", name_dict= None):
 
     summ_csv = os.path.join(data_dir, "summary", "fit_summary.csv")
     df = pd.read_csv(summ_csv, index_col=0)
+    metrics.lap("load_summary")
 
-    df["orig_names"] = df.index
-
-    if name_dict is not None:
-        # rename the index
-        df.rename(index=name_dict, inplace=True)
-    else:
-        # no naming dict available
-        # cut off the ".txt" in the filename before plotting.
-        df.index = df.index.str[:-4]
+    df = _prepare_summary(df, name_dict)
 
     create_barcharts = True
 
     if create_barcharts:
-        #########################################################################
-        #                   Barchart maximum anisotropy                         #
-        #########################################################################
-        fig, ax = plt.subplots()
-        width = 0.6
-        df["r_max"].plot(kind="bar", ax=ax, color=fc.blue, width=width, label="segment 1")
-        ax.set_ylabel(r"$r_{max}$", fontsize=16)
-        # adjust margins around bars
-        ax.set_xlim(-0.6, df.shape[0] - 0.4)
-        ax.set_ylim(df["r_max"].min() - 0.005, df["r_max"].max() + 0.005)
-        fig.tight_layout()
-        fig.savefig(cfp.barchart_r_max)
-        sys.stdout.write("\n{}".format(cfp.barchart_r_max))
-
-        #########################################################################
-        #                              Barchart r_inf                           #
-        #########################################################################
-        fig, ax = plt.subplots()
-        width = 0.6
-        df["r_inf"].plot(kind="bar", ax=ax, color=fc.blue, width=width, label="segment 1")
-        ax.set_ylabel(r"$r_{inf}$", fontsize=16)
-        # adjust margins around bars
-        ax.set_xlim(-0.6, df.shape[0] - 0.4)
-        ax.set_ylim(df["r_inf"].min() - 0.005, df["r_inf"].max() + 0.005)
-        fig.tight_layout()
-        fig.savefig(cfp.barchart_r_inf)
-        sys.stdout.write("\n{}".format(cfp.barchart_r_inf))
-
-        #########################################################################
-        #               Barchart variable a, segments 1 and 2                   #
-        #########################################################################
-
-        #generate only dataframe with a_seg1 and a_seg2
-        df_a_bars = pd.concat([df["a_seg1"], df["a_seg2"]], axis=1)
-        df_a_bars.columns = ["a_seg1", "a_seg2"]
-
-        fig, ax = plt.subplots()
-        width = 0.8
-        df_a_bars.plot(kind="bar", ax=ax, color=[fc.blue,fc.lemon], width=width, legend=False)
-        #gets handles for the legend (also gets and labels - rudimentary)
-        handles, labels = ax.get_legend_handles_labels()
-        #brings segment b to secondary y axis
-        ax2 = ax.twinx()
-        for r in ax.patches[len(df_a_bars):]:
-            r.set_transform(ax2.transData)
-        #defines labels
-        labels = ["segment 1", "segment 2"]
-
-        ax.set_ylabel("variable a in segment 1", color=fc.blue)
-        ax.tick_params("y", colors=fc.blue)
-        ax2.set_ylabel("variable a in segment 2", color=fc.lemon)
-        ax2.tick_params("y", colors=fc.lemon)
-        # adjust margins around bars
-        ax.set_xlim(-0.6, df.shape[0] - 0.4)
-        ax.set_ylim(df["a_seg1"].min() - 0.005, df["a_seg1"].max() + 0.01)
-        ax2.set_ylim(df["a_seg2"].min() - 0.005, df["a_seg2"].max() + 0.01)
-        fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
-
-        fig.tight_layout()
-        fig.savefig(cfp.barchart_variable_a_png)
-        sys.stdout.write("\n{}".format(cfp.barchart_variable_a_png))
-
-
-        #########################################################################
-        #               Barchart variable b, segments 1 and 2                   #
-        #########################################################################
-
-        #generate only dataframe with b_seg1 and b_seg2
-        df_b_bars = pd.concat([df["b_seg1"], df["b_seg2"]], axis=1)
-        df_b_bars.columns = ["b_seg1", "b_seg2"]
-
-        fig, ax = plt.subplots()
-        width = 0.8
-        df_b_bars.plot(kind="bar", ax=ax, color=[fc.blue, fc.lemon], width=width, legend=False)
-        # gets handles for the legend (also gets and labels - rudimentary)
-        handles, labels = ax.get_legend_handles_labels()
-        # brings segment b to secondary y axis
-        ax2 = ax.twinx()
-        for r in ax.patches[len(df_b_bars):]:
-            r.set_transform(ax2.transData)
-        # defines labels
-        labels = ["segment 1", "segment 2"]
-
-        ax.set_ylabel("variable b in segment 1", color=fc.blue)
-        ax.tick_params("y", colors=fc.blue)
-        ax2.set_ylabel("variable b in segment 2", color=fc.lemon)
-        ax2.tick_params("y", colors=fc.lemon)
-        # adjust margins around bars
-        ax.set_xlim(-0.6, df.shape[0] - 0.4)
-        ax.set_ylim(df["b_seg1"].min() - 0.005, df["b_seg1"].max() + 0.02)
-        ax2.set_ylim(df["b_seg2"].min() - 0.005, df["b_seg2"].max() + 0.02)
-        fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
-
-        fig.tight_layout()
-        fig.savefig(cfp.barchart_variable_b_png)
-        sys.stdout.write("\n{}".format(cfp.barchart_variable_b_png))
-
-        #########################################################################
-        #               Barchart variable c, segments 1 and 2 (r_inf)           #
-        #########################################################################
-        plt.close("all")
-
-        # generate only dataframe with c_seg1 and r_inf
-        df_c_rinf_bars = pd.concat([df["c_seg1"], df["r_inf"]], axis=1)
-        df_c_rinf_bars.columns = ["c_seg1", "r_inf"]
-
-        fig, ax = plt.subplots()
-        width = 0.8
-        df_c_rinf_bars.plot(kind="bar", ax=ax, color=[fc.blue, fc.lemon], width=width, legend=False)
-        # gets handles for the legend (also gets and labels - rudimentary)
-        handles, labels = ax.get_legend_handles_labels()
-        # brings segment b to secondary y axis
-        ax2 = ax.twinx()
-        for r in ax.patches[len(df_c_rinf_bars):]:
-            r.set_transform(ax2.transData)
-        # defines labels
-        labels = ["segment 1", "segment 2"]
-
-        ax.set_ylabel("variable c in segment 1", color=fc.blue)
-        ax.tick_params("y", colors=fc.blue)
-        ax2.set_ylabel("variable c (r_inf) in segment 2", color=fc.lemon)
-        ax2.tick_params("y", colors=fc.lemon)
-        # adjust margins around bars
-        ax.set_xlim(-0.6, df.shape[0] - 0.4)
-        ax.set_ylim(df["c_seg1"].min() - 0.005, df["c_seg1"].max() + 0.01)
-        ax2.set_ylim(df["r_inf"].min() - 0.005, df["r_inf"].max() + 0.01)
-
-        fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
-        fig.tight_layout()
-        fig.savefig(cfp.barchart_variable_c_png)
-        sys.stdout.write("\n{}".format(cfp.barchart_variable_c_png))
-
-
-    fig_sg, ax_sg = plt.subplots()
-    fig_seg1, ax_seg1 = plt.subplots()
-    fig_seg2, ax_seg2 = plt.subplots()
+        _plot_barcharts(df, cfp, fc)
+    metrics.lap("barcharts")
+
+    line_charts = LineCharts(cfp, decimate)
+
+    # load fitdata from the columnar store written by run_fit, if available, otherwise from the individual pickles
+    store = FitDataStore(cfp.fitdata_store_dir) if os.path.isdir(cfp.fitdata_store_dir) else None
 
     for csv in csv_files:
         # paths for the output files
         p = utils.FitFilePaths(data_dir, csv)
-        with open(p.fitdata_pickle, "rb") as pic:
-            #fd = blitzcurve.fit.OutputFitData()
-            fd = pickle.load(pic)
-            print("fd.filename", fd.filename)
-            #for item in [fd.fit_savgol, fd.seg1_xfit, fd.seg1_yfit, fd.seg2_xfit, fd.seg2_yfit]:
-            #    assert item is not None
-            if name_dict is not None:
-                label = name_dict[fd.filename] if fd.filename in name_dict else fd.filename
+        with metrics.stage("load_fitdata"):
+            if store is not None:
+                if p.filename not in store:
+                    continue
+                fd = store.get(p.filename)
             else:
-                label = fd.filename
-            ax_sg.plot(fd.time, fd.y_fit_savgol, label=label)
+                # skip samples that could not be fitted
+                if not os.path.isfile(p.fitdata_pickle):
+                    continue
+                with open(p.fitdata_pickle, "rb") as pic:
+                    fd = pickle.load(pic)
+        print("fd.filename", fd.filename)
+        line_charts.add(fd, _get_label(fd.filename, name_dict))
+    line_charts.save()
+
+    # the linecharts time includes loading the fitdata of each sample
+    metrics.lap("linecharts")
+    write_metrics_csv({"run_compare": metrics.values}, os.path.join(data_dir, "summary", "compare_metrics.csv"))
+
+def _prepare_summary(df, name_dict=None):
+    """Renames the samples of the summary for plotting, keeping the filenames in the orig_names column."""
+    df["orig_names"] = df.index
+
+    if name_dict is not None:
+        # rename the index
+        df.rename(index=name_dict, inplace=True)
+    else:
+        # no naming dict available
+        # cut off the ".txt" in the filename before plotting.
+        df.index = df.index.str[:-4]
+    return df
+
+def _get_label(filename, name_dict=None):
+    """Label of a sample in the line charts."""
+    if name_dict is not None and filename in name_dict:
+        return name_dict[filename]
+    return filename
+
+def _plot_barcharts(df, cfp, fc):
+    """Saves the barcharts of the fitted parameters of all samples in the summary."""
+    #########################################################################
+    #                   Barchart maximum anisotropy                         #
+    #########################################################################
+    fig, ax = plt.subplots()
+    width = 0.6
+    df["r_max"].plot(kind="bar", ax=ax, color=fc.blue, width=width, label="segment 1")
+    ax.set_ylabel(r"$r_{max}$", fontsize=16)
+    # adjust margins around bars
+    ax.set_xlim(-0.6, df.shape[0] - 0.4)
+    _set_ylim(ax, df["r_max"], 0.005, 0.005)
+    fig.tight_layout()
+    fig.savefig(cfp.barchart_r_max)
+    sys.stdout.write("\n{}".format(cfp.barchart_r_max))
+
+    #########################################################################
+    #                              Barchart r_inf                           #
+    #########################################################################
+    fig, ax = plt.subplots()
+    width = 0.6
+    df["r_inf"].plot(kind="bar", ax=ax, color=fc.blue, width=width, label="segment 1")
+    ax.set_ylabel(r"$r_{inf}$", fontsize=16)
+    # error bars from the bootstrap confidence intervals or standard errors of the fits
+    r_inf_errors = _get_errors(df, "r_inf")
+    _add_error_bars(ax, ax.patches, df["r_inf"], r_inf_errors)
+    # adjust margins around bars
+    ax.set_xlim(-0.6, df.shape[0] - 0.4)
+    _set_ylim(ax, df["r_inf"], 0.005, 0.005, r_inf_errors)
+    fig.tight_layout()
+    fig.savefig(cfp.barchart_r_inf)
+    sys.stdout.write("\n{}".format(cfp.barchart_r_inf))
+
+    #########################################################################
+    #               Barchart variable a, segments 1 and 2                   #
+    #########################################################################
+
+    #generate only dataframe with a_seg1 and a_seg2
+    df_a_bars = pd.concat([df["a_seg1"], df["a_seg2"]], axis=1)
+    df_a_bars.columns = ["a_seg1", "a_seg2"]
+
+    fig, ax = plt.subplots()
+    width = 0.8
+    df_a_bars.plot(kind="bar", ax=ax, color=[fc.blue,fc.lemon], width=width, legend=False)
+    #gets handles for the legend (also gets and labels - rudimentary)
+    handles, labels = ax.get_legend_handles_labels()
+    #brings segment b to secondary y axis
+    ax2 = ax.twinx()
+    for r in ax.patches[len(df_a_bars):]:
+        r.set_transform(ax2.transData)
+    #defines labels
+    labels = ["segment 1", "segment 2"]
+
+    ax.set_ylabel("variable a in segment 1", color=fc.blue)
+    ax.tick_params("y", colors=fc.blue)
+    ax2.set_ylabel("variable a in segment 2", color=fc.lemon)
+    ax2.tick_params("y", colors=fc.lemon)
+    # adjust margins around bars
+    # error bars from the bootstrap confidence intervals or standard errors of the fits
+    errors = [_get_errors(df, "a_seg1"), _get_errors(df, "a_seg2")]
+    _add_error_bars(ax, ax.patches[:len(df_a_bars)], df["a_seg1"], errors[0])
+    _add_error_bars(ax2, ax.patches[len(df_a_bars):], df["a_seg2"], errors[1])
+    ax.set_xlim(-0.6, df.shape[0] - 0.4)
+    _set_ylim(ax, df["a_seg1"], 0.005, 0.01, errors[0])
+    _set_ylim(ax2, df["a_seg2"], 0.005, 0.01, errors[1])
+    fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
+
+    fig.tight_layout()
+    fig.savefig(cfp.barchart_variable_a_png)
+    sys.stdout.write("\n{}".format(cfp.barchart_variable_a_png))
+
+
+    #########################################################################
+    #               Barchart variable b, segments 1 and 2                   #
+    #########################################################################
+
+    #generate only dataframe with b_seg1 and b_seg2
+    df_b_bars = pd.concat([df["b_seg1"], df["b_seg2"]], axis=1)
+    df_b_bars.columns = ["b_seg1", "b_seg2"]
+
+    fig, ax = plt.subplots()
+    width = 0.8
+    df_b_bars.plot(kind="bar", ax=ax, color=[fc.blue, fc.lemon], width=width, legend=False)
+    # gets handles for the legend (also gets and labels - rudimentary)
+    handles, labels = ax.get_legend_handles_labels()
+    # brings segment b to secondary y axis
+    ax2 = ax.twinx()
+    for r in ax.patches[len(df_b_bars):]:
+        r.set_transform(ax2.transData)
+    # defines labels
+    labels = ["segment 1", "segment 2"]
+
+    ax.set_ylabel("variable b in segment 1", color=fc.blue)
+    ax.tick_params("y", colors=fc.blue)
+    ax2.set_ylabel("variable b in segment 2", color=fc.lemon)
+    ax2.tick_params("y", colors=fc.lemon)
+    # adjust margins around bars
+    # error bars from the bootstrap confidence intervals or standard errors of the fits
+    errors = [_get_errors(df, "b_seg1"), _get_errors(df, "b_seg2")]
+    _add_error_bars(ax, ax.patches[:len(df_b_bars)], df["b_seg1"], errors[0])
+    _add_error_bars(ax2, ax.patches[len(df_b_bars):], df["b_seg2"], errors[1])
+    ax.set_xlim(-0.6, df.shape[0] - 0.4)
+    _set_ylim(ax, df["b_seg1"], 0.005, 0.02, errors[0])
+    _set_ylim(ax2, df["b_seg2"], 0.005, 0.02, errors[1])
+    fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
+
+    fig.tight_layout()
+    fig.savefig(cfp.barchart_variable_b_png)
+    sys.stdout.write("\n{}".format(cfp.barchart_variable_b_png))
+
+    #########################################################################
+    #               Barchart variable c, segments 1 and 2 (r_inf)           #
+    #########################################################################
+    plt.close("all")
+
+    # generate only dataframe with c_seg1 and r_inf
+    df_c_rinf_bars = pd.concat([df["c_seg1"], df["r_inf"]], axis=1)
+    df_c_rinf_bars.columns = ["c_seg1", "r_inf"]
+
+    fig, ax = plt.subplots()
+    width = 0.8
+    df_c_rinf_bars.plot(kind="bar", ax=ax, color=[fc.blue, fc.lemon], width=width, legend=False)
+    # gets handles for the legend (also gets and labels - rudimentary)
+    handles, labels = ax.get_legend_handles_labels()
+    # brings segment b to secondary y axis
+    ax2 = ax.twinx()
+    for r in ax.patches[len(df_c_rinf_bars):]:
+        r.set_transform(ax2.transData)
+    # defines labels
+    labels = ["segment 1", "segment 2"]
+
+    ax.set_ylabel("variable c in segment 1", color=fc.blue)
+    ax.tick_params("y", colors=fc.blue)
+    ax2.set_ylabel("variable c (r_inf) in segment 2", color=fc.lemon)
+    ax2.tick_params("y", colors=fc.lemon)
+    # adjust margins around bars
+    # error bars from the bootstrap confidence intervals or standard errors of the fits
+    errors = [_get_errors(df, "c_seg1"), _get_errors(df, "r_inf")]
+    _add_error_bars(ax, ax.patches[:len(df_c_rinf_bars)], df["c_seg1"], errors[0])
+    _add_error_bars(ax2, ax.patches[len(df_c_rinf_bars):], df["r_inf"], errors[1])
+    ax.set_xlim(-0.6, df.shape[0] - 0.4)
+    _set_ylim(ax, df["c_seg1"], 0.005, 0.01, errors[0])
+    _set_ylim(ax2, df["r_inf"], 0.005, 0.01, errors[1])
+
+    fig.legend(handles,labels,ncol=2, loc="upper center", bbox_to_anchor=(0, 0.85, 1.1, .102))
+    fig.tight_layout()
+    fig.savefig(cfp.barchart_variable_c_png)
+    sys.stdout.write("\n{}".format(cfp.barchart_variable_c_png))
+    # the barcharts are saved, and are not needed anymore (e.g. in the repeated updates of run_watch)
+    plt.close("all")
+
+#########################################################################
+#     Line charts with the fitted curves of all samples overlaid        #
+#########################################################################
+class LineCharts:
+    """
+    Line charts of the Savitzky-Golay fits and the segment fits of all samples.
 
-            ax_seg1.plot(fd.time, fd.y_fit_savgol, color="0.3", zorder=0)
-            ax_seg1.plot(fd.seg1_xfit, fd.seg1_yfit, label=label)
+    The lines of each sample are kept, so that a single sample can be added or replaced without plotting
+    the other samples again (see IncrementalCompare). The figures are not managed by pyplot, so plt.close("all")
+    in the barcharts does not affect them.
 
-            ax_seg2.plot(fd.time, fd.y_fit_savgol, color="0.3", zorder=0)
-            ax_seg2.plot(fd.seg2_xfit, fd.seg2_yfit, label=label)
+    Parameters
+    ----------
+    cfp : utils.CompareFilePaths
+        Paths of the compare figures.
+    decimate : str
+        Decimation of the curves to the resolution of the figures. See run_compare.
 
-    ax_sg.set_xlabel("time (ns)")
-    ax_sg.set_ylabel("anisotropy, r")
-    ax_sg.legend()
-    fig_sg.tight_layout()
-    fig_sg.savefig(cfp.linechart_savgol)
+    Usage
+    -----
+    line_charts = LineCharts(cfp)
+    for fd in ...:
+        line_charts.add(fd, label)
+    line_charts.save()
+    """
+    def __init__(self, cfp, decimate="minmax"):
+        self.cfp = cfp
+        self.decimate = decimate
+        self.figs = {}
+        for name in ["savgol", "seg1", "seg2"]:
+            fig = Figure()
+            ax = fig.subplots()
+            ax.set_xlabel("time (ns)")
+            ax.set_ylabel("anisotropy, r")
+            self.figs[name] = (fig, ax)
+        # lines of each sample, with the filename as key
+        self.lines = {}
+
+    def add(self, fd, label):
+        """Adds the curves of a sample, replacing any earlier curves of the same sample."""
+        self.remove(fd.filename)
+        ax_sg, ax_seg1, ax_seg2 = (self.figs[name][1] for name in ["savgol", "seg1", "seg2"])
+        lines = []
+        # the savgol stage is not run if it was deselected in FitSettings.stages
+        if fd.y_fit_savgol is not None:
+            lines += ax_sg.plot(*decimate_for_axes(ax_sg, fd.time, fd.y_fit_savgol, self.decimate), label=label)
+
+        # samples where the segment fit failed have no fitted curve
+        if fd.seg1_xfit is not None:
+            lines += ax_seg1.plot(*decimate_for_axes(ax_seg1, fd.time, fd.y_fit_savgol, self.decimate), color="0.3", zorder=0)
+            lines += ax_seg1.plot(*decimate_for_axes(ax_seg1, fd.seg1_xfit, fd.seg1_yfit, self.decimate), label=label)
+
+        if fd.seg2_xfit is not None:
+            lines += ax_seg2.plot(*decimate_for_axes(ax_seg2, fd.time, fd.y_fit_savgol, self.decimate), color="0.3", zorder=0)
+            lines += ax_seg2.plot(*decimate_for_axes(ax_seg2, fd.seg2_xfit, fd.seg2_yfit, self.decimate), label=label)
+        self.lines[fd.filename] = lines
+
+    def remove(self, filename):
+        """Removes the curves of a sample, if it has been added."""
+        for line in self.lines.pop(filename, []):
+            line.remove()
+
+    def save(self):
+        """Saves the three line charts."""
+        for name, png in [("savgol", self.cfp.linechart_savgol), ("seg1", self.cfp.linechart_seg1), ("seg2", self.cfp.linechart_seg2)]:
+            fig, ax = self.figs[name]
+            # the axis limits follow the current lines, after samples have been replaced
+            ax.relim()
+            ax.autoscale_view()
+            ax.legend()
+            fig.tight_layout()
+            fig.savefig(png)
+
+class IncrementalCompare:
+    """
+    Keeps the compare figures of a directory up to date, as samples are fitted one by one (see run_watch).
 
-    ax_seg1.set_xlabel("time (ns)")
-    ax_seg1.set_ylabel("anisotropy, r")
-    ax_seg1.legend()
-    fig_seg1.tight_layout()
-    fig_seg1.savefig(cfp.linechart_seg1)
+    The barcharts show all samples, and are replotted from the summary on each update, which only takes
+    a few bars per sample. The line charts are kept between updates, and only the lines of the new or
+    changed samples are plotted. The fitdata of the other samples is therefore not loaded again.
 
-    ax_seg2.set_xlabel("time (ns)")
-    ax_seg2.set_ylabel("anisotropy, r")
-    ax_seg2.legend()
-    fig_seg2.tight_layout()
-    fig_seg2.savefig(cfp.linechart_seg2)
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files.
+    name_dict : dict
+        Dictionary to rename long filenames for plotting.
+    decimate : str
+        Decimation of the curves to the resolution of the line charts. See run_compare.
+    render_profile : str or profiles.RenderProfile
+        Format and resolution of the figures. See run_compare.
 
+    Usage
+    -----
+    compare = IncrementalCompare(data_dir)
+    compare.update(nested_summ_dict, all_fd_list)
+    ...
+    compare.update(nested_summ_dict, [new_fd])
+    """
+    def __init__(self, data_dir, name_dict=None, decimate="minmax", render_profile="standard"):
+        profile = get_render_profile(render_profile)
+        self.cfp = utils.CompareFilePaths(data_dir, profile.fmt)
+        self.name_dict = name_dict
+        setup_matplotlib_dark_background(plt, profile.dpi)
+        self.fc = utils.FlourescentColours()
+        self.line_charts = LineCharts(self.cfp, decimate)
+
+    def update(self, nested_summ_dict, fd_list):
+        """Replots the barcharts with all samples in nested_summ_dict, and adds or replaces the curves of the samples in fd_list."""
+        if not nested_summ_dict:
+            return
+        df = _prepare_summary(pd.DataFrame.from_dict(nested_summ_dict, orient="index"), self.name_dict)
+        _plot_barcharts(df, self.cfp, self.fc)
+        for fd in fd_list:
+            self.line_charts.add(fd, _get_label(fd.filename, self.name_dict))
+        self.line_charts.save()
+
+def _set_ylim(ax, values, below, above, errors=None):
+    """Sets the y-axis limits around the values and their error bars, unless they are all NaN (e.g. if the stage was not run)."""
+    if values.notna().any():
+        low, high = values.values, values.values
+        if errors is not None:
+            # error bars that are NaN do not change the limits
+            low, high = np.fmin(low, low - errors[0]), np.fmax(high, high + errors[1])
+        ax.set_ylim(np.nanmin(low) - below, np.nanmax(high) + above)
+
+def _get_errors(df, column):
+    """Returns the (lower, upper) error bars of a column of the summary, with shape (2, n_samples).
+
+    The bootstrap confidence intervals ("<column>_ci_low", "<column>_ci_high") are used if available,
+    otherwise the standard errors ("<column>_se"). Returns None if neither is in the summary (e.g. older summaries).
+    """
+    if column + "_ci_low" in df.columns:
+        # a percentile interval does not always contain the fitted value
+        return np.clip(np.vstack([df[column] - df[column + "_ci_low"], df[column + "_ci_high"] - df[column]]), 0, None)
+    if column + "_se" in df.columns:
+        return np.vstack([df[column + "_se"], df[column + "_se"]])
+    return None
+
+def _add_error_bars(ax, patches, values, errors):
+    """Adds error bars to the bars of a bar chart. The cap size is set in utils.setup_matplotlib_dark_background."""
+    if errors is None:
+        return
+    x = [r.get_x() + r.get_width() / 2 for r in patches]
+    ax.errorbar(x, values, yerr=errors, fmt="none", ecolor="0.8", zorder=3)
@@ -0,0 +1,15 @@
+import glob
+from os import path
+
+import pytest
+import blitzcurve
+from blitzcurve.load import read_anisotropy_file
+
+# Fixtures of the focused tests in blitzcurve/test_*.py, which complement the end-to-end run_test.
+# Run with "python -m pytest blitzcurve".
+
+@pytest.fixture(scope="session")
+def example_data():
+    """InputData of the example files shipped with blitzcurve."""
+    example_dir = path.join(path.dirname(path.abspath(blitzcurve.__file__)), "examples")
+    return [read_anisotropy_file(csv) for csv in sorted(glob.glob(path.join(example_dir, "*.txt")))]
@@ -0,0 +1,195 @@
+import numpy as np
+
+# decimation methods for plotting. "none" plots all datapoints.
+DECIMATE_METHODS = ["minmax", "lttb", "none"]
+
+def decimate_for_axes(ax, x, y, method="minmax", dpi=None, xlim=None):
+    """Reduces a trace to about the number of datapoints that can be distinguished in a matplotlib axes.
+
+    Traces with less than two datapoints per pixel column of the saved figure are returned unchanged,
+    so decimation only affects long traces. See decimate for the methods.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axes in which the trace is plotted.
+    x, y : np.ndarray
+        Trace, with x in increasing order.
+    method : str
+        "minmax" (default), "lttb" or "none".
+    dpi : float
+        Resolution of the saved figure. Default is None, which uses rcParams["savefig.dpi"].
+    xlim : tuple
+        Visible x range, for figures that only show part of the trace (e.g. the peak). Default is None, for the full trace.
+
+    Returns
+    -------
+    x, y : np.ndarray
+        Decimated trace.
+    """
+    if method not in DECIMATE_METHODS:
+        raise ValueError("method should be one of {}, not '{}'".format(DECIMATE_METHODS, method))
+    if method == "none" or x is None or y is None:
+        return x, y
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if xlim is not None:
+        # only the visible datapoints, and one datapoint beyond each edge, so that lines continue to the edge
+        start = max(np.searchsorted(x, xlim[0]) - 1, 0)
+        end = np.searchsorted(x, xlim[1], side="right") + 1
+        x, y = x[start:end], y[start:end]
+    return decimate(x, y, axes_pixel_width(ax, dpi), method)
+
+def decimate_scatter_for_axes(ax, x, y, method="minmax", dpi=None, xlim=None, ylim=None, s=None):
+    """Removes datapoints of a scatter plot that are hidden by the marker of an earlier datapoint.
+
+    Lines are decimated with minmax or LTTB (see decimate), but in a scatter plot of a noisy trace, these would leave
+    a hollow band with only the lowest and highest datapoints. Instead, the axes is divided into a grid of
+    cells with half the width of a marker, and only the first datapoint in each cell is kept. Each removed marker
+    is covered for the most part by the kept marker of its cell, so the figure looks the same.
+    Only applied to traces with more than two datapoints per pixel column.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axes in which the trace is plotted.
+    x, y : np.ndarray
+        Trace, with x in increasing order.
+    method : str
+        "minmax" or "lttb" (default "minmax") decimate the scatter in the same way, "none" plots all datapoints.
+    dpi : float
+        Resolution of the saved figure. Default is None, which uses rcParams["savefig.dpi"].
+    xlim, ylim : tuple
+        Visible x and y range, for figures with fixed axis limits. Default is None, for the range of the data.
+    s : float
+        Marker size in points ** 2, as in ax.scatter. Default is None, which uses rcParams["lines.markersize"] ** 2.
+
+    Returns
+    -------
+    x, y : np.ndarray
+        Decimated trace.
+    """
+    if method not in DECIMATE_METHODS:
+        raise ValueError("method should be one of {}, not '{}'".format(DECIMATE_METHODS, method))
+    if method == "none" or x is None or y is None:
+        return x, y
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n_cols = axes_pixel_width(ax, dpi)
+    if x.size <= 2 * n_cols:
+        return x, y
+    if s is None:
+        import matplotlib
+        s = matplotlib.rcParams["lines.markersize"] ** 2
+    # cells of half the marker diameter, and at least one pixel
+    cell = max(1.0, np.sqrt(s) / 72 * _savefig_dpi(ax, dpi) / 2)
+    index = pixel_grid_indices(x, y, max(1, int(n_cols / cell)), max(1, int(axes_pixel_height(ax, dpi) / cell)), xlim, ylim)
+    return x[index], y[index]
+
+def decimate(x, y, n_pixels, method="minmax"):
+    """Reduces a trace to about two datapoints per pixel column, keeping its visual shape.
+
+    "minmax" splits the trace into n_pixels bins and keeps the lowest and highest datapoint of each bin,
+    so that peaks, dips and the spread of the noise look the same as in the full trace.
+    "lttb" (largest triangle three buckets, S. Steinarsson, 2013) keeps 2 * n_pixels datapoints that form the
+    largest triangles with their neighbours. This follows the shape of lines closely, but does not keep
+    every extreme value.
+
+    Parameters
+    ----------
+    x, y : np.ndarray
+        Trace, with x in increasing order.
+    n_pixels : int
+        Number of pixel columns covered by the trace.
+    method : str
+        "minmax", "lttb" or "none".
+
+    Returns
+    -------
+    x, y : np.ndarray
+        Decimated trace. Unchanged if the trace has at most 2 * n_pixels datapoints.
+    """
+    if method not in DECIMATE_METHODS:
+        raise ValueError("method should be one of {}, not '{}'".format(DECIMATE_METHODS, method))
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == "none" or x.size <= 2 * n_pixels:
+        return x, y
+    if method == "minmax":
+        index = minmax_indices(y, n_pixels)
+    else:
+        index = lttb_indices(x, y, 2 * n_pixels)
+    return x[index], y[index]
+
+def minmax_indices(y, n_bins):
+    """Indices of the lowest and highest value in each of n_bins bins of equal length, and of the first and last datapoint."""
+    n = y.size
+    bin_size = int(np.ceil(n / n_bins))
+    n_bins = int(np.ceil(n / bin_size))
+    # the last bin is padded, and NaN is never selected unless the whole bin is NaN
+    padded = np.full(n_bins * bin_size, np.nan)
+    padded[:n] = y
+    bins = padded.reshape(n_bins, bin_size)
+    offset = np.arange(n_bins) * bin_size
+    lowest = np.argmin(np.where(np.isnan(bins), np.inf, bins), axis=1) + offset
+    highest = np.argmax(np.where(np.isnan(bins), -np.inf, bins), axis=1) + offset
+    index = np.unique(np.concatenate([[0, n - 1], lowest, highest]))
+    return index[index < n]
+
+def pixel_grid_indices(x, y, n_cols, n_rows, xlim=None, ylim=None):
+    """Indices of the first datapoint in each occupied cell of a grid of n_cols x n_rows cells.
+
+    Datapoints outside xlim or ylim are assigned to the cells at the edge, and NaN is dropped, as it is not plotted.
+    """
+    finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    x, y = x[finite], y[finite]
+    if x.size == 0:
+        return finite
+    col = _grid_position(x, n_cols, xlim)
+    row = _grid_position(y, n_rows, ylim)
+    _, first = np.unique(col * n_rows + row, return_index=True)
+    return finite[np.sort(first)]
+
+def _grid_position(a, n, lim=None):
+    lo, hi = (a.min(), a.max()) if lim is None else lim
+    if hi <= lo:
+        return np.zeros(a.size, dtype=np.int64)
+    return np.clip(((a - lo) / (hi - lo) * n).astype(np.int64), 0, n - 1)
+
+def lttb_indices(x, y, n_out):
+    """Indices of n_out datapoints selected with the largest triangle three buckets algorithm."""
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # the first and last datapoints are always kept, and the others are divided into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    index = np.empty(n_out, dtype=int)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # the third point of the triangle is the mean of the next bucket
+        if i < n_out - 3:
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+def axes_pixel_width(ax, dpi=None):
+    """Width of the axes in pixels, in a figure saved with the given dpi."""
+    return max(1, int(ax.get_position().width * ax.figure.get_figwidth() * _savefig_dpi(ax, dpi)))
+
+def axes_pixel_height(ax, dpi=None):
+    """Height of the axes in pixels, in a figure saved with the given dpi."""
+    return max(1, int(ax.get_position().height * ax.figure.get_figheight() * _savefig_dpi(ax, dpi)))
+
+def _savefig_dpi(ax, dpi=None):
+    if dpi is None:
+        import matplotlib
+        dpi = matplotlib.rcParams["savefig.dpi"]
+        if dpi == "figure":
+            dpi = ax.figure.dpi
+    return dpi
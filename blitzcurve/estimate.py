@@ -0,0 +1,145 @@
+import numpy as np
+
+def estimate_exp(x, y):
+    """Non-iterative estimate of the parameters of utils.exp_func, y = (a - c) * exp(-b * x) + c.
+
+    See _estimate_decay for the method.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x values, in increasing order.
+    y : np.ndarray
+        y values.
+
+    Returns
+    -------
+    p0 : np.ndarray or None
+        Estimated (a, b, c), or None if the data does not look like an exponential decay.
+    """
+    decay = _estimate_decay(x, y)
+    if decay is None:
+        return None
+    span, b, c = decay
+    return np.array([span + c, b, c])
+
+def estimate_two_phase_exp_decay(x, y):
+    """Non-iterative estimate of the parameters of utils.two_phase_exp_decay_func.
+
+    The rate constants are obtained with the integral method for a sum of two exponentials (J. Jacquelin,
+    "Regressions et equations integrales"). The model satisfies y'' + (Kfast + Kslow) * y' + Kfast * Kslow * (y - plateau) = 0.
+    Integrating twice from the first datapoint gives
+        y - y[0] = A * S1 + B * S2 + C * (x - x[0]) + D * (x - x[0]) ** 2
+    where S1 and S2 are the first and second cumulative integrals of y, A = -(Kfast + Kslow) and B = -Kfast * Kslow.
+    The rate constants are the roots of K ** 2 + A * K - B = 0, and the spans and plateau are then
+    obtained by linear regression.
+
+    If the roots are not two positive rate constants (e.g. for very noisy data), the estimate falls back to
+    exponential peeling: the slow component is estimated from the second half of the time range, where the fast
+    component has decayed, and the fast component from the remaining signal in the first half.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x values, in increasing order.
+    y : np.ndarray
+        y values.
+
+    Returns
+    -------
+    p0 : np.ndarray or None
+        Estimated (plateau, SpanFast, Kfast, SpanSlow, Kslow), or None if the data does not look like a two phase decay.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size < 8:
+        return None
+    S1 = _cumulative_integral(x, y)
+    S2 = _cumulative_integral(x, S1)
+    dx = x - x[0]
+    # the constant term is fitted rather than taken from the noisy first datapoint
+    A, B = np.linalg.lstsq(np.column_stack([S1, S2, np.ones_like(x), dx, dx ** 2]), y, rcond=None)[0][:2]
+    roots = np.roots([1, A, -B])
+    if np.all(np.isreal(roots)) and np.all(roots.real > 0):
+        Kfast, Kslow = np.sort(roots.real)[::-1]
+    else:
+        rates = _peel_rates(x, y)
+        if rates is None:
+            return None
+        Kfast, Kslow = rates
+    SpanFast, SpanSlow, plateau = _linear_amplitudes(x, y, [Kfast, Kslow])
+    return _finite_or_none([plateau, SpanFast, Kfast, SpanSlow, Kslow])
+
+def estimate_time_resolved_anisotropy_decay(x, y):
+    """Non-iterative estimate of the parameters of utils.time_resolved_anisotropy_decay_func.
+
+    The model r(t) = (r0 - r_inf) * exp(-2 * transfer_rate * t) + r_inf is a single exponential decay,
+    which is estimated with _estimate_decay.
+
+    Returns
+    -------
+    p0 : np.ndarray or None
+        Estimated (r0, r_inf, transfer_rate), or None if the data does not look like an exponential decay.
+    """
+    decay = _estimate_decay(x, y)
+    if decay is None:
+        return None
+    span, rate, r_inf = decay
+    return np.array([span + r_inf, r_inf, rate / 2])
+
+def _estimate_decay(x, y):
+    """Estimates (span, rate, constant) of y = span * exp(-rate * x) + constant, without iteration.
+
+    Uses the integral method (J. Jacquelin, "Regressions et equations integrales"), which does not need a guess of
+    the baseline. As dy/dx = -rate * (y - constant), integrating from the first datapoint gives
+        y - y[0] = -rate * S + rate * constant * (x - x[0])
+    where S is the cumulative integral of y. The rate is obtained by linear regression of y - y[0] on S and x - x[0],
+    and the span and constant by linear regression of y on exp(-rate * x).
+    Returns None if there are too few datapoints, or if the data is not decaying.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size < 4:
+        return None
+    S = _cumulative_integral(x, y)
+    # the constant term is fitted rather than taken from the noisy first datapoint
+    coef = np.linalg.lstsq(np.column_stack([S, np.ones_like(x), x - x[0]]), y, rcond=None)[0]
+    rate = -coef[0]
+    if not np.isfinite(rate) or rate <= 0:
+        return None
+    span, constant = _linear_amplitudes(x, y, [rate])
+    return _finite_or_none([span, rate, constant])
+
+def _peel_rates(x, y):
+    """Estimates (Kfast, Kslow) of a two phase decay by exponential peeling, or returns None."""
+    tail = x >= (x[0] + x[-1]) / 2
+    slow = _estimate_decay(x[tail], y[tail])
+    if slow is None:
+        return None
+    SpanSlow, Kslow, plateau = slow
+    # signal of the fast component in the first half, where it is clearly above the noise
+    fast = y[~tail] - (plateau + SpanSlow * np.exp(-Kslow * x[~tail]))
+    if fast.size < 3:
+        return None
+    keep = fast > 0.1 * fast.max()
+    if np.count_nonzero(keep) < 3:
+        return None
+    # weighting with the signal reduces the influence of the noise at small values, after taking the logarithm
+    slope = np.polyfit(x[~tail][keep], np.log(fast[keep]), 1, w=fast[keep])[0]
+    Kfast = -slope
+    if not Kfast > Kslow:
+        return None
+    return Kfast, Kslow
+
+def _linear_amplitudes(x, y, rates):
+    """Least-squares amplitudes of exp(-rate * x) for each rate, and the constant, for given rate constants."""
+    A = np.column_stack([np.exp(-rate * x) for rate in rates] + [np.ones_like(x)])
+    return np.linalg.lstsq(A, y, rcond=None)[0]
+
+def _cumulative_integral(x, y):
+    """Cumulative integral of y from the first datapoint, with the trapezoidal rule."""
+    return np.concatenate([[0], np.cumsum(0.5 * (y[1:] + y[:-1]) * np.diff(x))])
+
+def _finite_or_none(p0):
+    p0 = np.asarray(p0, dtype=float)
+    return p0 if np.all(np.isfinite(p0)) else None
@@ -1,21 +1,30 @@
+import cProfile
 import glob
 import os
 import pickle
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-from matplotlib.patches import Rectangle
-from scipy.optimize import curve_fit
-from scipy.signal import savgol_filter
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 import blitzcurve.utils as utils
-from blitzcurve.utils import setup_matplotlib_dark_background, FitFilePaths
+from blitzcurve.cache import FitCache
+from blitzcurve.calc import fit_curves, FitSettings, OutputFitData
+from blitzcurve.load import read_anisotropy_file
+from blitzcurve.metrics import StageMetrics, timed, write_metrics_csv
+from blitzcurve.profiles import find_outliers, get_render_profile
+from blitzcurve.store import FitDataStore
+from blitzcurve.summary import IncrementalSummary
+from blitzcurve.utils import FitFilePaths
 
 ### test ###
 
-def run_fit(data_dir, figs_to_plot="all", testing_mode=False):
+def run_fit(data_dir, figs_to_plot="all", testing_mode=False, workers=None, cache=True, settings=None, fitdata_format="pickle",
+            async_render=False, render_workers=1, render_mode="new", profile_dir=None, callback=None,
+            resume=False, decimate="minmax", render_profile="standard"):
     """Runs fit_single_sample on all files in a designated directory.
 
-    Saves detailed output for each input data file as a pickle.
+    Saves detailed output for each input data file as a pickle, or in a single columnar store for the whole run.
 
     For details, see docstring for fit_single_sample.
 
@@ -31,8 +40,75 @@ def run_fit(data_dir, figs_to_plot="all", testing_mode=False):
         "savgol" = Savitzky-Golay fit
         "seg1" = fit to segment 1 of anisotropy data
         "seg2" = fit to segment 2 of anisotropy data
+        "2phasedecay" = two phase exponential decay fit
+        "anisotropy_decay" = time resolved anisotropy decay fit
+        Which fits are computed is selected separately, with FitSettings(stages=[...]).
+        Figures of fits that are not computed are skipped.
     testing_mode : bool
         If true, only the first two input data files in the folder will be analysed.
+    workers : int
+        Number of worker processes used to fit and plot the input files in parallel.
+        Default is None, which uses one process per CPU core.
+        Use workers=1 to analyse all files serially in the current process.
+        The fit_summary.csv rows are always in the same order as in a serial run.
+        If a file fails, the error is reported and the remaining files are still analysed.
+    cache : bool
+        If True, samples whose input file, fit settings and figs_to_plot are unchanged since the last run
+        are taken from the cache in fits/fitdata, rather than being fitted again.
+        The fit_summary.csv is always rebuilt from all samples.
+    settings : calc.FitSettings
+        Settings for the fits (selected stages, Savitzky-Golay window, segment boundaries, initial guesses).
+        Default is None, which uses FitSettings().
+    fitdata_format : str
+        Format of the detailed output fit data (OutputFitData) of each sample, which is the input for run_compare.
+        "pickle" = one fitdata pickle per sample in fits/fitdata (default)
+        "store" = a single columnar FitDataStore for the whole run, in fits/fitdata/fitdata_store
+        "both" = pickles and store
+    async_render : bool
+        If True, the figures are plotted and saved in background processes (see render.FigureRenderer),
+        while the next sample is being fitted. Only used if the files are analysed serially (workers=1),
+        as with several worker processes, fitting and plotting of different samples already overlap.
+    render_workers : int
+        Number of background rendering processes, if async_render is True.
+    render_mode : str
+        "new" = each figure is created from scratch for each sample (default)
+        "reuse" = template figures are created once per process and updated with the data of each sample,
+            which is faster for many samples. See plot.FigureTemplates.
+    profile_dir : str
+        Optional directory for cProfile output. If given, each sample is profiled in the process
+        where it is fitted, and the stats are saved as <sample name>.prof (view with pstats or snakeviz).
+    callback : function
+        Optional function that is called in the main process as callback(filename, metrics) for each fitted sample,
+        where metrics is a dictionary of the wall time of each stage and the evaluation counts of each fit.
+    resume : bool
+        If True, samples that are already in summary/fit_summary.csv (e.g. from a run that was interrupted)
+        are not fitted again, as long as their fitdata exists. Unlike the cache, changes to the input files
+        or settings are not checked.
+    decimate : str
+        Decimation of long traces to the resolution of the figures, before plotting. Does not affect the fits.
+        "minmax" (default) keeps the peaks of each pixel column, "lttb" uses the largest triangle three buckets algorithm,
+        and "none" plots all datapoints. Traces that are short compared with the figure width are always plotted in full.
+        See plot.plot_single_sample.
+    render_profile : str or profiles.RenderProfile
+        Format and resolution of the figures. See profiles.RENDER_PROFILES.
+        "standard" = PNG at 240 dpi (default)
+        "preview" = PNG at 72 dpi, which is several times faster to save, and much smaller
+        "publication" = PNG at 600 dpi
+        "svg", "pdf" = vector graphics
+        "summary" = the figures of each sample are only saved for samples flagged as outliers
+            (see profiles.find_outliers), after all samples are fitted. The outliers and the reasons
+            for flagging them are saved in summary/outliers.csv.
+
+    Summary
+    -------
+    summary/fit_summary.csv is written incrementally. Each sample is appended as soon as it is finished,
+    so that the results are kept if the run is interrupted. At the end, the csv is rewritten in the order of the input files.
+
+    Metrics
+    -------
+    The wall time of each stage (load, savgol, each fit, each figure, saving the fitdata) and the function (nfev)
+    and Jacobian (njev) evaluation counts of each curve_fit are saved for each fitted sample in summary/fit_metrics.csv.
+    Figures that are plotted with async_render are not timed.
 
     Usage
     -----
@@ -44,10 +120,6 @@ def run_fit(data_dir, figs_to_plot="all", testing_mode=False):
     name_dict = {"10nM-FGC1-2min_aniso.txt": "FGC1", "10nM-FGC2-2min_aniso.txt": "FGC2", "10nM-FGC3-2min_aniso.txt": "FGC3"}
     blitzcurve.run_compare(data_dir, name_dict=name_dict)
     """
-    # setup colours and plot style
-    setup_matplotlib_dark_background(plt)
-    fc = utils.FlourescentColours()
-
     # get list of all text files in directory
     csv_files = glob.glob(os.path.join(data_dir, "*.txt"))
 
@@ -55,36 +127,360 @@ def run_fit(data_dir, figs_to_plot="all", testing_mode=False):
     if testing_mode:
         csv_files = csv_files[0:2]
 
-    # iterate through the input files
-    nested_summ_dict = {}
-    for csv in csv_files:
-        print(csv)
-        # setup paths for the output files for that sample
-        p = FitFilePaths(data_dir, csv)
-        # run fit_single_sample to fit various curves
-        summ_dict, fd = fit_single_sample(csv, fc, p, figs_to_plot)
-        # collect summary for that sample
-        nested_summ_dict[p.filename] = summ_dict
-        # save output object with fitted curves etc for that sample
-        with open(p.fitdata_pickle, "wb") as pic:
-            pickle.dump(fd, pic, protocol=pickle.HIGHEST_PROTOCOL)
+    if settings is None:
+        settings = FitSettings()
+    profile = get_render_profile(render_profile)
+    # figures plotted for each sample as it is fitted. With sample_figures="outliers", only outliers are plotted at the end.
+    sample_figs = figs_to_plot if profile.sample_figures == "all" else []
+    if fitdata_format not in ["pickle", "store", "both"]:
+        raise ValueError("fitdata_format should be 'pickle', 'store' or 'both', not '{}'".format(fitdata_format))
+    dirs = utils.OutDirPaths(data_dir)
+    write_store = fitdata_format in ["store", "both"]
+    # the existing store is read into memory, as it will be replaced at the end of the run
+    old_store = FitDataStore(dirs.fitdata_store_dir, mmap=False) if write_store and os.path.isdir(dirs.fitdata_store_dir) else None
 
-    # convert nested dict to dataframe and save.
-    # this is the input for the barcharts ind the "compare.py" functions
     summ_dir = os.path.join(data_dir, "summary")
     if not os.path.isdir(summ_dir):
         os.makedirs(summ_dir)
     summ_csv = os.path.join(summ_dir, "fit_summary.csv")
-    df_summ = pd.DataFrame(nested_summ_dict).T
-    df_summ.to_csv(summ_csv)
+    summary = IncrementalSummary(summ_csv)
+
+    # take unchanged samples from the cache, or samples finished in an interrupted run, and only fit the rest
+    cached_summ_dict = {}
+    if resume:
+        resumed_summ_dict = summary.read()
+        for csv in csv_files:
+            filename = os.path.basename(csv)
+            if filename in resumed_summ_dict and _fitdata_exists(utils.FitFilePaths(data_dir, csv), fitdata_format, old_store):
+                cached_summ_dict[filename] = resumed_summ_dict[filename]
+        if cached_summ_dict:
+            sys.stdout.write("{} of {} files were already in {}, and are not fitted again.\n".format(len(cached_summ_dict), len(csv_files), summ_csv))
+    if cache:
+        fit_cache = FitCache(dirs.fitdata_dir)
+        cache_keys = {}
+        n_from_cache = 0
+        for csv in csv_files:
+            filename = os.path.basename(csv)
+            cache_keys[filename] = fit_cache.get_key(csv, settings, figs_to_plot, profile.name, decimate, render_mode)
+            summ_dict = fit_cache.get(filename, cache_keys[filename])
+            if filename in cached_summ_dict:
+                continue
+            if summ_dict is not None and _fitdata_exists(utils.FitFilePaths(data_dir, csv), fitdata_format, old_store):
+                cached_summ_dict[filename] = summ_dict
+                n_from_cache += 1
+        if n_from_cache:
+            sys.stdout.write("{} of {} files are unchanged, and were taken from the cache.\n".format(n_from_cache, len(csv_files)))
+    csv_files_to_fit = [csv for csv in csv_files if os.path.basename(csv) not in cached_summ_dict]
+
+    # start the summary with the samples that are not fitted again. Fitted samples are appended as they finish.
+    summary.start({os.path.basename(csv): cached_summ_dict[os.path.basename(csv)] for csv in csv_files if os.path.basename(csv) in cached_summ_dict})
+
+    # by default, use one worker process per CPU core
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(csv_files_to_fit)))
+
+    # iterate through the input files, either serially or in a process pool
+    render_failed = []
+    if workers == 1 and async_render:
+        from blitzcurve.render import FigureRenderer
+        with FigureRenderer(workers=render_workers, dpi=profile.dpi) as renderer:
+            results = (_fit_and_save(data_dir, csv, sample_figs, settings, fitdata_format, render_mode, profile_dir, renderer, decimate, profile.fmt) for csv in csv_files_to_fit)
+            fitted_summ_dict, fitted_fd, failed_files, nested_metrics = _collect_results(csv_files_to_fit, results, callback, summary)
+            # wait until all figures are saved
+            render_failed = renderer.wait()
+    else:
+        results = fit_files(data_dir, csv_files_to_fit, sample_figs, settings, fitdata_format, workers, render_mode, profile_dir, decimate, profile)
+        fitted_summ_dict, fitted_fd, failed_files, nested_metrics = _collect_results(csv_files_to_fit, results, callback, summary)
+        # shuts down the worker processes
+        results.close()
+
+    if cache:
+        for filename, summ_dict in fitted_summ_dict.items():
+            fit_cache.set(filename, cache_keys[filename], summ_dict)
+        fit_cache.save()
+
+    # combine cached and fitted samples, in the order of the input files
+    all_summ_dict = dict(cached_summ_dict, **fitted_summ_dict)
+    filenames = [os.path.basename(csv) for csv in csv_files]
+    nested_summ_dict = {filename: all_summ_dict[filename] for filename in filenames if filename in all_summ_dict}
+
+    # write all fitdata to a single store, or remove an outdated store so that run_compare uses the pickles
+    if write_store:
+        fd_list = [fitted_fd[filename] if filename in fitted_fd else old_store.get(filename) for filename in nested_summ_dict]
+        FitDataStore.write(dirs.fitdata_store_dir, fd_list)
+    elif os.path.isdir(dirs.fitdata_store_dir):
+        shutil.rmtree(dirs.fitdata_store_dir)
+
+    for filename, error in render_failed:
+        sys.stdout.write("ERROR: figures of {} could not be plotted.\n{}".format(filename, error))
+
+    if failed_files:
+        sys.stdout.write("\n{} of {} files could not be analysed:\n{}\n".format(len(failed_files), len(csv_files), "\n".join(failed_files)))
+
+    # rewrite the summary in the order of the input files.
+    # this is the input for the barcharts ind the "compare.py" functions
+    summary.finish(nested_summ_dict)
+
+    if profile.sample_figures == "outliers":
+        plot_outliers(data_dir, nested_summ_dict, figs_to_plot, fitdata_format, fitted_fd, profile, render_mode, decimate)
+
+    # timing and evaluation counts of the samples fitted in this run
+    if nested_metrics:
+        write_metrics_csv(nested_metrics, os.path.join(summ_dir, "fit_metrics.csv"))
+
+def fit_files(data_dir, csv_files, figs_to_plot="all", settings=None, fitdata_format="pickle", workers=1, render_mode="new",
+              profile_dir=None, decimate="minmax", render_profile="standard"):
+    """Fits and plots each input file separately, either serially or in a process pool, without writing the summary.
+
+    This is the fitting step of run_fit, which can also be used for single files, e.g. by the watch mode.
+    The results are yielded in the order of csv_files, each as soon as that file is finished.
+    A file that could not be analysed gives an error rather than raising, so that it does not abort the other files.
 
-def fit_single_sample(csv, fc, p, figs_to_plot):
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files.
+    csv_files : list
+        Paths of the input files to fit.
+    figs_to_plot : str, list
+        Figures plotted for each sample. See run_fit.
+    settings : calc.FitSettings
+        Settings for the fits. Default is None, which uses FitSettings().
+    fitdata_format : str
+        Format of the output fit data. The pickles are saved for each file, but the store is not written. See run_fit.
+    workers : int
+        Number of worker processes. Default is 1, which fits the files in the current process.
+    render_mode, profile_dir, decimate, render_profile
+        See run_fit. Only the format and resolution of the figures are taken from the render profile.
+
+    Yields
+    ------
+    filename : str
+        Filename of the input file.
+    summ_dict : dict or None
+        Dictionary with summary data for that single sample. None if the file could not be analysed.
+    fd : OutputFitData or None
+        Output fit data object, if fitdata_format is "store" or "both". Otherwise None, as it is saved in the pickle.
+    error : str or None
+        Formatted traceback if the file could not be analysed, otherwise None.
+    metrics : dict
+        Wall time of each stage and evaluation counts of each fit (StageMetrics.values).
+
+    Usage
+    -----
+    for filename, summ_dict, fd, error, metrics in fit_files(data_dir, csv_files, workers=4, fitdata_format="store"):
+        if error is None:
+            print(filename, summ_dict["r_inf"])
     """
+    if settings is None:
+        settings = FitSettings()
+    profile = get_render_profile(render_profile)
+    workers = max(1, min(workers, len(csv_files)))
+    if workers == 1:
+        _init_worker(figs_to_plot, profile.dpi)
+        for csv in csv_files:
+            yield _fit_and_save(data_dir, csv, figs_to_plot, settings, fitdata_format, render_mode, profile_dir, None, decimate, profile.fmt)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(figs_to_plot, profile.dpi)) as executor:
+        futures = [executor.submit(_fit_and_save, data_dir, csv, figs_to_plot, settings, fitdata_format, render_mode, profile_dir, None, decimate, profile.fmt)
+                   for csv in csv_files]
+        for csv, future in zip(csv_files, futures):
+            yield _get_future_result(csv, future)
+
+def _init_worker(figs_to_plot="all", dpi=240):
+    """Sets up the plot style in each process that fits and plots samples.
+
+    matplotlib is only imported if figures are plotted, so that headless fits start quickly.
+    """
+    if _figures_required(figs_to_plot):
+        import matplotlib.pyplot as plt
+        utils.setup_matplotlib_dark_background(plt, dpi)
+
+def _figures_required(figs_to_plot):
+    """Returns False if figs_to_plot selects no figures (None or an empty list)."""
+    return bool(figs_to_plot)
+
+def _fit_and_save(data_dir, csv, figs_to_plot, settings, fitdata_format, render_mode="new", profile_dir=None, renderer=None, decimate="minmax",
+                  fmt="png"):
+    """Fits a single input file and saves the output fit data as a pickle, if required.
+
+    Used by run_fit, either in the current process or in a worker process.
+    If a render.FigureRenderer is given, the figures are queued for background rendering rather than plotted here.
+    Exceptions are caught and returned as a formatted traceback, so that a single
+    failed file does not abort the whole batch.
+
+    Returns
+    -------
+    filename : str
+        Filename of the input file.
+    summ_dict : dict or None
+        Dictionary with summary data for that single sample. None if the fit failed.
+    fd : OutputFitData or None
+        Output fit data object, if it is needed for the columnar store. Otherwise None.
+    error : str or None
+        Formatted traceback if the fit failed, otherwise None.
+    metrics : dict
+        Wall time of each stage and evaluation counts of each fit (StageMetrics.values).
+        For failed samples, this includes the stages up to and including the failed stage.
+    """
+    filename = os.path.basename(csv)
+    metrics = StageMetrics()
+    profiler = None
+    if profile_dir is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        fc = utils.FlourescentColours()
+        # setup paths for the output files for that sample
+        p = FitFilePaths(data_dir, csv, fmt)
+        # run fit_single_sample to fit various curves
+        if renderer is None:
+            summ_dict, fd = fit_single_sample(csv, fc, p, figs_to_plot, settings, render_mode, metrics, decimate)
+        else:
+            summ_dict, fd = fit_single_sample(csv, fc, p, None, settings, metrics=metrics)
+            with metrics.stage("render_queue"):
+                renderer.submit(summ_dict, fd, fc, p, figs_to_plot, render_mode, decimate)
+        # save output object with fitted curves etc for that sample
+        if fitdata_format in ["pickle", "both"]:
+            with metrics.stage("save_pickle"):
+                with open(p.fitdata_pickle, "wb") as pic:
+                    pickle.dump(fd, pic, protocol=pickle.HIGHEST_PROTOCOL)
+        if fitdata_format == "pickle":
+            fd = None
+        return filename, summ_dict, fd, None, metrics.values
+    except Exception:
+        return filename, None, None, traceback.format_exc(), metrics.values
+    finally:
+        metrics.values["total_ms"] = (time.perf_counter() - start) * 1000
+        if profiler is not None:
+            profiler.disable()
+            if not os.path.isdir(profile_dir):
+                os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, filename[:-4] + ".prof"))
+
+def plot_outliers(data_dir, nested_summ_dict, figs_to_plot, fitdata_format, fitted_fd, profile, render_mode="new", decimate="minmax"):
+    """Saves the figures of the samples flagged by profiles.find_outliers, and lists them in summary/outliers.csv.
+
+    Used by run_fit and run_watch with render profiles that only save the figures of outliers. The outliers are judged
+    against all samples of the run, including those taken from the cache, so the figures of all outliers are saved in each run.
+
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files.
+    nested_summ_dict : dict
+        Summary dictionaries of all samples of the run, with the filename as key.
+    figs_to_plot : str, list
+        Figures plotted for each outlier. See run_fit.
+    fitdata_format : str
+        Format of the output fit data, from which the fit data of the outliers are loaded. See run_fit.
+    fitted_fd : dict
+        Output fit data objects that are already loaded, with the filename as key. Used instead of the store.
+    profile : profiles.RenderProfile
+        Render profile, with the outlier threshold and the format and resolution of the figures.
+    render_mode, decimate
+        See run_fit.
+    """
+    import pandas as pd
+    outliers = find_outliers(pd.DataFrame.from_dict(nested_summ_dict, orient="index"), profile.outlier_threshold)
+    outliers.rename("reason").rename_axis("filename").to_csv(os.path.join(data_dir, "summary", "outliers.csv"), header=True)
+    sys.stdout.write("\n{} of {} samples were flagged as outliers.\n".format(len(outliers), len(nested_summ_dict)))
+    if not _figures_required(figs_to_plot) or outliers.empty:
+        return
+    import matplotlib.pyplot as plt
+    from blitzcurve.plot import plot_single_sample
+    utils.setup_matplotlib_dark_background(plt, profile.dpi)
+    fc = utils.FlourescentColours()
+    dirs = utils.OutDirPaths(data_dir)
+    store = FitDataStore(dirs.fitdata_store_dir) if fitdata_format in ["store", "both"] else None
+    for filename, reason in outliers.items():
+        p = FitFilePaths(data_dir, os.path.join(data_dir, filename), profile.fmt)
+        try:
+            if store is not None:
+                fd = fitted_fd[filename] if filename in fitted_fd else store.get(filename)
+            else:
+                with open(p.fitdata_pickle, "rb") as pic:
+                    fd = pickle.load(pic)
+            plot_single_sample(nested_summ_dict[filename], fd, fc, p, figs_to_plot, render_mode, decimate=decimate)
+        except Exception:
+            sys.stdout.write("ERROR: figures of {} could not be plotted.\n{}".format(filename, traceback.format_exc()))
+            continue
+        sys.stdout.write("{} ({})\n".format(filename, reason))
+
+def _get_future_result(csv, future):
+    """Gets the result of a _fit_and_save future, including errors where the worker process itself died."""
+    try:
+        return future.result()
+    except Exception:
+        return os.path.basename(csv), None, None, traceback.format_exc(), {}
+
+def _collect_results(csv_files, results, callback=None, summary=None):
+    """Collects the summary dictionaries of all samples, in the order of the input files.
+
+    Parameters
+    ----------
+    csv_files : list
+        List of input files, in the order in which they were submitted.
+    results : iterable
+        Results of _fit_and_save, in the same order as csv_files.
+    callback : function
+        Optional function, called as callback(filename, metrics) for each sample.
+    summary : summary.IncrementalSummary
+        Optional summary csv, to which each successfully analysed sample is appended.
+
+    Returns
+    -------
+    nested_summ_dict : dict
+        Summary dictionaries for each successfully analysed sample, with the filename as key.
+    fd_dict : dict
+        Output fit data objects returned for the columnar store, with the filename as key.
+    failed_files : list
+        Filenames of the samples that could not be analysed.
+    nested_metrics : dict
+        Metrics of each sample, including failed samples, with the filename as key.
+    """
+    nested_summ_dict = {}
+    fd_dict = {}
+    failed_files = []
+    nested_metrics = {}
+    for csv, (filename, summ_dict, fd, error, metrics) in zip(csv_files, results):
+        print(csv)
+        metrics["failed"] = error is not None
+        nested_metrics[filename] = metrics
+        if error is not None:
+            sys.stdout.write("ERROR: {} could not be analysed.\n{}".format(filename, error))
+            failed_files.append(filename)
+        else:
+            # collect summary for that sample
+            nested_summ_dict[filename] = summ_dict
+            if summary is not None:
+                summary.append(filename, summ_dict)
+            if fd is not None:
+                fd_dict[filename] = fd
+        if callback is not None:
+            callback(filename, metrics)
+    return nested_summ_dict, fd_dict, failed_files, nested_metrics
+
+def _fitdata_exists(p, fitdata_format, store):
+    """Checks whether the output fit data of a sample exists in the required format, e.g. before using the cache."""
+    if fitdata_format in ["pickle", "both"] and not os.path.isfile(p.fitdata_pickle):
+        return False
+    if fitdata_format in ["store", "both"] and (store is None or p.filename not in store):
+        return False
+    return True
+
+def fit_single_sample(csv, fc, p, figs_to_plot, settings=None, render_mode="new", metrics=None, decimate="minmax"):
+    """Fits curves to a single input file and plots the selected figures.
+
+    The fitting is carried out by blitzcurve.calc.fit_curves, which does not use matplotlib.
+    The plotting is carried out afterwards by blitzcurve.plot.plot_single_sample.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Input dataframe from .txt file, with raw time_ns and anisotropy data, as well as matlab-generated fits.
+    csv : str
+        Path to input .txt file, with raw time_ns and anisotropy data, as well as matlab-generated fits.
     fc : utils.FlourescentColours
         Fluorescent colours object with some useful colours for plotting.
     p : FitFilePaths
@@ -97,6 +493,16 @@ def fit_single_sample(csv, fc, p, figs_to_plot):
         "savgol" = Savitzky-Golay fit
         "seg1" = fit to segment 1 of anisotropy data
         "seg2" = fit to segment 2 of anisotropy data
+        "2phasedecay" = two phase exponential decay fit
+        "anisotropy_decay" = time resolved anisotropy decay fit
+    settings : calc.FitSettings
+        Settings for the fits. Default is None, which uses FitSettings().
+    render_mode : str
+        "new" or "reuse". See plot.plot_single_sample.
+    metrics : metrics.StageMetrics
+        Optional object that records the wall time of each stage, and the evaluation counts of each fit.
+    decimate : str
+        "minmax", "lttb" or "none". Decimation of long traces before plotting. See plot.plot_single_sample.
 
     Saved Files
     -----------
@@ -105,6 +511,8 @@ def fit_single_sample(csv, fc, p, figs_to_plot):
     p.savgol_fit_peak_png : zoom of savitzky-golay fit to show only the peak, to check accuracy of r_max
     p.exp_fit_seg1_png : exponential fit to segment 1
     p.exp_fit_seg2_png : exponential fit to segment 2
+    p.two_comp_exp_decay_png : two phase exponential decay fit
+    p.time_resolved_anisotropy_decay_png : time resolved anisotropy decay fit
 
     Returns
     -------
@@ -114,323 +522,15 @@ def fit_single_sample(csv, fc, p, figs_to_plot):
         Output fit data object
 
     """
-    df = pd.read_csv(csv)
-
-    #df2 = df[["time_ns", "anisotropy"]]
-
-    """Input dataframe looks like this:
-         time_ns  anisotropy       fit      wres
-    150    2.400    0.379667  0.383769 -0.004102
-    151    2.416    0.378772  0.382971 -0.004199
-    152    2.432    0.376986  0.382180 -0.005193
-    153    2.448    0.376041  0.381395 -0.005355
-    154    2.464    0.375459  0.380617 -0.005158
-    155    2.480    0.375113  0.379846 -0.004732
-    156    2.496    0.376228  0.379081 -0.002853
-    157    2.512    0.373975  0.378323 -0.004347
-    158    2.528    0.374096  0.377571 -0.003475
-    """
+    # read only the time_ns, anisotropy and (optional) fit and wres columns
+    with timed(metrics, "load"):
+        data = read_anisotropy_file(csv)
 
-    # initialise fit-data-object to hold fitted curves, and add filename and raw data
-    fd = OutputFitData()
-    fd.filename = p.filename
-    fd.time = df.time_ns
-    fd.anisotropy = df.anisotropy
-
-    #########################################################################
-    #    Scatter/Line plot with original fit designed to measure rotation   #
-    #########################################################################
-    if all(["all" or "rotat" in figs_to_plot, "fit" in df.columns]):
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data")
-        df.plot(x="time_ns", y="fit", ax=ax, color=fc.red, label="rotational correlation fit")
-        fig.savefig(p.rotat_fit_png)
-
-    #########################################################################
-    #               Scatter/Line plot with Savitzky-Golay fit               #
-    #########################################################################
-    x = df.time_ns.as_matrix()
-    y = df.anisotropy.as_matrix()
-    # get fit using window of 51 residues, and polynomial degrees of 3
-    y_fit_savgol = savgol_filter(y, 51, 3)
-    # save fit datapoints to output object
-    fd.y_fit_savgol = y_fit_savgol
-
-    # create a summary dictionary for this sample, and add r_max, etc
-    summ_dict = {}
-    summ_dict["r_max"] = y_fit_savgol.max()
-    summ_dict["r_max_index"] = y_fit_savgol.argmax()
-    summ_dict["r_max_time"] = x[summ_dict["r_max_index"]]
-
-    if "all" or "savgol" in figs_to_plot:
-        #########################################################################
-        #                          plot with all datapoints                     #
-        #########################################################################
-        plt.close("all")
-        fig, ax = plt.subplots()
-        #plot raw data
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1)
-        # plot fit data
-        ax.plot(x, y_fit_savgol, color=fc.red, label="savitzky-golay fit")
-        ax.set_title("savitzky-golay fit")
-        ax.legend()
-        
-        # annotate the anosotropy associated with the peak on the graph
-        peak_string = "max anisotropy : {:.02f}\n   time : {:.02f} ns".format(summ_dict["r_max"], summ_dict["r_max_time"])
-        ax.annotate(peak_string, (summ_dict["r_max_time"] + 0.2, summ_dict["r_max"] - 0.02), color=fc.red)
-        
-        fig.savefig(p.savgol_fit_png, dpi=240)
-
-
-        #########################################################################
-        #       plot of only the peak region, to check accuracy of r_max        #
-        #########################################################################
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1)
-        ax.plot(x, y_fit_savgol, color=fc.red, label="savitzky-golay fit")
-        ax.set_title("savitzky-golay fit")
-        ax.legend()
-        #  hard-coded xlim and ylim are not very flexible, but work right now..
-        ax.set_xlim(0.4, 2)
-        ax.set_ylim(0.3, 0.6)
-        ax.set_title("savitzky-golay fit for peak only")
-
-        # annotate the anosotropy associated with the peak on the graph
-        peak_string = "max anisotropy : {:.02f}\ntime : {:.02f} ns".format(summ_dict["r_max"], summ_dict["r_max_time"])
-        ax.annotate(peak_string, (summ_dict["r_max_time"] + 0.1, summ_dict["r_max"] + 0.005), color=fc.red)
-        
-        fig.savefig(p.savgol_fit_peak_png)
-
-
-    #########################################################################
-    #          Scatter/Line plot with segment 1 exponential fit             #
-    #########################################################################
-    
-    # define start and end of segment 1 and segment 2
-    # currently segment 1 starts 40 datapoints after the peak, which is not very flexible
-    datapoints_after_peak = 40
-    start_seg1 = summ_dict["r_max_index"] + datapoints_after_peak
-    end_seg1 = 300
-    start_seg2 = end_seg1
-
-    if "all" or "seg1" in figs_to_plot:
-        # plot raw datapoints
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1, zorder=2)
-
-        # get x (time) and y (anisotropy) for only this segment
-        df_seg1 = df.loc[start_seg1:end_seg1, :]
-        x = df_seg1.time_ns.as_matrix()
-        y = df_seg1.anisotropy.as_matrix()
-
-        # fit to exponential. Extract a, b and c from fitted exponential formula.
-        guess = (0.7, 0.7, 0.2)
-        popt, pcov = curve_fit(utils.exp_func, x, y, p0=guess)
-        a_seg1, b_seg1, c_seg1 = popt
-        summ_dict["a_seg1"], summ_dict["b_seg1"] ,summ_dict["c_seg1"] = a_seg1, b_seg1, c_seg1
-
-        # annotate the function on the graph
-        function_string = r"y = %0.2f * $e^{(-%0.2fx)}$ + %0.2f" % (a_seg1, b_seg1, c_seg1)
-        ax.annotate(function_string, (np.median(x) + 0.2, np.median(y) + 0.05), color=fc.magenta)
-
-        # plot the exponential fit to this section
-        xmax_seg1 = df.time_ns[end_seg1]
-        seg1_xfit = np.linspace(0, xmax_seg1, 500)
-        seg1_yfit = utils.exp_func(seg1_xfit, *popt)
-        ax.plot(seg1_xfit, seg1_yfit, color=fc.magenta, label="exponential fit")
-
-        # add the shading rectangle behind the fitted segment
-        # zorder is used to send the rectangle to the back
-        ymin, ymax = ax.get_ylim()
-        height = ymax - ymin
-        width = x[-1] - x[0]
-        rect = Rectangle((x[0], ymin), width, height, color="0.2", zorder=1)
-        ax.add_patch(rect)
-
-        ax.set_title("fit to segment 1")
-        ax.legend()
-        fig.savefig(p.exp_fit_seg1_png)
-
-        # add data to output curve dictionary
-        #curve_dict["seg1_xfit"] = seg1_xfit
-        #curve_dict["seg1_yfit"] = seg1_yfit
-        fd.seg1_xfit = seg1_xfit
-        fd.seg1_yfit = seg1_yfit
-
-    #########################################################################
-    #          Scatter/Line plot with segment 2 exponential fit             #
-    #########################################################################
-    if "all" or "seg2" in figs_to_plot:
-        # plot raw datapoints
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1, zorder=2)
-
-        # get x (time) and y (anisotropy) for only this segment
-        df_seg2 = df.loc[start_seg2:, :]
-        x = df_seg2.time_ns.as_matrix()
-        y = df_seg2.anisotropy.as_matrix()
-
-        # fit to exponential. Extract a, b and c from fitted exponential formula.
-        guess = (0.4, 0.2, 0.2)
-        popt, pcov = curve_fit(utils.exp_func, x, y, p0=guess)
-        a_seg2, b_seg2, r_inf = popt
-        summ_dict["a_seg2"], summ_dict["b_seg2"] ,summ_dict["r_inf"] = a_seg2, b_seg2, r_inf
-
-        # annotate the function on the graph
-        function_string = r"y = %0.2f * $e^{(-%0.2fx)}$ + %0.2f" % (a_seg2, b_seg2, r_inf)
-        ax.annotate(function_string, (x[0] + 0.2, y[0] + 0.05), color=fc.pink)
-
-        # plot the exponential fit to this section
-        xmax_fit = x.max() + 3
-        seg2_xfit = np.linspace(0, xmax_fit, 500)
-        seg2_yfit = utils.exp_func(seg2_xfit, *popt)
-        ax.plot(seg2_xfit, seg2_yfit, color=fc.pink, label="exponential fit segment 2")
-
-        # plot the r_inf as a horizontal line
-        ax.hlines(r_inf, 0, xmax_fit, color=fc.pink)
-
-        # add the shading rectangle behind the fitted segment
-        # zorder is used to send the rectangle to the back
-        ymin, ymax = ax.get_ylim()
-        height = ymax - ymin
-        width = x[-1] - x[0]
-        rect = Rectangle((x[0], ymin), width, height, color="0.2", zorder=1)
-        ax.add_patch(rect)
-
-        ax.set_title("fit to segment 2")
-        ax.legend()
-        fig.savefig(p.exp_fit_seg2_png)
-
-        # save fitted data to output object
-        fd.seg2_xfit = seg2_xfit
-        fd.seg2_yfit = seg2_yfit
-
-
-    #########################################################################
-    #           2-phase exponential day fit to segments 1 & 2              #
-    #########################################################################
-    if "all" or "2phasedecay" in figs_to_plot:
-        # plot raw datapoints
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1, zorder=2)
-
-        # get x (time) and y (anisotropy) for only this segment
-        df_2ph = df.loc[start_seg1:, :]
-        x = df_2ph.time_ns.as_matrix()
-        y = df_2ph.anisotropy.as_matrix()
-
-        # fit to 2-phase decay formula. Extract constants from fitted exponential formula.
-        # guess = (plateau, SpanFast, Kfast, SpanSlow, Kslow)
-        guess = (0.1, 0.72, 0.65, 0.42, 0.15)
-        popt, pcov = curve_fit(utils.two_phase_exp_decay_func, x, y, p0=guess)
-        plateau, SpanFast, Kfast, SpanSlow, Kslow = popt
-        summ_dict["plateau"], summ_dict["SpanFast"], summ_dict["Kfast"], summ_dict["SpanSlow"], summ_dict["Kslow"] = plateau, SpanFast, Kfast, SpanSlow, Kslow
-
-        # annotate the function on the graph
-        # plateau + SpanFast * np.exp(-Kfast * x) + SpanSlow * np.exp(-Kslow * x)
-        function_string = r"y = %0.2f + %0.2f * $e^{(-%0.2fx)} + %0.2f * e^{(-%0.2fx)}$" % (plateau, SpanFast, Kfast, SpanSlow, Kslow)
-        ax.annotate(function_string, (x[0] + 0.2, y[0] + 0.05), color=fc.blue, fontsize=10)
-
-        # plot the fit to this section
-        xmax_fit = x.max() + 3
-        tped_xfit = np.linspace(0, xmax_fit, 500)
-        tped_yfit = utils.two_phase_exp_decay_func(tped_xfit, *popt)
-        ax.plot(tped_xfit, tped_yfit, color=fc.blue, label="fit")
-
-        # plot the r_inf as a horizontal line
-        ax.hlines(plateau, 0, xmax_fit, color=fc.blue)
-
-        # add the shading rectangle behind the fitted segment
-        # zorder is used to send the rectangle to the back
-        ymin, ymax = ax.get_ylim()
-        height = ymax - ymin
-        width = x[-1] - x[0]
-        rect = Rectangle((x[0], ymin), width, height, color="0.2", zorder=1)
-        ax.add_patch(rect)
-
-        ax.set_title("two phase exponential decay fit")
-        ax.legend()
-        fig.savefig(p.two_comp_exp_decay_png)
-
-        # save fitted data to output object
-        fd.tped_xfit = tped_xfit
-        fd.tped_yfit = tped_yfit
-
-    #########################################################################
-    #     Time resolved anisotropy decay fit for slowly rotating dyes       #
-    #########################################################################
-    if "all" or "anisotropy_decay" in figs_to_plot:
-        # plot raw datapoints
-        plt.close("all")
-        fig, ax = plt.subplots()
-        df.plot(kind="scatter", x="time_ns", y="anisotropy", ax=ax, color=fc.green, label="data", s=1, zorder=2)
-
-        # get x (time) and y (anisotropy) for only this segment
-        df_2ad = df.loc[start_seg1:, :]
-        x = df_2ad.time_ns.as_matrix()
-        y = df_2ad.anisotropy.as_matrix()
-
-        # fit to time resolved anisotropy decay formula. Extract constants from fitted exponential formula.
-        # guess = (plateau, SpanFast, Kfast, SpanSlow, Kslow)
-        # guess = (0.1, 0.72, 0.65, 0.42, 0.15)
-        r0=summ_dict["r_max"]
-        # popt, pcov = curve_fit(utils.time_resolved_anisotropy_decay_func, x, y)  # p0=guess)
-        popt, pcov = curve_fit((lambda t, r_inf, transfer_rate: utils.time_resolved_anisotropy_decay_func(t, r0, r_inf, transfer_rate)), x, y)  # p0=guess)
-        r_inf, transfer_rate = popt
-        summ_dict["r_inf"], summ_dict["transfer_rate"] = r_inf, transfer_rate
-
-        # annotate the function on the graph
-        function_string = r"r(t) = (%0.2f-%0.2f) * $e^{(-2*%0.2f*t)}$ + %0.2f" % (r0, r_inf, transfer_rate, r_inf)
-        ax.annotate(function_string, (np.median(x) - 0.5, np.median(y) + 0.1), color=fc.magenta)
-
-        # plot the fit to this section
-        xmax_fit = x.max() + 3
-        trad_xfit = np.linspace(0, xmax_fit, 500)
-        trad_yfit = utils.time_resolved_anisotropy_decay_func(trad_xfit,r0, r_inf, transfer_rate)
-        ax.plot(trad_xfit, trad_yfit, color=fc.blue, label="fit")
-
-        # plot the r_inf as a horizontal line
-        ax.hlines(r_inf, 0, xmax_fit, color=fc.blue)
-
-        # add the shading rectangle behind the fitted segment
-        # zorder is used to send the rectangle to the back
-        ymin, ymax = ax.get_ylim()
-        height = ymax - ymin
-        width = x[-1] - x[0]
-        rect = Rectangle((x[0], ymin), width, height, color="0.2", zorder=1)
-        ax.add_patch(rect)
-
-        ax.set_title("time resolved anisotropy decay fit for slowly rotating dyes ")
-        ax.legend()
-        fig.savefig(p.time_resolved_anisotropy_decay_png)
-
-        # save fitted data to output object
-        fd.trad_xfit = trad_xfit
-        fd.trad_yfit = trad_yfit
+    summ_dict, fd = fit_curves(data.time, data.anisotropy, fit=data.fit, settings=settings, filename=p.filename, metrics=metrics,
+                                wres=data.wres)
 
+    if _figures_required(figs_to_plot):
+        from blitzcurve.plot import plot_single_sample
+        plot_single_sample(summ_dict, fd, fc, p, figs_to_plot, render_mode, metrics, decimate)
 
     return summ_dict, fd
-
-
-class OutputFitData:
-    """
-
-    Object to hold the output fitted curves, which consists of arrays of different lengths.
-
-    I know this is probably easier to store in a dictionary, but I was having a little "OOP moment".
-
-    """
-
-    def __init__(self, name=None, time=None, y_fit_savgol=None, seg1_xfit=None, seg1_yfit=None, seg2_xfit=None, seg2_yfit=None):
-        self.name = name
-        self.y_fit_savgol = y_fit_savgol
-        self.time = time
-        self.seg1_xfit = seg1_xfit
-        self.seg1_yfit = seg1_yfit
-        self.seg2_xfit = seg2_xfit
-        self.seg2_yfit = seg2_yfit
\ No newline at end of file
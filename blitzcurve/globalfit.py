@@ -0,0 +1,368 @@
+import glob
+import os
+import sys
+import numpy as np
+import blitzcurve.utils as utils
+from blitzcurve.calc import FitSettings, find_r_max, find_start_seg1, find_end_seg1
+from blitzcurve.load import read_anisotropy_file
+
+# model and summary keys of the parameters for each fit that can be carried out globally.
+# The keys are the same as in the summary of run_fit, e.g. r_inf is "c" of the exponential fit to segment 2.
+GLOBAL_FITS = {"seg1": (utils.exp_model, ["a_seg1", "b_seg1", "c_seg1"]),
+               "seg2": (utils.exp_model, ["a_seg2", "b_seg2", "r_inf"]),
+               "2phasedecay": (utils.two_phase_exp_decay_model, ["plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow"]),
+               "anisotropy_decay": (utils.time_resolved_anisotropy_decay_model, ["r0", "r_inf", "transfer_rate"])}
+
+def run_global_fit(data_dir, fit="2phasedecay", shared=("Kslow",), settings=None, file_list=None):
+    """Fits the traces of all input files in a directory together, with some parameters shared by all samples.
+
+    For example, the slow rate constant Kslow of the two phase exponential decay, or r_inf, may be the same
+    for all samples of a concentration series. Fitting the samples together with a single shared value is
+    more precise than averaging separate fits. The other parameters are fitted separately for each sample.
+
+    Each sample is prepared as in run_fit: r_max is found with the Savitzky-Golay filter, and the segment
+    is selected according to settings. For settings.segment_mode "auto", the boundary between the segments
+    is taken from the estimated (rather than fitted) two phase exponential decay.
+    For the anisotropy decay fit, r0 is fixed to r_max of each sample, as in run_fit.
+
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files. The files do not need to share the same time axis.
+    fit : str
+        Fit that is carried out globally. "seg1", "seg2", "2phasedecay" or "anisotropy_decay".
+    shared : list
+        Parameters shared by all samples, with the names used in the summary, e.g. ["Kslow"] or ["r_inf"].
+    settings : FitSettings
+        Settings for r_max and the segments. Default is None, which uses FitSettings().
+    file_list : list
+        Optional list of filenames to fit together. Default is None, which uses all .txt files in the directory.
+
+    Saved Files
+    -----------
+    summary/global_fit_<fit>.csv : fitted parameters and standard errors of each sample
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Fitted parameters and their standard errors ("<key>_se") of each sample, with the filename as index.
+        Shared parameters have the same value in each row.
+
+    Usage
+    -----
+    from blitzcurve.globalfit import run_global_fit
+    df = run_global_fit(data_dir, fit="2phasedecay", shared=["Kslow"])
+    """
+    import pandas as pd
+    if fit not in GLOBAL_FITS:
+        raise ValueError("fit should be one of {}, not '{}'".format(list(GLOBAL_FITS), fit))
+    if settings is None:
+        settings = FitSettings()
+    model, keys = GLOBAL_FITS[fit]
+    for key in shared:
+        if key not in keys:
+            raise ValueError("{} is not a parameter of the {} fit. Parameters: {}".format(key, fit, keys))
+    csv_files = _get_input_files(data_dir, file_list)
+
+    filenames, x_list, y_list, r_max_list = [], [], [], []
+    for csv in csv_files:
+        data = read_anisotropy_file(csv)
+        x_seg, y_seg, r_max = _get_segment(data.time, data.anisotropy, fit, settings)
+        filenames.append(data.filename)
+        x_list.append(x_seg)
+        y_list.append(y_seg)
+        r_max_list.append(r_max)
+
+    # the parameters are renamed from the names used by the model to the summary keys
+    names = dict(zip(keys, model.param_names))
+    fixed = {"r0": np.array(r_max_list)} if fit == "anisotropy_decay" else None
+    result = global_fit(model, x_list, y_list, shared=[names[key] for key in shared], fixed=fixed)
+
+    df = pd.DataFrame(index=filenames)
+    for i, key in enumerate(keys):
+        df[key] = result.params[:, i]
+        df[key + "_se"] = result.se[:, i]
+    summ_dir = os.path.join(data_dir, "summary")
+    if not os.path.isdir(summ_dir):
+        os.makedirs(summ_dir)
+    df.to_csv(os.path.join(summ_dir, "global_fit_{}.csv".format(fit)))
+
+    if not result.success:
+        sys.stdout.write("WARNING: the global {} fit did not converge. {}\n".format(fit, result.message))
+    for key in shared:
+        i = keys.index(key)
+        sys.stdout.write("global {} fit of {} samples: {} = {:.5g} +/- {:.2g}\n".format(fit, len(filenames), key, result.params[0, i], result.se[0, i]))
+    return df
+
+def global_fit(model, x_list, y_list, shared=(), fixed=None, p0=None, max_iter=200, ftol=1.49012e-08, xtol=1.49012e-08):
+    """Fits a model to several traces together, with some parameters shared by all traces.
+
+    All traces are fitted as a single least-squares problem with a Levenberg-Marquardt solver. The free parameters
+    are the shared parameters, followed by the local parameters of each trace. As each residual only depends on the
+    shared parameters and the local parameters of its own trace, the Jacobian has a sparse block structure, and
+    J.T @ J is block diagonal for the local parameters, bordered by the shared parameters ("block arrow" matrix).
+    The normal equations are solved by eliminating the local parameters of each trace (Schur complement), so that only
+    matrices of size n_params x n_params are inverted. Neither the Jacobian of all traces nor a dense
+    J.T @ J is created, and the cost of each iteration increases linearly with the number of traces.
+
+    Parameters
+    ----------
+    model : utils.FitModel
+        Model with analytic Jacobian, e.g. utils.two_phase_exp_decay_model.
+    x_list, y_list : list
+        x and y values of each trace. The traces can have different lengths.
+    shared : list
+        Names of the parameters of the model that are shared by all traces, e.g. ["Kslow"].
+    fixed : dict
+        Parameters held constant, as name: value, where value is a float or an array with one value per trace.
+        E.g. {"r0": r_max} for the anisotropy decay fit. Default is None.
+    p0 : np.ndarray
+        Initial parameters, shape (n_params,) or (n_traces, n_params). Default is None, which uses the
+        model estimate of each trace (see utils.FitModel.estimate). Shared parameters start at the median over the traces.
+    max_iter : int
+        Maximum number of iterations.
+    ftol : float
+        Relative tolerance in the sum of squares. Same default as scipy.optimize.curve_fit.
+    xtol : float
+        Relative tolerance in the parameters. Same default as scipy.optimize.curve_fit.
+
+    Returns
+    -------
+    result : GlobalFitResult
+        Fitted parameters and standard errors of each trace.
+
+    Usage
+    -----
+    result = global_fit(utils.two_phase_exp_decay_model, x_list, y_list, shared=["Kslow"])
+    Kslow = result.params[0, 4]
+    """
+    fixed = {} if fixed is None else fixed
+    param_names = model.param_names
+    for name in list(shared) + list(fixed):
+        if name not in param_names:
+            raise ValueError("{} is not a parameter of the model. Parameters: {}".format(name, param_names))
+    shared_index = [param_names.index(name) for name in shared if name not in fixed]
+    local_index = [i for i, name in enumerate(param_names) if name not in shared and name not in fixed]
+    free_index = shared_index + local_index
+    n_traces, n_shared = len(x_list), len(shared_index)
+
+    # all traces are concatenated, and trace gives the trace of each datapoint
+    x = np.concatenate([np.asarray(xi, dtype=float) for xi in x_list])
+    y = np.concatenate([np.asarray(yi, dtype=float) for yi in y_list])
+    trace = np.repeat(np.arange(n_traces), [len(xi) for xi in x_list])
+
+    P = _initial_params(model, x_list, y_list, p0, fixed)
+    P[:, shared_index] = np.median(P[:, shared_index], axis=0)
+    lower, upper = model.bounds[0][free_index], model.bounds[1][free_index]
+    P[:, free_index] = np.clip(P[:, free_index], lower, upper)
+
+    def residuals(P):
+        # large steps can overflow the exponential in the models. These give a non-finite cost and are rejected.
+        with np.errstate(over="ignore", invalid="ignore"):
+            return y - model.func(x, *(P[trace, i] for i in range(len(param_names))))
+
+    resid = residuals(P)
+    cost = np.sum(resid ** 2)
+    lam = 1e-3
+    nfev = 1
+    success, message = False, "The maximum number of iterations is exceeded."
+    for _ in range(max_iter):
+        J = _free_partials(model, x, P[trace], free_index)
+        G, g = _block_normal_equations(J, resid, trace, n_traces)
+        if not np.any(g):
+            # no step can reduce the cost at a stationary point
+            success, message = True, "The gradient of the sum of squares is zero."
+            break
+
+        # damped Gauss-Newton step, with Marquardt scaling of the damping by the diagonal of J.T @ J
+        diag = np.maximum(np.einsum("npp->np", G), 1e-12)
+        diag[:, :n_shared] = diag[:, :n_shared].sum(axis=0)
+        delta_shared, delta_local = _solve_block_normal_equations(G, g, n_shared, lam * diag)
+        stalled = False
+        while True:
+            P_new = P.copy()
+            P_new[:, free_index] = np.clip(P[:, free_index] + np.column_stack([np.tile(delta_shared, (n_traces, 1)), delta_local]), lower, upper)
+            resid_new = residuals(P_new)
+            cost_new = np.sum(resid_new ** 2)
+            nfev += 1
+            reduction = cost - cost_new
+            if np.isfinite(cost_new) and reduction > 0:
+                break
+            # increase the damping until the step reduces the cost
+            lam *= 10
+            if lam > 1e16:
+                stalled = True
+                break
+            delta_shared, delta_local = _solve_block_normal_equations(G, g, n_shared, lam * diag)
+        if stalled:
+            # the tolerances were not reached, so the fit is reported as not converged
+            success, message = False, "The fit stalled, as no step reduced the sum of squares before the damping exceeded 1e16."
+            break
+
+        step = np.concatenate([delta_shared, delta_local.ravel()])
+        free_params = np.concatenate([P_new[0, shared_index], P_new[:, local_index].ravel()])
+        P, resid, cost = P_new, resid_new, cost_new
+        lam *= 0.1
+        if reduction <= ftol * cost:
+            success, message = True, "The relative reduction of the sum of squares is below ftol."
+            break
+        if np.linalg.norm(step) <= xtol * (np.linalg.norm(free_params) + xtol):
+            success, message = True, "The relative step size is below xtol."
+            break
+
+    J = _free_partials(model, x, P[trace], free_index)
+    G, g = _block_normal_equations(J, resid, trace, n_traces)
+    dof = y.size - n_shared - n_traces * len(local_index)
+    variance = cost / dof if dof > 0 else np.nan
+    se = np.full(P.shape, np.nan)
+    se[:, free_index] = _block_standard_errors(G, n_shared, variance)
+    return GlobalFitResult(param_names, list(shared), P, se, success, message, nfev, cost / 2)
+
+def _free_partials(model, x, P, free_index):
+    """Partial derivatives of the free parameters at each datapoint, shape (n_datapoints, n_free).
+    P contains the parameters of the trace of each datapoint, shape (n_datapoints, n_params)."""
+    with np.errstate(over="ignore", invalid="ignore"):
+        partials = model.partials(x, *P.T)
+    return np.column_stack([np.broadcast_to(partials[i], x.shape) for i in free_index])
+
+def _block_normal_equations(J, resid, trace, n_traces):
+    """J.T @ J and J.T @ resid of each trace, with shapes (n_traces, n_free, n_free) and (n_traces, n_free).
+
+    Together, these blocks give the normal equations of the global fit. The sums over the datapoints of each trace
+    are calculated with np.bincount, for traces of any length.
+    """
+    n_free = J.shape[1]
+    G = np.empty((n_traces, n_free, n_free))
+    g = np.empty((n_traces, n_free))
+    for i in range(n_free):
+        g[:, i] = np.bincount(trace, weights=J[:, i] * resid, minlength=n_traces)
+        for j in range(i, n_free):
+            G[:, i, j] = G[:, j, i] = np.bincount(trace, weights=J[:, i] * J[:, j], minlength=n_traces)
+    return G, g
+
+def _solve_block_normal_equations(G, g, n_shared, damping):
+    """Solves the damped normal equations of the global fit, by eliminating the local parameters of each trace.
+
+    With A = sum of the shared blocks of G, B_i the coupling of the shared and local parameters and D_i the local block
+    of each trace, the equations are
+        A @ d_shared + sum(B_i @ d_local_i) = sum(g_shared_i)
+        B_i.T @ d_shared + D_i @ d_local_i = g_local_i
+    Substituting d_local_i from the second equation gives the shared step from the Schur complement
+    S = A - sum(B_i @ inv(D_i) @ B_i.T), followed by the local step of each trace.
+
+    Returns
+    -------
+    delta_shared : np.ndarray
+        Step of the shared parameters, shape (n_shared,).
+    delta_local : np.ndarray
+        Step of the local parameters of each trace, shape (n_traces, n_local).
+    """
+    G = G + damping[:, :, None] * np.eye(G.shape[1])
+    A = G[:, :n_shared, :n_shared].sum(axis=0)
+    B = G[:, :n_shared, n_shared:]
+    D_inv = np.linalg.pinv(G[:, n_shared:, n_shared:])
+    g_local = g[:, n_shared:]
+    D_inv_g = np.einsum("nij,nj->ni", D_inv, g_local)
+    S = A - np.einsum("nij,njk,nlk->il", B, D_inv, B)
+    delta_shared = np.linalg.pinv(S) @ (g[:, :n_shared].sum(axis=0) - np.einsum("nij,nj->i", B, D_inv_g))
+    delta_local = D_inv_g - np.einsum("nij,nkj,k->ni", D_inv, B, delta_shared)
+    return delta_shared, delta_local
+
+def _block_standard_errors(G, n_shared, variance):
+    """Standard errors of the shared and local parameters, from the blocks G of J.T @ J of each trace.
+
+    The covariance of the shared parameters is inv(S), where S is the Schur complement of
+    _solve_block_normal_equations, and the covariance of the local parameters of each trace is
+    inv(D_i) + inv(D_i) @ B_i.T @ inv(S) @ B_i @ inv(D_i), both scaled by the residual variance.
+
+    Returns
+    -------
+    se : np.ndarray
+        Standard errors of the shared and local parameters of each trace, shape (n_traces, n_free).
+        The shared parameters have the same standard error in each row.
+    """
+    n_traces = G.shape[0]
+    A = G[:, :n_shared, :n_shared].sum(axis=0)
+    B = G[:, :n_shared, n_shared:]
+    D_inv = np.linalg.pinv(G[:, n_shared:, n_shared:])
+    S_inv = np.linalg.pinv(A - np.einsum("nij,njk,nlk->il", B, D_inv, B))
+    # inv(D_i) @ B_i.T, shape (n_traces, n_local, n_shared)
+    DB = np.einsum("nij,nkj->nik", D_inv, B)
+    cov_local = D_inv + np.einsum("nij,jk,nlk->nil", DB, S_inv, DB)
+    var = np.concatenate([np.tile(np.diag(S_inv), (n_traces, 1)), np.diagonal(cov_local, axis1=1, axis2=2)], axis=1) * variance
+    var[~np.isfinite(var) | (var < 0)] = np.nan
+    return np.sqrt(var)
+
+def _initial_params(model, x_list, y_list, p0, fixed):
+    """Initial parameters of each trace, shape (n_traces, n_params), with the fixed parameters set to their values."""
+    n_traces, n_params = len(x_list), len(model.param_names)
+    if p0 is not None:
+        P0 = np.array(np.broadcast_to(np.asarray(p0, dtype=float), (n_traces, n_params)))
+    else:
+        P0 = np.ones((n_traces, n_params))
+        for n, (xi, yi) in enumerate(zip(x_list, y_list)):
+            estimate = model.estimate(np.asarray(xi, dtype=float), np.asarray(yi, dtype=float))
+            if estimate is not None:
+                P0[n] = estimate
+    for name, value in fixed.items():
+        P0[:, model.param_names.index(name)] = value
+    return P0
+
+def _get_segment(time, anisotropy, fit, settings):
+    """Time and anisotropy of the datapoints of a single sample used by a fit, as selected in calc.fit_curves, and r_max."""
+    y_fit_savgol, r_max, r_max_index, r_max_time = find_r_max(time, anisotropy, settings.savgol_window, settings.savgol_order, settings.refine_peak)
+    start_seg1 = int(find_start_seg1(time, r_max_index, settings))
+    if fit in ["2phasedecay", "anisotropy_decay"]:
+        return time[start_seg1:], anisotropy[start_seg1:], r_max
+    two_phase_popt = None
+    if settings.segment_mode == "auto":
+        two_phase_popt = utils.two_phase_exp_decay_model.estimate(time[start_seg1:], anisotropy[start_seg1:])
+    end_seg1 = int(find_end_seg1(time, start_seg1, settings, two_phase_popt))
+    if fit == "seg1":
+        return time[start_seg1:end_seg1 + 1], anisotropy[start_seg1:end_seg1 + 1], r_max
+    return time[end_seg1:], anisotropy[end_seg1:], r_max
+
+def _get_input_files(data_dir, file_list=None):
+    """Paths of the input text files in a directory, optionally only those in file_list."""
+    csv_files = sorted(glob.glob(os.path.join(data_dir, "*.txt")))
+    if file_list is not None:
+        csv_files = [csv for csv in csv_files if os.path.basename(csv) in file_list]
+    if not csv_files:
+        raise ValueError("No input text files found in {}".format(data_dir))
+    return csv_files
+
+class GlobalFitResult:
+    """
+    Result of global_fit.
+
+    Attributes
+    ----------
+    param_names : list
+        Names of the parameters of the model.
+    shared : list
+        Names of the shared parameters.
+    params : np.ndarray
+        Fitted parameters of each trace, shape (n_traces, n_params). Shared parameters have the same value
+        in each row, and fixed parameters their fixed value.
+    se : np.ndarray
+        Standard errors of params. NaN for fixed parameters.
+    success : bool
+        True if the block Levenberg-Marquardt solver of global_fit converged, i.e. the relative reduction of the
+        sum of squares was below ftol, the relative step was below xtol, or the gradient was zero.
+        False if the maximum number of iterations was exceeded, or the fit stalled.
+    message : str
+        Description of the cause of termination.
+    nfev : int
+        Number of function evaluations.
+    cost : float
+        Half of the sum of squared residuals of all traces.
+    """
+    def __init__(self, param_names, shared, params, se, success, message, nfev, cost):
+        self.param_names = param_names
+        self.shared = shared
+        self.params = params
+        self.se = se
+        self.success = success
+        self.message = message
+        self.nfev = nfev
+        self.cost = cost
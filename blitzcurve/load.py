@@ -0,0 +1,112 @@
+import glob
+import os
+
+import numpy as np
+
+# columns of the input text files. time_ns and anisotropy are required, fit and wres are optional.
+INPUT_COLUMNS = ["time_ns", "anisotropy", "fit", "wres"]
+
+def read_anisotropy_file(csv):
+    """Reads a single input text file into contiguous float64 arrays.
+
+    Only the time_ns, anisotropy, fit and wres columns are parsed. The index column and
+    any other columns are skipped. This is faster than creating a full pandas DataFrame.
+
+    Input files look like this (the fit and wres columns from the matlab fit are optional):
+    ,time_ns,anisotropy,fit,wres
+    150,2.400,0.379667,0.383769,-0.004102
+    151,2.416,0.378772,0.382971,-0.004199
+
+    Parameters
+    ----------
+    csv : str
+        Path to input .txt file.
+
+    Returns
+    -------
+    data : InputData
+        Object with the filename, and time, anisotropy, fit and wres arrays.
+        fit and wres are None if the columns are not in the file.
+
+    Usage
+    -----
+    data = read_anisotropy_file(csv)
+    summ_dict, fd = fit_curves(data.time, data.anisotropy, fit=data.fit)
+    """
+    with open(csv) as f:
+        header = [name.strip().strip('"') for name in f.readline().split(",")]
+    for required in INPUT_COLUMNS[:2]:
+        if required not in header:
+            raise ValueError("{} does not contain a {} column. Columns found: {}".format(csv, required, header))
+    columns = [name for name in INPUT_COLUMNS if name in header]
+    usecols = [header.index(name) for name in columns]
+    values = np.loadtxt(csv, delimiter=",", skiprows=1, usecols=usecols, ndmin=2)
+    arrays = {name: np.ascontiguousarray(values[:, i]) for i, name in enumerate(columns)}
+    return InputData(os.path.basename(csv), arrays["time_ns"], arrays["anisotropy"], arrays.get("fit"), arrays.get("wres"))
+
+def load_directory(data_dir, file_list=None):
+    """Loads all input text files in a directory into one stacked anisotropy array.
+
+    All files must share the same time axis. The output can be used directly in blitzcurve.batch.fit_batch.
+
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files.
+    file_list : list
+        Optional list of filenames to load, e.g. ["10nM-FGC1-2min_aniso.txt"].
+        Default is None, which loads all .txt files in the directory.
+
+    Returns
+    -------
+    filenames : list
+        Filenames of the samples, in the order of the rows of anisotropy.
+    time : np.ndarray
+        Shared time axis, shape (n_timepoints,).
+    anisotropy : np.ndarray
+        Anisotropy of all samples, shape (n_samples, n_timepoints).
+
+    Usage
+    -----
+    filenames, time, anisotropy = load_directory(data_dir)
+    results = blitzcurve.batch.fit_batch(time, anisotropy)
+    """
+    csv_files = sorted(glob.glob(os.path.join(data_dir, "*.txt")))
+    if file_list is not None:
+        csv_files = [csv for csv in csv_files if os.path.basename(csv) in file_list]
+    if not csv_files:
+        raise ValueError("No input text files found in {}".format(data_dir))
+
+    data_list = [read_anisotropy_file(csv) for csv in csv_files]
+    time = data_list[0].time
+    for data in data_list[1:]:
+        if not np.array_equal(data.time, time):
+            raise ValueError("{} does not have the same time axis as {}. "
+                             "Use read_anisotropy_file to load the files individually.".format(data.filename, data_list[0].filename))
+    anisotropy = np.vstack([data.anisotropy for data in data_list])
+    return [data.filename for data in data_list], time, anisotropy
+
+
+class InputData:
+    """
+    Raw data from a single input text file.
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the input file.
+    time : np.ndarray
+        Time in nanoseconds.
+    anisotropy : np.ndarray
+        Anisotropy for each timepoint.
+    fit : np.ndarray or None
+        Rotational correlation fit from the original input file, if available.
+    wres : np.ndarray or None
+        Weighted residuals of the fit from the original input file, if available.
+    """
+    def __init__(self, filename, time, anisotropy, fit=None, wres=None):
+        self.filename = filename
+        self.time = time
+        self.anisotropy = anisotropy
+        self.fit = fit
+        self.wres = wres
@@ -0,0 +1,78 @@
+import contextlib
+import os
+import time
+import pandas as pd
+
+class StageMetrics:
+    """
+    Wall time of each stage, and optimiser evaluation counts, for a single sample (or a single run of run_compare).
+
+    Times are stored in ms as "<stage>_ms". Evaluation counts of curve_fit are stored as "<fit>_nfev" (function evaluations)
+    and "<fit>_njev" (Jacobian evaluations). With the analytic Jacobians, curve_fit evaluates the Jacobian
+    once per Levenberg-Marquardt iteration, so njev is the number of iterations.
+
+    Usage
+    -----
+    metrics = StageMetrics()
+    with metrics.stage("load"):
+        data = read_anisotropy_file(csv)
+    popt, pcov, infodict, mesg, ier = model.curve_fit(x, y, full_output=True)
+    metrics.record_fit("seg1", infodict)
+    metrics.lap("plot")
+    metrics.values
+    {'load_ms': 0.61, 'seg1_nfev': 9, 'seg1_njev': 8, 'plot_ms': 1203.4}
+    """
+    def __init__(self):
+        self.values = {}
+        self._last_lap = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that adds the wall time of the enclosed code to "<name>_ms", including if it raises an error."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name + "_ms", (time.perf_counter() - start) * 1000)
+
+    def lap(self, name):
+        """Adds the wall time since the previous lap (or since the object was created) to "<name>_ms".
+
+        Laps are independent of stages, so a lap includes any stages that were timed within it.
+        """
+        now = time.perf_counter()
+        self.add(name + "_ms", (now - self._last_lap) * 1000)
+        self._last_lap = now
+
+    def add(self, name, value):
+        """Adds a value to a metric, e.g. if a stage is carried out more than once."""
+        self.values[name] = self.values.get(name, 0) + value
+
+    def record_fit(self, name, infodict):
+        """Records the evaluation counts from the infodict of curve_fit(..., full_output=True)."""
+        self.values[name + "_nfev"] = infodict["nfev"]
+        if "njev" in infodict:
+            self.values[name + "_njev"] = infodict["njev"]
+
+def timed(metrics, name):
+    """Returns metrics.stage(name), or a context manager that does nothing if metrics is None."""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.stage(name)
+
+def write_metrics_csv(nested_metrics_dict, metrics_csv):
+    """Saves the metrics of all samples, with one row per sample and one column per metric.
+
+    Parameters
+    ----------
+    nested_metrics_dict : dict
+        Dictionary of StageMetrics.values, with the filename as key.
+    metrics_csv : str
+        Path of the csv, e.g. os.path.join(data_dir, "summary", "fit_metrics.csv")
+    """
+    df = pd.DataFrame(nested_metrics_dict).T
+    df.index.name = "filename"
+    if not os.path.isdir(os.path.dirname(metrics_csv)):
+        os.makedirs(os.path.dirname(metrics_csv))
+    df.to_csv(metrics_csv)
+    return df
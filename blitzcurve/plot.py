@@ -0,0 +1,440 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from blitzcurve.decimate import decimate_for_axes, decimate_scatter_for_axes
+from blitzcurve.metrics import timed
+
+def plot_single_sample(summ_dict, fd, fc, p, figs_to_plot="all", render_mode="new", metrics=None, decimate="minmax"):
+    """Plots the fitted curves of a single sample.
+
+    Takes the output of blitzcurve.calc.fit_curves, so that plotting is a separate,
+    optional stage after the fitting.
+
+    Parameters
+    ----------
+    summ_dict : dict
+        Dictionary with summary data for that single sample.
+    fd : OutputFitData
+        Output fit data object, with the fitted curves.
+    fc : utils.FlourescentColours
+        Fluorescent colours object with some useful colours for plotting.
+    p : FitFilePaths
+        File path object with the various output file locations
+    figs_to_plot : str, list
+        List of figures to plot. Default is "all" (all figures).
+        "rotat" = rotation fit
+            Figure from fit in original input file, designed to measure w (rotation).
+        "savgol" = Savitzky-Golay fit
+        "seg1" = fit to segment 1 of anisotropy data
+        "seg2" = fit to segment 2 of anisotropy data
+        "2phasedecay" = two phase exponential decay fit
+        "anisotropy_decay" = time resolved anisotropy decay fit
+        Figures of fits that failed, or whose stage was not run (see calc.FitSettings.stages), are skipped.
+    render_mode : str
+        "new" = each figure is created from scratch (default)
+        "reuse" = template figures are created once per process, and only updated with the data of each sample.
+            This is faster when plotting many samples. See FigureTemplates.
+    metrics : metrics.StageMetrics
+        Optional object that records the wall time of each figure, e.g. "plot_seg1_ms".
+    decimate : str
+        Decimation of long traces to the resolution of the saved figure, before plotting (see blitzcurve.decimate).
+        Traces with at most two datapoints per pixel column are always plotted in full.
+        "minmax" = lines keep the lowest and highest datapoint of each pixel column, so that peaks stay visible (default)
+        "lttb" = lines are decimated with the largest triangle three buckets algorithm
+        "none" = all datapoints are plotted
+        In both "minmax" and "lttb", markers of the raw data that are hidden by other markers are not plotted.
+
+    Saved Files
+    -----------
+    p.rotat_fit_png : rotation fit and scatter plot
+    p.savgol_fit_png : savitzky-golay fit and scatter plot
+    p.savgol_fit_peak_png : zoom of savitzky-golay fit to show only the peak, to check accuracy of r_max
+    p.exp_fit_seg1_png : exponential fit to segment 1
+    p.exp_fit_seg2_png : exponential fit to segment 2
+    p.two_comp_exp_decay_png : two phase exponential decay fit
+    p.time_resolved_anisotropy_decay_png : time resolved anisotropy decay fit
+    """
+    if render_mode == "reuse":
+        _get_figure_templates(fc).plot_single_sample(summ_dict, fd, p, figs_to_plot, metrics, decimate)
+        return
+    if render_mode != "new":
+        raise ValueError("render_mode should be 'new' or 'reuse', not '{}'".format(render_mode))
+    if fig_is_selected("rotat", figs_to_plot) and _fit_available(fd, "rotat"):
+        with timed(metrics, "plot_rotat"):
+            plot_rotat(fd, fc, p.rotat_fit_png, decimate)
+    if fig_is_selected("savgol", figs_to_plot) and _fit_available(fd, "savgol"):
+        with timed(metrics, "plot_savgol"):
+            plot_savgol(summ_dict, fd, fc, p.savgol_fit_png, decimate)
+            plot_savgol_peak(summ_dict, fd, fc, p.savgol_fit_peak_png, decimate)
+    if fig_is_selected("seg1", figs_to_plot) and _fit_available(fd, "seg1"):
+        with timed(metrics, "plot_seg1"):
+            plot_seg1(summ_dict, fd, fc, p.exp_fit_seg1_png, decimate)
+    if fig_is_selected("seg2", figs_to_plot) and _fit_available(fd, "seg2"):
+        with timed(metrics, "plot_seg2"):
+            plot_seg2(summ_dict, fd, fc, p.exp_fit_seg2_png, decimate)
+    if fig_is_selected("2phasedecay", figs_to_plot) and _fit_available(fd, "2phasedecay"):
+        with timed(metrics, "plot_2phasedecay"):
+            plot_two_phase_exp_decay(summ_dict, fd, fc, p.two_comp_exp_decay_png, decimate)
+    if fig_is_selected("anisotropy_decay", figs_to_plot) and _fit_available(fd, "anisotropy_decay"):
+        with timed(metrics, "plot_anisotropy_decay"):
+            plot_time_resolved_anisotropy_decay(summ_dict, fd, fc, p.time_resolved_anisotropy_decay_png, decimate)
+
+def fig_is_selected(fig_name, figs_to_plot):
+    """Returns True if a figure is selected in figs_to_plot (e.g. "all", or a list containing "seg1")."""
+    if figs_to_plot is None:
+        return False
+    if isinstance(figs_to_plot, str):
+        figs_to_plot = [figs_to_plot]
+    return "all" in figs_to_plot or fig_name in figs_to_plot
+
+def _fit_available(fd, fig_name):
+    """Returns False if the data shown in a figure is missing, so that the figure is skipped.
+
+    This is the case if the fit failed, or if its stage was not run (see calc.fit_curves), or for the
+    rotation fit, if the input file did not contain a fit column.
+    """
+    data = {"rotat": fd.rotat_fit, "savgol": fd.y_fit_savgol, "seg1": fd.seg1_xfit, "seg2": fd.seg2_xfit,
+            "2phasedecay": fd.tped_xfit, "anisotropy_decay": fd.trad_xfit}[fig_name]
+    return data is not None
+
+def _scatter_raw_data(ax, fd, fc, decimate="minmax", xlim=None, ylim=None, **kwargs):
+    """Scatter plot of the raw anisotropy data. Hidden markers are removed from long traces (see decimate_scatter_for_axes)."""
+    x, y = decimate_scatter_for_axes(ax, fd.time, fd.anisotropy, decimate, None, xlim, ylim, kwargs.get("s"))
+    ax.scatter(x, y, color=fc.green, label="data", **kwargs)
+    ax.set_xlabel("time_ns")
+    ax.set_ylabel("anisotropy")
+
+def _add_segment_rectangle(ax, x):
+    """Adds the shading rectangle behind the fitted segment, from the first to the last x value."""
+    # zorder is used to send the rectangle to the back
+    ymin, ymax = ax.get_ylim()
+    height = ymax - ymin
+    width = x[-1] - x[0]
+    rect = Rectangle((x[0], ymin), width, height, color="0.2", zorder=1)
+    ax.add_patch(rect)
+
+#########################################################################
+#      Annotation text and position of each figure, as (text, xy)       #
+#########################################################################
+def _savgol_annotation(summ_dict, fd):
+    # annotate the anosotropy associated with the peak on the graph
+    peak_string = "max anisotropy : {:.02f}\n   time : {:.02f} ns".format(summ_dict["r_max"], summ_dict["r_max_time"])
+    return peak_string, (summ_dict["r_max_time"] + 0.2, summ_dict["r_max"] - 0.02)
+
+def _savgol_peak_annotation(summ_dict, fd):
+    peak_string = "max anisotropy : {:.02f}\ntime : {:.02f} ns".format(summ_dict["r_max"], summ_dict["r_max_time"])
+    return peak_string, (summ_dict["r_max_time"] + 0.1, summ_dict["r_max"] + 0.005)
+
+def _seg1_annotation(summ_dict, fd):
+    x = fd.time[fd.start_seg1:fd.end_seg1 + 1]
+    y = fd.anisotropy[fd.start_seg1:fd.end_seg1 + 1]
+    function_string = r"y = %0.2f * $e^{(-%0.2fx)}$ + %0.2f" % (summ_dict["a_seg1"], summ_dict["b_seg1"], summ_dict["c_seg1"])
+    return function_string, (np.median(x) + 0.2, np.median(y) + 0.05)
+
+def _seg2_annotation(summ_dict, fd):
+    x = fd.time[fd.start_seg2:]
+    y = fd.anisotropy[fd.start_seg2:]
+    function_string = r"y = %0.2f * $e^{(-%0.2fx)}$ + %0.2f" % (summ_dict["a_seg2"], summ_dict["b_seg2"], fd.r_inf_seg2)
+    return function_string, (x[0] + 0.2, y[0] + 0.05)
+
+def _two_phase_exp_decay_annotation(summ_dict, fd):
+    x = fd.time[fd.start_seg1:]
+    y = fd.anisotropy[fd.start_seg1:]
+    # plateau + SpanFast * np.exp(-Kfast * x) + SpanSlow * np.exp(-Kslow * x)
+    params = tuple(summ_dict[k] for k in ["plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow"])
+    function_string = r"y = %0.2f + %0.2f * $e^{(-%0.2fx)} + %0.2f * e^{(-%0.2fx)}$" % params
+    return function_string, (x[0] + 0.2, y[0] + 0.05)
+
+def _time_resolved_anisotropy_decay_annotation(summ_dict, fd):
+    x = fd.time[fd.start_seg1:]
+    y = fd.anisotropy[fd.start_seg1:]
+    function_string = r"r(t) = (%0.2f-%0.2f) * $e^{(-2*%0.2f*t)}$ + %0.2f" % (summ_dict["r_max"], summ_dict["r_inf"], summ_dict["transfer_rate"], summ_dict["r_inf"])
+    return function_string, (np.median(x) - 0.5, np.median(y) + 0.1)
+
+#########################################################################
+#    Scatter/Line plot with original fit designed to measure rotation   #
+#########################################################################
+def plot_rotat(fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    _scatter_raw_data(ax, fd, fc, decimate, s=20)
+    ax.plot(*decimate_for_axes(ax, fd.time, fd.rotat_fit, decimate), color=fc.red, label="rotational correlation fit")
+    ax.legend()
+    fig.savefig(png)
+
+#########################################################################
+#               Scatter/Line plot with Savitzky-Golay fit               #
+#########################################################################
+def plot_savgol(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    #plot raw data
+    _scatter_raw_data(ax, fd, fc, decimate, s=1)
+    # plot fit data
+    ax.plot(*decimate_for_axes(ax, fd.time, fd.y_fit_savgol, decimate), color=fc.red, label="savitzky-golay fit")
+    ax.set_title("savitzky-golay fit")
+    ax.legend()
+
+    # annotate the anosotropy associated with the peak on the graph
+    ax.annotate(*_savgol_annotation(summ_dict, fd), color=fc.red)
+
+    # resolution is set by the render profile (savefig.dpi, see utils.setup_matplotlib_dark_background)
+    fig.savefig(png)
+
+#########################################################################
+#       plot of only the peak region, to check accuracy of r_max        #
+#########################################################################
+def plot_savgol_peak(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    #  hard-coded xlim and ylim are not very flexible, but work right now..
+    xlim, ylim = (0.4, 2), (0.3, 0.6)
+    _scatter_raw_data(ax, fd, fc, decimate, xlim=xlim, ylim=ylim, s=1)
+    ax.plot(*decimate_for_axes(ax, fd.time, fd.y_fit_savgol, decimate, xlim=xlim), color=fc.red, label="savitzky-golay fit")
+    ax.legend()
+    ax.set_xlim(*xlim)
+    ax.set_ylim(*ylim)
+    ax.set_title("savitzky-golay fit for peak only")
+
+    # annotate the anosotropy associated with the peak on the graph
+    ax.annotate(*_savgol_peak_annotation(summ_dict, fd), color=fc.red)
+
+    fig.savefig(png)
+
+#########################################################################
+#          Scatter/Line plot with segment 1 exponential fit             #
+#########################################################################
+def plot_seg1(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    # plot raw datapoints
+    _scatter_raw_data(ax, fd, fc, decimate, s=1, zorder=2)
+
+    # x (time) for only this segment
+    x = fd.time[fd.start_seg1:fd.end_seg1 + 1]
+
+    # annotate the function on the graph
+    ax.annotate(*_seg1_annotation(summ_dict, fd), color=fc.magenta)
+
+    # plot the exponential fit to this section
+    ax.plot(*decimate_for_axes(ax, fd.seg1_xfit, fd.seg1_yfit, decimate), color=fc.magenta, label="exponential fit")
+    _add_segment_rectangle(ax, x)
+
+    ax.set_title("fit to segment 1")
+    ax.legend()
+    fig.savefig(png)
+
+#########################################################################
+#          Scatter/Line plot with segment 2 exponential fit             #
+#########################################################################
+def plot_seg2(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    _scatter_raw_data(ax, fd, fc, decimate, s=1, zorder=2)
+
+    x = fd.time[fd.start_seg2:]
+
+    # annotate the function on the graph. Note that r_inf in the summary is from the anisotropy decay fit.
+    ax.annotate(*_seg2_annotation(summ_dict, fd), color=fc.pink)
+
+    # plot the exponential fit to this section
+    ax.plot(*decimate_for_axes(ax, fd.seg2_xfit, fd.seg2_yfit, decimate), color=fc.pink, label="exponential fit segment 2")
+    # plot the r_inf as a horizontal line
+    ax.hlines(fd.r_inf_seg2, 0, fd.seg2_xfit[-1], color=fc.pink)
+    _add_segment_rectangle(ax, x)
+
+    ax.set_title("fit to segment 2")
+    ax.legend()
+    fig.savefig(png)
+
+#########################################################################
+#           2-phase exponential day fit to segments 1 & 2              #
+#########################################################################
+def plot_two_phase_exp_decay(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    _scatter_raw_data(ax, fd, fc, decimate, s=1, zorder=2)
+
+    x = fd.time[fd.start_seg1:]
+
+    # annotate the function on the graph
+    ax.annotate(*_two_phase_exp_decay_annotation(summ_dict, fd), color=fc.blue, fontsize=10)
+
+    # plot the fit to this section
+    ax.plot(*decimate_for_axes(ax, fd.tped_xfit, fd.tped_yfit, decimate), color=fc.blue, label="fit")
+    # plot the plateau as a horizontal line
+    ax.hlines(summ_dict["plateau"], 0, fd.tped_xfit[-1], color=fc.blue)
+    _add_segment_rectangle(ax, x)
+
+    ax.set_title("two phase exponential decay fit")
+    ax.legend()
+    fig.savefig(png)
+
+#########################################################################
+#     Time resolved anisotropy decay fit for slowly rotating dyes       #
+#########################################################################
+def plot_time_resolved_anisotropy_decay(summ_dict, fd, fc, png, decimate="minmax"):
+    plt.close("all")
+    fig, ax = plt.subplots()
+    _scatter_raw_data(ax, fd, fc, decimate, s=1, zorder=2)
+
+    x = fd.time[fd.start_seg1:]
+
+    # annotate the function on the graph
+    ax.annotate(*_time_resolved_anisotropy_decay_annotation(summ_dict, fd), color=fc.magenta)
+
+    # plot the fit to this section
+    ax.plot(*decimate_for_axes(ax, fd.trad_xfit, fd.trad_yfit, decimate), color=fc.blue, label="fit")
+    # plot the r_inf as a horizontal line
+    ax.hlines(summ_dict["r_inf"], 0, fd.trad_xfit[-1], color=fc.blue)
+    _add_segment_rectangle(ax, x)
+
+    ax.set_title("time resolved anisotropy decay fit for slowly rotating dyes ")
+    ax.legend()
+    fig.savefig(png)
+
+#########################################################################
+#         Reusable template figures, updated with each sample           #
+#########################################################################
+# templates of the current process, created on first use by plot_single_sample(render_mode="reuse")
+_figure_templates = None
+
+def _get_figure_templates(fc):
+    global _figure_templates
+    if _figure_templates is None:
+        _figure_templates = FigureTemplates(fc)
+    return _figure_templates
+
+class FigureTemplates:
+    """
+    Template figures that are built once, and updated with the data of each sample before saving.
+
+    Gives the same figures as the plot_* functions, without re-creating figures, axes, tick locators and text
+    for every sample. Only the scatter and line data, the segment rectangle, the annotations and the axis limits
+    are updated. The figures are not managed by pyplot, so plt.close("all") elsewhere does not affect them.
+
+    Parameters
+    ----------
+    fc : utils.FlourescentColours
+        Fluorescent colours object with some useful colours for plotting.
+
+    Usage
+    -----
+    templates = FigureTemplates(fc)
+    for ...:
+        templates.plot_single_sample(summ_dict, fd, p, figs_to_plot)
+    """
+    def __init__(self, fc):
+        self.figs = {}
+
+        fig, ax = self._new_figure()
+        artists = {"scatter": ax.scatter([], [], color=fc.green, label="data", s=20)}
+        artists["lines"] = ax.plot([], [], color=fc.red, label="rotational correlation fit")
+        self._finish(fig, ax, artists, "rotat")
+
+        fig, ax = self._new_figure()
+        artists = {"scatter": ax.scatter([], [], color=fc.green, label="data", s=1)}
+        artists["lines"] = ax.plot([], [], color=fc.red, label="savitzky-golay fit")
+        artists["annotation"] = ax.annotate("", (0, 0), color=fc.red)
+        self._finish(fig, ax, artists, "savgol", title="savitzky-golay fit")
+
+        fig, ax = self._new_figure()
+        artists = {"scatter": ax.scatter([], [], color=fc.green, label="data", s=1)}
+        artists["lines"] = ax.plot([], [], color=fc.red, label="savitzky-golay fit")
+        artists["annotation"] = ax.annotate("", (0, 0), color=fc.red)
+        ax.set_xlim(0.4, 2)
+        ax.set_ylim(0.3, 0.6)
+        artists["fixed_limits"] = True
+        self._finish(fig, ax, artists, "savgol_peak", title="savitzky-golay fit for peak only")
+
+        for name, color, label, has_hline, title in [("seg1", fc.magenta, "exponential fit", False, "fit to segment 1"),
+                                                     ("seg2", fc.pink, "exponential fit segment 2", True, "fit to segment 2"),
+                                                     ("2phasedecay", fc.blue, "fit", True, "two phase exponential decay fit"),
+                                                     ("anisotropy_decay", fc.blue, "fit", True, "time resolved anisotropy decay fit for slowly rotating dyes ")]:
+            fig, ax = self._new_figure()
+            artists = {"scatter": ax.scatter([], [], color=fc.green, label="data", s=1, zorder=2)}
+            annotation_color = fc.magenta if name == "anisotropy_decay" else color
+            annotation_kwargs = {"fontsize": 10} if name == "2phasedecay" else {}
+            artists["annotation"] = ax.annotate("", (0, 0), color=annotation_color, **annotation_kwargs)
+            artists["lines"] = ax.plot([], [], color=color, label=label)
+            if has_hline:
+                # horizontal line for r_inf or the plateau, as a line rather than ax.hlines, so that it is easy to update
+                artists["lines"] += ax.plot([], [], color=color)
+            artists["rect"] = Rectangle((0, 0), 0, 0, color="0.2", zorder=1)
+            ax.add_patch(artists["rect"])
+            self._finish(fig, ax, artists, name, title=title)
+
+    def _new_figure(self):
+        fig = Figure()
+        ax = fig.subplots()
+        ax.set_xlabel("time_ns")
+        ax.set_ylabel("anisotropy")
+        return fig, ax
+
+    def _finish(self, fig, ax, artists, name, title=None):
+        if title is not None:
+            ax.set_title(title)
+        ax.legend(handles=[artists["scatter"], artists["lines"][0]])
+        artists.update({"fig": fig, "ax": ax})
+        self.figs[name] = artists
+
+    def plot_single_sample(self, summ_dict, fd, p, figs_to_plot="all", metrics=None, decimate="minmax"):
+        """Updates the templates with a single sample and saves the selected figures. See plot_single_sample."""
+        if fig_is_selected("rotat", figs_to_plot) and _fit_available(fd, "rotat"):
+            self._save("rotat", fd, p.rotat_fit_png, [(fd.time, fd.rotat_fit)], metrics=metrics, decimate=decimate)
+        if fig_is_selected("savgol", figs_to_plot) and _fit_available(fd, "savgol"):
+            self._save("savgol", fd, p.savgol_fit_png, [(fd.time, fd.y_fit_savgol)], _savgol_annotation(summ_dict, fd), metrics=metrics, decimate=decimate)
+            self._save("savgol_peak", fd, p.savgol_fit_peak_png, [(fd.time, fd.y_fit_savgol)], _savgol_peak_annotation(summ_dict, fd), metrics=metrics, decimate=decimate)
+        if fig_is_selected("seg1", figs_to_plot) and _fit_available(fd, "seg1"):
+            self._save("seg1", fd, p.exp_fit_seg1_png, [(fd.seg1_xfit, fd.seg1_yfit)], _seg1_annotation(summ_dict, fd),
+                       fd.time[fd.start_seg1:fd.end_seg1 + 1], metrics=metrics, decimate=decimate)
+        if fig_is_selected("seg2", figs_to_plot) and _fit_available(fd, "seg2"):
+            lines = [(fd.seg2_xfit, fd.seg2_yfit), ([0, fd.seg2_xfit[-1]], [fd.r_inf_seg2] * 2)]
+            self._save("seg2", fd, p.exp_fit_seg2_png, lines, _seg2_annotation(summ_dict, fd), fd.time[fd.start_seg2:], metrics=metrics, decimate=decimate)
+        if fig_is_selected("2phasedecay", figs_to_plot) and _fit_available(fd, "2phasedecay"):
+            lines = [(fd.tped_xfit, fd.tped_yfit), ([0, fd.tped_xfit[-1]], [summ_dict["plateau"]] * 2)]
+            self._save("2phasedecay", fd, p.two_comp_exp_decay_png, lines, _two_phase_exp_decay_annotation(summ_dict, fd), fd.time[fd.start_seg1:], metrics=metrics, decimate=decimate)
+        if fig_is_selected("anisotropy_decay", figs_to_plot) and _fit_available(fd, "anisotropy_decay"):
+            lines = [(fd.trad_xfit, fd.trad_yfit), ([0, fd.trad_xfit[-1]], [summ_dict["r_inf"]] * 2)]
+            self._save("anisotropy_decay", fd, p.time_resolved_anisotropy_decay_png, lines,
+                       _time_resolved_anisotropy_decay_annotation(summ_dict, fd), fd.time[fd.start_seg1:], metrics=metrics, decimate=decimate)
+
+    def _save(self, name, fd, png, lines, annotation=None, rect_x=None, metrics=None, decimate="minmax"):
+        """Updates the artists of a single template figure and saves it."""
+        # the savgol peak figure is timed together with the savgol figure, as in plot_single_sample
+        with timed(metrics, "plot_savgol" if name == "savgol_peak" else "plot_" + name):
+            self._update_and_save(name, fd, png, lines, annotation, rect_x, decimate)
+
+    def _update_and_save(self, name, fd, png, lines, annotation, rect_x, decimate="minmax"):
+        artists = self.figs[name]
+        ax = artists["ax"]
+        # figures with fixed limits only show part of the trace, which is decimated to the visible range
+        xlim, ylim = (ax.get_xlim(), ax.get_ylim()) if artists.get("fixed_limits") else (None, None)
+        scatter = artists["scatter"]
+        x, y = decimate_scatter_for_axes(ax, fd.time, fd.anisotropy, decimate, None, xlim, ylim, scatter.get_sizes()[0])
+        scatter.set_offsets(np.column_stack([x, y]))
+        for line, (x, y) in zip(artists["lines"], lines):
+            line.set_data(*decimate_for_axes(ax, x, y, decimate, xlim=xlim))
+        if annotation is not None:
+            text, xy = annotation
+            artists["annotation"].set_text(text)
+            # position of the annotated point and of the text itself
+            artists["annotation"].xy = xy
+            artists["annotation"].xyann = xy
+
+        if not artists.get("fixed_limits"):
+            rect = artists.get("rect")
+            if rect is not None:
+                # the rectangle is excluded from the data limits, and spans the full height, as in _add_segment_rectangle
+                rect.set_visible(False)
+            # relim does not include the scatter (a collection), so the raw data is added separately
+            ax.relim(visible_only=True)
+            ax.update_datalim(np.column_stack([fd.time, fd.anisotropy]))
+            ax.autoscale_view()
+            if rect is not None:
+                ymin, ymax = ax.get_ylim()
+                rect.set_bounds(rect_x[0], ymin, rect_x[-1] - rect_x[0], ymax - ymin)
+                rect.set_visible(True)
+
+        artists["fig"].savefig(png)
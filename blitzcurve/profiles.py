@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+class RenderProfile:
+    """
+    Output format and resolution of the figures, and which per-sample figures are saved.
+
+    Parameters
+    ----------
+    name : str
+        Name of the profile, e.g. "preview". Used in the cache key, so that the figures are replotted if the profile changes.
+    fmt : str
+        File format of the figures: "png", "svg" or "pdf".
+    dpi : float
+        Resolution of the saved figures. For svg and pdf, this only sets the resolution to which long traces
+        are decimated (see blitzcurve.decimate), as the figures are vector graphics.
+    sample_figures : str
+        "all" = the figures of each sample are saved
+        "outliers" = only the figures of samples flagged by find_outliers are saved, after all samples are fitted.
+            The summary figures of run_compare are always saved.
+    outlier_threshold : float
+        Robust z-score above which a parameter is flagged as an outlier. See find_outliers.
+
+    Usage
+    -----
+    profile = RenderProfile("poster", fmt="pdf", dpi=300)
+    blitzcurve.run_fit(data_dir, render_profile=profile)
+    """
+    def __init__(self, name, fmt="png", dpi=240, sample_figures="all", outlier_threshold=3.5):
+        if fmt not in ["png", "svg", "pdf"]:
+            raise ValueError("fmt should be 'png', 'svg' or 'pdf', not '{}'".format(fmt))
+        if sample_figures not in ["all", "outliers"]:
+            raise ValueError("sample_figures should be 'all' or 'outliers', not '{}'".format(sample_figures))
+        self.name = name
+        self.fmt = fmt
+        self.dpi = dpi
+        self.sample_figures = sample_figures
+        self.outlier_threshold = outlier_threshold
+
+    def __repr__(self):
+        return "RenderProfile({!r}, fmt={!r}, dpi={!r}, sample_figures={!r})".format(self.name, self.fmt, self.dpi, self.sample_figures)
+
+# "standard" gives the same figures as earlier versions
+RENDER_PROFILES = {"standard": RenderProfile("standard"),
+                   "preview": RenderProfile("preview", dpi=72),
+                   "publication": RenderProfile("publication", dpi=600),
+                   "svg": RenderProfile("svg", fmt="svg"),
+                   "pdf": RenderProfile("pdf", fmt="pdf"),
+                   "summary": RenderProfile("summary", sample_figures="outliers")}
+
+def get_render_profile(render_profile):
+    """Returns the RenderProfile for a profile name in RENDER_PROFILES, or the profile itself if a RenderProfile is given."""
+    if isinstance(render_profile, RenderProfile):
+        return render_profile
+    if render_profile not in RENDER_PROFILES:
+        raise ValueError("render_profile should be one of {}, not '{}'".format(list(RENDER_PROFILES), render_profile))
+    return RENDER_PROFILES[render_profile]
+
+# parameters in the summary that are checked for outliers
+OUTLIER_COLUMNS = ["r_max", "r_max_time", "a_seg1", "b_seg1", "c_seg1", "a_seg2", "b_seg2", "r_inf",
+                   "plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow", "transfer_rate"]
+
+def find_outliers(df, threshold=3.5, columns=None):
+    """Flags samples whose fits failed, or whose parameters differ strongly from the other samples of the run.
+
+    Each parameter is compared with the median of all samples, using the modified z-score of Iglewicz and Hoaglin,
+    0.6745 * (x - median) / MAD, where MAD is the median absolute deviation. Unlike the mean and standard deviation,
+    the median and MAD are not shifted by the outliers themselves. At least 3 samples are required for the comparison.
+    Samples where a fit failed, or was only successful with the fallback guesses (see the fit_status column),
+    and samples with a missing parameter that the other samples have, are always flagged.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Summary of all samples, as in summary/fit_summary.csv, with the filename as index.
+    threshold : float
+        Modified z-score above which a parameter is flagged.
+    columns : list
+        Parameters that are checked. Default is None, which uses OUTLIER_COLUMNS.
+
+    Returns
+    -------
+    outliers : pd.Series
+        Reasons for flagging each outlier sample, e.g. "Kslow; fit_status fallback", with the filename as index.
+        Samples that are not outliers are not included.
+    """
+    columns = OUTLIER_COLUMNS if columns is None else columns
+    reasons = {filename: [] for filename in df.index}
+    if "fit_status" in df.columns:
+        for filename, status in df["fit_status"].items():
+            if isinstance(status, str) and status != "ok":
+                reasons[filename].append("fit_status {}".format(status))
+    for column in columns:
+        if column not in df.columns:
+            continue
+        values = pd.to_numeric(df[column], errors="coerce")
+        # parameters of stages that were not run are NaN for all samples
+        if values.isna().all():
+            continue
+        for filename in values.index[values.isna()]:
+            reasons[filename].append("{} missing".format(column))
+        if values.notna().sum() < 3:
+            continue
+        median = values.median()
+        mad = (values - median).abs().median()
+        if mad == 0 or not np.isfinite(mad):
+            continue
+        z = 0.6745 * (values - median).abs() / mad
+        for filename in values.index[z > threshold]:
+            reasons[filename].append(column)
+    return pd.Series({filename: "; ".join(r) for filename, r in reasons.items() if r}, dtype=object)
@@ -0,0 +1,92 @@
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+from blitzcurve.plot import plot_single_sample
+from blitzcurve.utils import setup_matplotlib_dark_background
+
+class FigureRenderer:
+    """
+    Background rendering of the figures of each sample, so that fitting does not wait for PNG encoding and disk writes.
+
+    Samples are submitted with the output of blitzcurve.calc.fit_curves, and plotted by plot_single_sample
+    in separate worker processes (pyplot is not thread-safe). At most max_pending samples are queued or
+    being rendered at any time. If the queue is full, submit blocks until a sample has been rendered,
+    so the memory used by queued samples stays bounded.
+
+    Parameters
+    ----------
+    workers : int
+        Number of rendering processes.
+    max_pending : int
+        Maximum number of samples that are waiting to be rendered, or are being rendered.
+    dpi : float
+        Resolution of the saved figures. See profiles.RenderProfile.
+
+    Usage
+    -----
+    with FigureRenderer() as renderer:
+        for csv in csv_files:
+            summ_dict, fd = fit_curves(time, anisotropy)
+            renderer.submit(summ_dict, fd, fc, p, figs_to_plot)
+        failed = renderer.wait()
+    """
+    def __init__(self, workers=1, max_pending=8, dpi=240):
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(dpi,))
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, summ_dict, fd, fc, p, figs_to_plot="all", render_mode="new", decimate="minmax"):
+        """Queues the figures of a single sample for rendering. Blocks while max_pending samples are already queued."""
+        self._slots.acquire()
+        try:
+            future = self.executor.submit(_render_sample, summ_dict, fd, fc, p, figs_to_plot, render_mode, decimate)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append((p.filename, future))
+
+    def wait(self):
+        """Waits until all queued figures have been saved.
+
+        Returns
+        -------
+        failed : list
+            (filename, traceback) tuples for samples whose figures could not be plotted.
+        """
+        failed = []
+        for filename, future in self._futures:
+            try:
+                error = future.result()
+            except Exception:
+                # the rendering process itself died
+                error = traceback.format_exc()
+            if error is not None:
+                failed.append((filename, error))
+        self._futures = []
+        return failed
+
+    def close(self):
+        """Waits for all queued figures and shuts down the rendering processes."""
+        failed = self.wait()
+        self.executor.shutdown()
+        return failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+def _init_render_worker(dpi=240):
+    """Sets up the plot style in each rendering process."""
+    setup_matplotlib_dark_background(plt, dpi)
+
+def _render_sample(summ_dict, fd, fc, p, figs_to_plot, render_mode, decimate="minmax"):
+    """Plots a single sample in a rendering process. Returns a formatted traceback if plotting failed, otherwise None."""
+    try:
+        plot_single_sample(summ_dict, fd, fc, p, figs_to_plot, render_mode, decimate=decimate)
+    except Exception:
+        return traceback.format_exc()
+    return None
@@ -0,0 +1,126 @@
+import os
+import shutil
+
+import numpy as np
+from blitzcurve.calc import OutputFitData
+
+# arrays with one value per timepoint, padded with NaN to the longest trace
+TRACE_ARRAYS = ["time", "anisotropy", "y_fit_savgol", "rotat_fit"]
+# fitted curves, which all have the same length
+CURVE_ARRAYS = ["seg1_xfit", "seg1_yfit", "seg2_xfit", "seg2_yfit", "tped_xfit", "tped_yfit", "trad_xfit", "trad_yfit"]
+# one value per sample
+SCALARS = ["start_seg1", "end_seg1", "start_seg2", "r_inf_seg2"]
+
+class FitDataStore:
+    """
+    Consolidated, columnar store of the OutputFitData of all samples in a run.
+
+    This is an alternative to the individual fitdata pickles. The store is a directory with one .npy file per array,
+    each holding the values of all samples (e.g. y_fit_savgol has shape (n_samples, n_timepoints)).
+    Traces of different length are padded with NaN. The arrays are loaded as read-only memory maps,
+    so loading the store takes the same time regardless of the number of samples.
+
+    Parameters
+    ----------
+    store_dir : str
+        Path to the store directory, e.g. utils.OutDirPaths(data_dir).fitdata_store_dir
+    mmap : bool
+        If True, the arrays are memory-mapped rather than read into memory.
+
+    Usage
+    -----
+    FitDataStore.write(p.fitdata_store_dir, fd_list)
+    store = FitDataStore(p.fitdata_store_dir)
+    for fd in store:
+        ax.plot(fd.time, fd.y_fit_savgol)
+    """
+    def __init__(self, store_dir, mmap=True):
+        self.store_dir = store_dir
+        mmap_mode = "r" if mmap else None
+        self.arrays = {}
+        for name in os.listdir(store_dir):
+            if name.endswith(".npy"):
+                # plain ndarray views of the memory maps are much faster to index than np.memmap objects
+                self.arrays[name[:-4]] = np.load(os.path.join(store_dir, name), mmap_mode=mmap_mode).view(np.ndarray)
+        self.filenames = self.arrays["filenames"].tolist()
+        self._index = {filename: i for i, filename in enumerate(self.filenames)}
+        self._n_timepoints = self.arrays["n_timepoints"].tolist()
+        self._has_rotat_fit = self.arrays["has_rotat_fit"].tolist()
+        self._scalars = {name: self.arrays[name].tolist() for name in SCALARS}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename):
+        return filename in self._index
+
+    def __iter__(self):
+        for filename in self.filenames:
+            yield self.get(filename)
+
+    def get(self, filename):
+        """Returns an OutputFitData object for a single sample, with arrays that are views into the store."""
+        i = self._index[filename]
+        n_timepoints = self._n_timepoints[i]
+        fd = OutputFitData()
+        fd.filename = filename
+        for name in TRACE_ARRAYS:
+            setattr(fd, name, self.arrays[name][i, :n_timepoints])
+        if not self._has_rotat_fit[i]:
+            fd.rotat_fit = None
+        if n_timepoints and fd.y_fit_savgol[0] != fd.y_fit_savgol[0]:
+            # NaN, the savgol stage was not run
+            fd.y_fit_savgol = None
+        for name in CURVE_ARRAYS:
+            values = self.arrays[name][i]
+            # fits that failed are stored as NaN
+            setattr(fd, name, None if values.size == 0 or values[0] != values[0] else values)
+        for name in SCALARS:
+            value = self._scalars[name][i]
+            if value != value:
+                # NaN, value not available
+                value = None
+            elif name != "r_inf_seg2":
+                value = int(value)
+            setattr(fd, name, value)
+        return fd
+
+    @staticmethod
+    def write(store_dir, fd_list):
+        """Writes a list of OutputFitData objects to a new store, replacing any existing store.
+
+        Parameters
+        ----------
+        store_dir : str
+            Path to the store directory.
+        fd_list : list
+            List of OutputFitData objects, in the order in which they should be stored.
+        """
+        n_samples = len(fd_list)
+        n_timepoints = np.array([len(fd.time) for fd in fd_list], dtype=int)
+        max_len = n_timepoints.max() if n_samples else 0
+        curve_len = max([len(getattr(fd, name)) for fd in fd_list for name in CURVE_ARRAYS if getattr(fd, name, None) is not None] + [0])
+
+        arrays = {"filenames": np.array([fd.filename for fd in fd_list], dtype=str),
+                  "n_timepoints": n_timepoints,
+                  "has_rotat_fit": np.array([getattr(fd, "rotat_fit", None) is not None for fd in fd_list], dtype=bool)}
+        for names, length in [(TRACE_ARRAYS, max_len), (CURVE_ARRAYS, curve_len)]:
+            for name in names:
+                arrays[name] = np.full((n_samples, length), np.nan)
+                for i, fd in enumerate(fd_list):
+                    values = getattr(fd, name, None)
+                    if values is not None:
+                        arrays[name][i, :len(values)] = values
+        for name in SCALARS:
+            arrays[name] = np.array([getattr(fd, name, None) for fd in fd_list], dtype=float)
+
+        # write to a temporary directory first, so that an interrupted write does not leave a broken store
+        tmp_dir = store_dir + ".tmp"
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        if os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
@@ -0,0 +1,77 @@
+import csv
+import io
+import os
+import pandas as pd
+
+class IncrementalSummary:
+    """
+    Writes the fit_summary.csv incrementally, so that the results of finished samples are kept if a run is interrupted.
+
+    At the start of a run, the csv is written with the samples that are already known (e.g. from the cache).
+    Each sample is then appended as a single row as soon as it is finished, and flushed to disk.
+    At the end of the run, the csv is rewritten in the order of the input files.
+
+    Parameters
+    ----------
+    summ_csv : str
+        Path of the fit_summary.csv
+
+    Usage
+    -----
+    summary = IncrementalSummary(summ_csv)
+    # samples that are already in the csv from an interrupted run
+    done_summ_dict = summary.read()
+    summary.start(done_summ_dict)
+    for ...:
+        summary.append(filename, summ_dict)
+    summary.finish(nested_summ_dict)
+    """
+    def __init__(self, summ_csv):
+        self.summ_csv = summ_csv
+        self.columns = None
+
+    def read(self):
+        """Returns the summary dictionaries of the samples in an existing csv, with the filename as key.
+
+        A row that was only partly written when the run was interrupted is ignored.
+        """
+        if not os.path.isfile(self.summ_csv):
+            return {}
+        with open(self.summ_csv, newline="") as f:
+            text = f.read()
+        # each row is written with a line ending, so a last line without one is incomplete
+        if not text.endswith("\n"):
+            text = text[:text.rfind("\n") + 1]
+        try:
+            df = pd.read_csv(io.StringIO(text), index_col=0)
+        except (ValueError, pd.errors.ParserError):
+            return {}
+        return {filename: row.to_dict() for filename, row in df.iterrows()}
+
+    def start(self, nested_summ_dict):
+        """Starts a new csv, containing the given samples."""
+        self.columns = None
+        with open(self.summ_csv, "w", newline="") as f:
+            for filename, summ_dict in nested_summ_dict.items():
+                self._write_row(f, filename, summ_dict)
+
+    def append(self, filename, summ_dict):
+        """Appends a single finished sample to the csv, and flushes it to disk."""
+        with open(self.summ_csv, "a", newline="") as f:
+            self._write_row(f, filename, summ_dict)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish(self, nested_summ_dict):
+        """Replaces the csv with the final summary of all samples, in the given order."""
+        tmp = self.summ_csv + ".tmp"
+        pd.DataFrame(nested_summ_dict).T.to_csv(tmp)
+        os.replace(tmp, self.summ_csv)
+
+    def _write_row(self, f, filename, summ_dict):
+        writer = csv.writer(f)
+        if self.columns is None:
+            # the header is written with the first row, in the same format as pd.DataFrame.to_csv
+            self.columns = list(summ_dict)
+            writer.writerow([""] + self.columns)
+        writer.writerow([filename] + [summ_dict.get(column, "") for column in self.columns])
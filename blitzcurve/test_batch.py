@@ -0,0 +1,65 @@
+import numpy as np
+import blitzcurve.utils as utils
+from blitzcurve.batch import fit_batch, levenberg_marquardt
+from blitzcurve.calc import fit_curves
+
+# parameters of the summary that are fitted by both fit_curves and fit_batch
+BATCH_KEYS = ["r_max", "r_max_time", "a_seg1", "b_seg1", "c_seg1", "a_seg2", "b_seg2", "r_inf",
+              "plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow", "transfer_rate"]
+
+def _example_batch(example_data, n_noisy=2, seed=0):
+    """Time axis and stacked anisotropy of the example files, and of copies of them with additional noise."""
+    time = example_data[0].time
+    anisotropy = [data.anisotropy for data in example_data]
+    rng = np.random.default_rng(seed)
+    for data in example_data:
+        for _ in range(n_noisy):
+            anisotropy.append(data.anisotropy + rng.normal(0, 0.005, data.anisotropy.size))
+    return time, np.vstack(anisotropy)
+
+def test_fit_batch_matches_fit_curves(example_data):
+    time, anisotropy = _example_batch(example_data)
+    results = fit_batch(time, anisotropy, chunk_size=4)
+    assert results["converged"].all()
+    for i, y in enumerate(anisotropy):
+        summ_dict, fd = fit_curves(time, y)
+        for key in BATCH_KEYS:
+            # both solvers stop at the same tolerances, but not after exactly the same steps
+            np.testing.assert_allclose(results[key][i], summ_dict[key], rtol=2e-3, err_msg="{} of trace {}".format(key, i))
+
+def test_fit_batch_matches_fit_curves_far_from_the_settings_guess():
+    # two phase decays with rate constants far from the default guesses in FitSettings
+    rng = np.random.default_rng(6)
+    time = np.arange(0, 40, 0.025)
+    anisotropy = []
+    for Kfast, Kslow in [(8.0, 0.4), (0.5, 0.02), (3.0, 0.05), (6.0, 0.3)]:
+        params = [rng.uniform(0, 0.3), rng.uniform(0.1, 0.5), Kfast, rng.uniform(0.05, 0.3), Kslow]
+        peak = utils.two_phase_exp_decay_func(0, *params)
+        y = np.where(time < 3, time / 3 * peak, utils.two_phase_exp_decay_func(time - 3, *params))
+        anisotropy.append(y + rng.normal(0, 0.004, time.size))
+    results = fit_batch(time, np.array(anisotropy))
+    assert results["converged"].all()
+    for i, y in enumerate(anisotropy):
+        summ_dict, fd = fit_curves(time, y)
+        # the parameters of the two phase decay are poorly determined for some traces, so only the other fits are compared
+        for key in ["a_seg1", "b_seg1", "c_seg1", "a_seg2", "b_seg2", "r_inf", "transfer_rate"]:
+            np.testing.assert_allclose(results[key][i], summ_dict[key], rtol=5e-3, err_msg="{} of trace {}".format(key, i))
+
+def test_fit_batch_chunks_are_independent(example_data):
+    time, anisotropy = _example_batch(example_data)
+    results_single = fit_batch(time, anisotropy, chunk_size=1)
+    results_all = fit_batch(time, anisotropy, chunk_size=64)
+    for key in BATCH_KEYS:
+        np.testing.assert_allclose(results_single[key], results_all[key], rtol=1e-10, err_msg=key)
+
+def test_levenberg_marquardt_reports_stalled_fits():
+    x = np.linspace(0, 10, 50)
+    Y = np.tile(utils.exp_func(x, 0.5, 0.8, 0.1), (3, 1))
+    # no step can reduce a cost of NaN
+    Y[1, 3] = np.nan
+    P0 = np.array([[0.4, 1.0, 0.0], [0.4, 1.0, 0.0], [0.5, 0.8, 0.1]])
+    P, converged = levenberg_marquardt(utils.exp_model, x, Y, P0)
+    assert converged.tolist() == [True, False, True]
+    np.testing.assert_allclose(P[0], [0.5, 0.8, 0.1], rtol=1e-6)
+    # the last sample starts at the minimum, where the gradient is zero
+    np.testing.assert_array_equal(P[2], P0[2])
@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+import numpy as np
+from blitzcurve.cache import FitCache
+from blitzcurve.calc import FitSettings, fit_curves
+
+def _write_input_file(csv, time, anisotropy):
+    with open(csv, "w") as f:
+        f.write("time_ns,anisotropy\n")
+        for t, r in zip(time, anisotropy):
+            f.write("{!r},{!r}\n".format(t, r))
+
+def test_fit_cache_round_trip(example_data):
+    data = example_data[0]
+    settings = FitSettings()
+    summ_dict, fd = fit_curves(data.time, data.anisotropy, settings=settings)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv = os.path.join(tmp_dir, data.filename)
+        _write_input_file(csv, data.time, data.anisotropy)
+        cache = FitCache(tmp_dir)
+        key = cache.get_key(csv, settings, "all")
+        assert cache.get(data.filename, key) is None
+        cache.set(data.filename, key, summ_dict)
+        cache.save()
+
+        loaded = FitCache(tmp_dir).get(data.filename, key)
+        assert set(loaded) == set(summ_dict)
+        for name, value in summ_dict.items():
+            if isinstance(value, str) or value is None:
+                assert loaded[name] == value, name
+            else:
+                np.testing.assert_equal(loaded[name], value, err_msg=name)
+
+def test_fit_cache_key_changes(example_data):
+    data = example_data[0]
+    settings = FitSettings()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv = os.path.join(tmp_dir, data.filename)
+        _write_input_file(csv, data.time, data.anisotropy)
+        cache = FitCache(tmp_dir)
+        key = cache.get_key(csv, settings, "all")
+        assert cache.get_key(csv, FitSettings(), "all") == key
+        assert cache.get_key(csv, FitSettings(savgol_window=31), "all") != key
+        assert cache.get_key(csv, settings, ["savgol"]) != key
+        # figures are replotted if they are drawn differently
+        assert cache.get_key(csv, settings, "all", "standard", "minmax", "new") == key
+        assert cache.get_key(csv, settings, "all", "preview") != key
+        assert cache.get_key(csv, settings, "all", decimate="lttb") != key
+        assert cache.get_key(csv, settings, "all", decimate="none") != cache.get_key(csv, settings, "all", decimate="lttb")
+        assert cache.get_key(csv, settings, "all", render_mode="reuse") != key
+        with open(csv, "a") as f:
+            f.write("{!r},{!r}\n".format(data.time[-1] + 1, data.anisotropy[-1]))
+        assert cache.get_key(csv, settings, "all") != key
+
+def test_corrupted_fit_cache_is_ignored():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = FitCache(tmp_dir)
+        with open(cache.cache_json, "w") as f:
+            f.write("{")
+        assert FitCache(tmp_dir).entries == {}
@@ -0,0 +1,43 @@
+import numpy as np
+from blitzcurve.decimate import decimate, minmax_indices
+
+def test_minmax_decimation_keeps_extrema():
+    rng = np.random.default_rng(5)
+    x = np.linspace(0, 100, 100003)
+    y = np.exp(-x / 20) + rng.normal(0, 0.05, x.size)
+    # narrow spikes, which a plot of the decimated trace must still show
+    y[[1234, 56789]] = [3.0, -2.0]
+    x_dec, y_dec = decimate(x, y, 500, "minmax")
+    assert y_dec.size <= 2 * 500 + 2
+    assert x_dec[0] == x[0] and x_dec[-1] == x[-1]
+    assert np.all(np.diff(x_dec) > 0)
+    assert y_dec.max() == 3.0 and y_dec.min() == -2.0
+    # the lowest and highest value of each bin are kept
+    index = minmax_indices(y, 500)
+    bin_size = int(np.ceil(y.size / 500))
+    for start in range(0, y.size, bin_size):
+        bin_index = index[(index >= start) & (index < start + bin_size)]
+        assert y[start:start + bin_size].max() in y[bin_index]
+        assert y[start:start + bin_size].min() in y[bin_index]
+
+def test_minmax_decimation_ignores_nan():
+    y = np.arange(1000, dtype=float)
+    y[10:20] = np.nan
+    index = minmax_indices(y, 50)
+    assert not np.isnan(y[index[1:-1]]).any()
+
+def test_lttb_decimation_keeps_ends():
+    x = np.linspace(0, 10, 10000)
+    y = np.sin(x)
+    x_dec, y_dec = decimate(x, y, 100, "lttb")
+    assert x_dec.size == 200
+    assert x_dec[0] == x[0] and x_dec[-1] == x[-1]
+    assert np.all(np.diff(x_dec) > 0)
+    assert abs(y_dec.max() - 1) < 1e-3 and abs(y_dec.min() + 1) < 1e-3
+
+def test_short_traces_are_not_decimated():
+    x = np.linspace(0, 1, 100)
+    for method in ["minmax", "lttb", "none"]:
+        x_dec, y_dec = decimate(x, x ** 2, 50, method)
+        np.testing.assert_array_equal(x_dec, x)
+        np.testing.assert_array_equal(y_dec, x ** 2)
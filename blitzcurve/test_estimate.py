@@ -0,0 +1,36 @@
+import numpy as np
+import blitzcurve.utils as utils
+from blitzcurve.calc import FitSettings, fit_curves
+from blitzcurve.estimate import estimate_exp, estimate_time_resolved_anisotropy_decay, estimate_two_phase_exp_decay
+
+def test_estimate_exp():
+    x = np.linspace(0, 10, 500)
+    rng = np.random.default_rng(3)
+    np.testing.assert_allclose(estimate_exp(x, utils.exp_func(x, 0.5, 0.8, 0.1)), [0.5, 0.8, 0.1], rtol=1e-3)
+    p0 = estimate_exp(x, utils.exp_func(x, 0.5, 0.8, 0.1) + rng.normal(0, 0.005, x.size))
+    np.testing.assert_allclose(p0, [0.5, 0.8, 0.1], rtol=0.1)
+    # a rising trace is not an exponential decay
+    assert estimate_exp(x, x) is None
+
+def test_estimate_two_phase_exp_decay():
+    x = np.linspace(0, 20, 1000)
+    params = [0.1, 0.3, 2.0, 0.2, 0.2]
+    p0 = estimate_two_phase_exp_decay(x, utils.two_phase_exp_decay_func(x, *params))
+    np.testing.assert_allclose(p0, params, rtol=0.01)
+    rng = np.random.default_rng(4)
+    p0 = estimate_two_phase_exp_decay(x, utils.two_phase_exp_decay_func(x, *params) + rng.normal(0, 0.005, x.size))
+    # the fast rate constant is larger than the slow one, and both are close enough to converge
+    assert p0[2] > p0[4] > 0
+    np.testing.assert_allclose(p0[[2, 4]], [2.0, 0.2], rtol=0.3)
+    assert estimate_two_phase_exp_decay(x[:5], x[:5]) is None
+
+def test_estimate_time_resolved_anisotropy_decay():
+    x = np.linspace(0, 10, 500)
+    params = [0.4, 0.1, 0.25]
+    p0 = estimate_time_resolved_anisotropy_decay(x, utils.time_resolved_anisotropy_decay_func(x, *params))
+    np.testing.assert_allclose(p0, params, rtol=1e-3)
+
+def test_estimated_guess_converges_on_examples(example_data):
+    for data in example_data:
+        summ_dict, fd = fit_curves(data.time, data.anisotropy, settings=FitSettings(initial_guess="estimate"))
+        assert summ_dict["fit_status"] == "ok", summ_dict["fit_message"]
@@ -0,0 +1,39 @@
+import numpy as np
+import blitzcurve.utils as utils
+from blitzcurve.globalfit import global_fit
+
+def test_global_fit_without_shared_parameters_matches_separate_fits():
+    rng = np.random.default_rng(1)
+    x_list, y_list = [], []
+    for a, b, c, n in [(0.5, 0.8, 0.1, 200), (0.45, 0.3, 0.15, 150), (0.6, 1.5, 0.05, 250)]:
+        x = np.linspace(0, 10, n)
+        x_list.append(x)
+        y_list.append(utils.exp_func(x, a, b, c) + rng.normal(0, 0.005, n))
+    result = global_fit(utils.exp_model, x_list, y_list, shared=())
+    assert result.success
+    for params, x, y in zip(result.params, x_list, y_list):
+        popt, pcov = utils.exp_model.curve_fit(x, y, p0=utils.exp_model.estimate(x, y))
+        np.testing.assert_allclose(params, popt, rtol=1e-5)
+
+def test_global_fit_shared_parameter():
+    rng = np.random.default_rng(2)
+    x_list, y_list = [], []
+    for a, c in [(0.5, 0.1), (0.4, 0.2), (0.6, 0.05)]:
+        x = np.linspace(0, 10, 300)
+        x_list.append(x)
+        y_list.append(utils.exp_func(x, a, 0.7, c) + rng.normal(0, 0.002, x.size))
+    result = global_fit(utils.exp_model, x_list, y_list, shared=["b"])
+    assert result.success
+    b = result.params[:, 1]
+    assert np.all(b == b[0])
+    assert abs(b[0] - 0.7) < 5 * result.se[0, 1]
+    np.testing.assert_allclose(result.params[:, 0], [0.5, 0.4, 0.6], atol=0.01)
+
+def test_stalled_global_fit_is_not_converged():
+    x = np.linspace(0, 10, 50)
+    y = utils.exp_func(x, 0.5, 0.8, 0.1)
+    # no step can reduce a cost of NaN
+    y[3] = np.nan
+    result = global_fit(utils.exp_model, [x], [y], p0=[1, 1, 0])
+    assert not result.success
+    assert "stalled" in result.message
@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+import numpy as np
+from blitzcurve.calc import fit_curves
+from blitzcurve.store import CURVE_ARRAYS, SCALARS, TRACE_ARRAYS, FitDataStore
+
+def test_fitdata_store_round_trip(example_data):
+    fd_list = []
+    for data in example_data:
+        summ_dict, fd = fit_curves(data.time, data.anisotropy, fit=data.fit, filename=data.filename)
+        fd_list.append(fd)
+    # a shorter trace with a failed fit is padded with NaN, and read back with the original length and None
+    summ_dict, fd = fit_curves(fd_list[0].time[:900], fd_list[0].anisotropy[:900], filename="short.txt")
+    fd.tped_xfit, fd.tped_yfit = None, None
+    fd_list.append(fd)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = os.path.join(tmp_dir, "fitdata_store")
+        FitDataStore.write(store_dir, fd_list)
+        for mmap in [True, False]:
+            store = FitDataStore(store_dir, mmap=mmap)
+            assert len(store) == len(fd_list)
+            assert [fd.filename for fd in store] == [fd.filename for fd in fd_list]
+            for fd in fd_list:
+                loaded = store.get(fd.filename)
+                for name in TRACE_ARRAYS + CURVE_ARRAYS:
+                    if getattr(fd, name) is None:
+                        assert getattr(loaded, name) is None, name
+                    else:
+                        np.testing.assert_array_equal(getattr(loaded, name), getattr(fd, name), err_msg=name)
+                for name in SCALARS:
+                    assert getattr(loaded, name) == getattr(fd, name), name
+            # the memory maps are closed before the directory is removed
+            del store, loaded
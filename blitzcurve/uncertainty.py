@@ -0,0 +1,78 @@
+import numpy as np
+
+def standard_errors(pcov):
+    """Standard errors of the fitted parameters, from the covariance matrix returned by curve_fit.
+
+    Parameters
+    ----------
+    pcov : np.ndarray
+        Covariance of the fitted parameters, shape (n_params, n_params).
+
+    Returns
+    -------
+    se : np.ndarray
+        Square root of the diagonal of pcov. NaN where the covariance could not be estimated
+        (curve_fit returns inf if the Jacobian at the solution is singular).
+    """
+    variance = np.diag(np.asarray(pcov, dtype=float)).copy()
+    variance[~np.isfinite(variance) | (variance < 0)] = np.nan
+    return np.sqrt(variance)
+
+def bootstrap_confidence_intervals(model, x, y, popt, n_resamples=200, confidence=0.95, seed=0, sigma=None):
+    """Residual bootstrap confidence intervals of fitted parameters.
+
+    The residuals of the fit are resampled with replacement and added to the fitted curve, to give n_resamples
+    synthetic datasets. All synthetic datasets are refitted together with the stacked Levenberg-Marquardt
+    solver of blitzcurve.batch, starting from popt, so the refits cost about as much as a few separate fits.
+    The confidence intervals are percentiles of the refitted parameters.
+    For weighted fits, the residuals are resampled relative to sigma, and the refits are weighted in the same way.
+
+    Parameters
+    ----------
+    model : utils.FitModel
+        Model that was fitted, e.g. utils.exp_model.
+    x, y : np.ndarray
+        Data that was fitted.
+    popt : np.ndarray
+        Fitted parameters.
+    n_resamples : int
+        Number of bootstrap datasets.
+    confidence : float
+        Confidence level of the intervals, e.g. 0.95.
+    seed : int
+        Seed of the random number generator, so that the intervals are reproducible.
+    sigma : np.ndarray
+        Noise of each datapoint of a weighted fit. Default is None, for an unweighted fit.
+
+    Returns
+    -------
+    ci_low, ci_high : np.ndarray
+        Lower and upper limits of the confidence interval of each parameter.
+        NaN if popt is not finite, or if less than half of the refits converged.
+
+    Usage
+    -----
+    popt, pcov = utils.exp_model.curve_fit(x, y, p0=(0.7, 0.7, 0.2))
+    ci_low, ci_high = bootstrap_confidence_intervals(utils.exp_model, x, y, popt)
+    """
+    # blitzcurve.batch imports blitzcurve.calc, which uses this module
+    from blitzcurve.batch import levenberg_marquardt
+    popt = np.asarray(popt, dtype=float)
+    ci_low, ci_high = np.full(popt.size, np.nan), np.full(popt.size, np.nan)
+    if not np.all(np.isfinite(popt)) or n_resamples < 1:
+        return ci_low, ci_high
+    x = np.asarray(x, dtype=float)
+    y_fit = model(x, *popt)
+    sigma = np.ones(x.size) if sigma is None else np.asarray(sigma, dtype=float)
+    # residuals relative to the noise of each datapoint, which are interchangeable between datapoints
+    residuals = (np.asarray(y, dtype=float) - y_fit) / sigma
+    rng = np.random.default_rng(seed)
+    Y = y_fit + residuals[rng.integers(0, residuals.size, size=(n_resamples, residuals.size))] * sigma
+    # the mask of levenberg_marquardt multiplies the residuals, so 1 / sigma gives the same weighting as the original fit
+    P, converged = levenberg_marquardt(model, x, Y, np.tile(popt, (n_resamples, 1)), mask=np.broadcast_to(1 / sigma, Y.shape))
+    P = P[converged & np.all(np.isfinite(P), axis=1)]
+    if P.shape[0] < n_resamples / 2:
+        return ci_low, ci_high
+    alpha = (1 - confidence) / 2
+    ci_low, ci_high = np.percentile(P, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    return ci_low, ci_high
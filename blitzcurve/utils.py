@@ -1,16 +1,27 @@
 import os
 
 import numpy as np
+import blitzcurve.estimate as estimate
 
 def exp_func(x, a, b, c):
     #y = a * np.exp(-b * x) + c
     y = (a - c) * np.exp(-b * x) + c
     return y
 
+def exp_func_partials(x, a, b, c):
+    """Partial derivatives of exp_func with respect to a, b and c."""
+    e = np.exp(-b * x)
+    return [e, -(a - c) * x * e, 1 - e]
+
 def time_resolved_anisotropy_decay_func(t, r0, r_inf, transfer_rate):
     r_t = (r0-r_inf) * np.exp(-2 * transfer_rate * t) + r_inf
     return r_t
 
+def time_resolved_anisotropy_decay_func_partials(t, r0, r_inf, transfer_rate):
+    """Partial derivatives of time_resolved_anisotropy_decay_func with respect to r0, r_inf and transfer_rate."""
+    e = np.exp(-2 * transfer_rate * t)
+    return [e, 1 - e, -2 * t * (r0 - r_inf) * e]
+
 def two_phase_exp_decay_func(x, plateau, SpanFast, Kfast, SpanSlow, Kslow):
     """Function for two phase exponential decay.
 
@@ -40,6 +51,120 @@ def two_phase_exp_decay_func(x, plateau, SpanFast, Kfast, SpanSlow, Kslow):
     y = plateau + SpanFast * np.exp(-Kfast * x) + SpanSlow * np.exp(-Kslow * x)
     return y
 
+def two_phase_exp_decay_func_partials(x, plateau, SpanFast, Kfast, SpanSlow, Kslow):
+    """Partial derivatives of two_phase_exp_decay_func with respect to plateau, SpanFast, Kfast, SpanSlow and Kslow."""
+    e_fast = np.exp(-Kfast * x)
+    e_slow = np.exp(-Kslow * x)
+    return [1.0, e_fast, -SpanFast * x * e_fast, e_slow, -SpanSlow * x * e_slow]
+
+class FitModel:
+    """
+    Model function for curve fitting, together with its analytic Jacobian.
+
+    Passing the Jacobian to scipy.optimize.curve_fit avoids the finite-difference estimate of the
+    derivatives, which costs one extra model evaluation per parameter in each iteration.
+
+    Parameters
+    ----------
+    func : function
+        Model function, func(x, *params) -> y.
+    partials : function
+        Partial derivatives of the model, partials(x, *params) -> list with one array (or scalar) per parameter.
+    param_names : list
+        Names of the parameters, in the order used by func.
+    bounds : tuple
+        (lower, upper) bounds of the parameters, used by fits with method="trf".
+        Default is None, which gives unbounded parameters.
+    estimator : function
+        Non-iterative estimate of the parameters from the data, estimator(x, y) -> array of params, or None.
+        Used as the initial guess of the fits. Default is None, for models without an estimator.
+
+    Usage
+    -----
+    popt, pcov = utils.exp_model.curve_fit(x, y, p0=(0.7, 0.7, 0.2))
+    # fix a parameter at a constant value
+    popt, pcov = utils.time_resolved_anisotropy_decay_model.fix(r0=0.48).curve_fit(x, y)
+    """
+    def __init__(self, func, partials, param_names, bounds=None, estimator=None):
+        self.func = func
+        self.estimator = estimator
+        self.partials = partials
+        self.param_names = list(param_names)
+        if bounds is None:
+            bounds = ([-np.inf] * len(self.param_names), [np.inf] * len(self.param_names))
+        self.bounds = (np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float))
+
+    def __call__(self, x, *params):
+        return self.func(x, *params)
+
+    def jac(self, x, *params):
+        """Jacobian for curve_fit, with shape (len(x), n_params)."""
+        partials = self.partials(x, *params)
+        J = np.empty((np.size(x), len(partials)))
+        for i, d in enumerate(partials):
+            J[:, i] = d
+        return J
+
+    def batch_func(self, x, P):
+        """Model for many samples at once. P has shape (n_samples, n_params), output has shape (n_samples, len(x))."""
+        return self.func(x, *(P[:, i, None] for i in range(P.shape[1])))
+
+    def batch_jac(self, x, P):
+        """Jacobian for many samples at once, with shape (n_samples, n_params, len(x))."""
+        shape = (P.shape[0], np.size(x))
+        partials = self.partials(x, *(P[:, i, None] for i in range(P.shape[1])))
+        return np.stack([np.broadcast_to(d, shape) for d in partials], axis=1)
+
+    def curve_fit(self, x, y, p0=None, **kwargs):
+        """Runs scipy.optimize.curve_fit with the analytic Jacobian. Keyword arguments are passed to curve_fit."""
+        if p0 is None:
+            p0 = np.ones(len(self.param_names))
+        # imported here, as scipy.optimize is slow to import and not needed for the batch fits
+        from scipy.optimize import curve_fit
+        return curve_fit(self.func, x, y, p0=p0, jac=self.jac, **kwargs)
+
+    def estimate(self, x, y):
+        """Returns an initial guess of the parameters estimated from the data, or None if it could not be estimated."""
+        if self.estimator is None:
+            return None
+        with np.errstate(all="ignore"):
+            return self.estimator(x, y)
+
+    def fix(self, **fixed):
+        """Returns a new FitModel where some parameters are held constant, e.g. model.fix(r0=0.48)."""
+        free_names = [name for name in self.param_names if name not in fixed]
+        free_index = [self.param_names.index(name) for name in free_names]
+        template = [fixed.get(name) for name in self.param_names]
+
+        def all_params(params):
+            values = list(template)
+            for i, value in zip(free_index, params):
+                values[i] = value
+            return values
+
+        def func(x, *params):
+            return self.func(x, *all_params(params))
+
+        def partials(x, *params):
+            all_partials = self.partials(x, *all_params(params))
+            return [all_partials[i] for i in free_index]
+
+        def estimator(x, y):
+            # estimate all parameters, and keep the free ones
+            p0 = self.estimate(x, y)
+            return None if p0 is None else np.asarray(p0)[free_index]
+
+        bounds = (self.bounds[0][free_index], self.bounds[1][free_index])
+        return FitModel(func, partials, free_names, bounds, estimator)
+
+# amplitudes and rate constants of the decays are not negative
+exp_model = FitModel(exp_func, exp_func_partials, ["a", "b", "c"],
+                     bounds=([0, 0, -np.inf], [np.inf, np.inf, np.inf]), estimator=estimate.estimate_exp)
+time_resolved_anisotropy_decay_model = FitModel(time_resolved_anisotropy_decay_func, time_resolved_anisotropy_decay_func_partials, ["r0", "r_inf", "transfer_rate"],
+                                                bounds=([-np.inf, -np.inf, 0], [np.inf, np.inf, np.inf]), estimator=estimate.estimate_time_resolved_anisotropy_decay)
+two_phase_exp_decay_model = FitModel(two_phase_exp_decay_func, two_phase_exp_decay_func_partials, ["plateau", "SpanFast", "Kfast", "SpanSlow", "Kslow"],
+                                     bounds=([-np.inf, 0, 0, 0, 0], [np.inf] * 5), estimator=estimate.estimate_two_phase_exp_decay)
+
 class FlourescentColours():
     """
     Object with fluorescent html colours from https://www.w3schools.com/colors/colors_crayola.asp
@@ -78,18 +203,20 @@ def get_fluorescent_colours():
     fl_col_list = [fc_dict[k] for k in fl_col_keys]
     return fc_dict, fl_col_keys, fl_col_list
 
-def setup_matplotlib_dark_background(plt):
+def setup_matplotlib_dark_background(plt, dpi=240):
     """ Initialises the dark background style of matplotlib, which applies to all following plots.
     Adds error caps to barcharts, sets figure size and dpi.
 
     Parameters
     ----------
     plt : matplotlib library
+    dpi : float
+        Resolution of the saved figures. See profiles.RenderProfile.
     """
     plt.style.use('dark_background')
     plt.rcParams['errorbar.capsize'] = 3
     plt.rcParams['figure.figsize'] = (5, 5)
-    plt.rcParams["savefig.dpi"] = 240
+    plt.rcParams["savefig.dpi"] = dpi
 
 # class OutFilepaths:
 #     def __init__(self, data_dir, csv):
@@ -127,46 +254,52 @@ class OutDirPaths:
         self.two_comp_exp_decay_dir = os.path.join(self.fits_dir, "two_phase_exp_decay")
         self.time_resolved_anisotropy_decay_dir = os.path.join(self.fits_dir, "time_resolved_anisotropy_decay")
         self.fitdata_dir = os.path.join(self.fits_dir, "fitdata")
+        # consolidated store of all fitdata, only created by run_fit if fitdata_format is "store" or "both"
+        self.fitdata_store_dir = os.path.join(self.fitdata_dir, "fitdata_store")
         self.summary_figs_dir = os.path.join(data_dir, "summary", "figs")
 
         for path in [self.fits_dir, self.rotat_dir, self.savgol_dir, self.seg1_dir, self.seg2_dir, self.two_comp_exp_decay_dir, self.time_resolved_anisotropy_decay_dir, self.fitdata_dir, self.summary_figs_dir]:
-            if not os.path.isdir(path):
-                os.makedirs(path)
+            # exist_ok, as worker processes of run_fit may create the same directories at the same time
+            os.makedirs(path, exist_ok=True)
 
 class FitFilePaths(OutDirPaths):
     """
     Adds file paths to the OutDirPaths object that are specific to a single sample, based on the original sample filename.
+    The figure paths end in "_png" for historical reasons, but have the extension of fmt (e.g. ".svg").
     """
-    def __init__(self, data_dir, csv):
+    def __init__(self, data_dir, csv, fmt="png"):
         # instantiate the parent OutDirPaths object, giving the relevant directories
         OutDirPaths.__init__(self, data_dir)
         # create various paths
         self.filename = os.path.basename(csv)
-        self.rotat_fit_png = os.path.join(self.rotat_dir, self.filename[:-4] + "_rotat_fit.png")
-        self.savgol_fit_png = os.path.join(self.savgol_dir, self.filename[:-4] + "_savgol_fit.png")
-        self.savgol_fit_peak_png = os.path.join(self.savgol_dir, self.filename[:-4] + "_savgol_fit_peak.png")
-        self.savgol_fit_desc_png = os.path.join(self.seg1_dir, self.filename[:-4] + "_savgol_fit_desc.png")
-        self.exp_fit_seg1_png = os.path.join(self.seg1_dir, self.filename[:-4] + "_seg1.png")
-        self.exp_fit_seg2_png = os.path.join(self.seg2_dir, self.filename[:-4] + "_seg2.png")
-        self.two_comp_exp_decay_png = os.path.join(self.two_comp_exp_decay_dir, self.filename[:-4] + "_two_comp_exp_decay.png")
-        self.time_resolved_anisotropy_decay_png = os.path.join(self.time_resolved_anisotropy_decay_dir, self.filename[:-4] + "_time_resolved_anisotropy_decay.png")
+        ext = "." + fmt
+        self.rotat_fit_png = os.path.join(self.rotat_dir, self.filename[:-4] + "_rotat_fit" + ext)
+        self.savgol_fit_png = os.path.join(self.savgol_dir, self.filename[:-4] + "_savgol_fit" + ext)
+        self.savgol_fit_peak_png = os.path.join(self.savgol_dir, self.filename[:-4] + "_savgol_fit_peak" + ext)
+        self.savgol_fit_desc_png = os.path.join(self.seg1_dir, self.filename[:-4] + "_savgol_fit_desc" + ext)
+        self.exp_fit_seg1_png = os.path.join(self.seg1_dir, self.filename[:-4] + "_seg1" + ext)
+        self.exp_fit_seg2_png = os.path.join(self.seg2_dir, self.filename[:-4] + "_seg2" + ext)
+        self.two_comp_exp_decay_png = os.path.join(self.two_comp_exp_decay_dir, self.filename[:-4] + "_two_comp_exp_decay" + ext)
+        self.time_resolved_anisotropy_decay_png = os.path.join(self.time_resolved_anisotropy_decay_dir, self.filename[:-4] + "_time_resolved_anisotropy_decay" + ext)
         self.fitdata_pickle = os.path.join(self.fitdata_dir, self.filename[:-4] + "_fitdata.pickle")
 
 class CompareFilePaths(OutDirPaths):
     """
     Adds file paths to the OutDirPaths object that are specific to the compare function, e.g. for barcharts.
+    The figures have the extension of fmt (e.g. ".svg").
     """
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, fmt="png"):
         # instantiate the parent OutDirPaths object, giving the relevant directories
         OutDirPaths.__init__(self, data_dir)
+        ext = "." + fmt
         # barchart paths
-        self.barchart_r_max = os.path.join(self.summary_figs_dir, "01_barchart_r_max.png")
-        self.barchart_r_inf = os.path.join(self.summary_figs_dir, "02_barchart_r_inf.png")
-        self.barchart_variable_a_png = os.path.join(self.summary_figs_dir, "03_barchart_a.png")
-        self.barchart_variable_b_png = os.path.join(self.summary_figs_dir, "04_barchart_b.png")
-        self.barchart_variable_c_png = os.path.join(self.summary_figs_dir, "05_barchart_c.png")
+        self.barchart_r_max = os.path.join(self.summary_figs_dir, "01_barchart_r_max" + ext)
+        self.barchart_r_inf = os.path.join(self.summary_figs_dir, "02_barchart_r_inf" + ext)
+        self.barchart_variable_a_png = os.path.join(self.summary_figs_dir, "03_barchart_a" + ext)
+        self.barchart_variable_b_png = os.path.join(self.summary_figs_dir, "04_barchart_b" + ext)
+        self.barchart_variable_c_png = os.path.join(self.summary_figs_dir, "05_barchart_c" + ext)
         # linechart paths
-        self.linechart_savgol = os.path.join(self.summary_figs_dir, "06_linechart_savgol.png")
-        self.linechart_seg1 = os.path.join(self.summary_figs_dir, "07_linechart_seg1.png")
-        self.linechart_seg2 = os.path.join(self.summary_figs_dir, "08_linechart_seg2.png")
+        self.linechart_savgol = os.path.join(self.summary_figs_dir, "06_linechart_savgol" + ext)
+        self.linechart_seg1 = os.path.join(self.summary_figs_dir, "07_linechart_seg1" + ext)
+        self.linechart_seg2 = os.path.join(self.summary_figs_dir, "08_linechart_seg2" + ext)
 
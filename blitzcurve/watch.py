@@ -0,0 +1,216 @@
+import glob
+import os
+import pickle
+import sys
+import time
+import blitzcurve.utils as utils
+from blitzcurve.cache import FitCache
+from blitzcurve.calc import FitSettings
+from blitzcurve.fit import fit_files, plot_outliers
+from blitzcurve.profiles import get_render_profile
+from blitzcurve.store import FitDataStore
+from blitzcurve.summary import IncrementalSummary
+from blitzcurve.utils import FitFilePaths
+
+def run_watch(data_dir, poll_interval=5.0, figs_to_plot="all", compare=True, name_dict=None, workers=1, settings=None,
+              fitdata_format="pickle", max_polls=None, decimate="minmax", render_profile="standard"):
+    """Watches a directory and fits new or changed input files as they are written by the instrument.
+
+    The directory is polled every poll_interval seconds. A file is fitted once its size and modification time
+    are unchanged between two polls, so that files that are still being written are not analysed.
+    Only the new or changed files are fitted (see DirectoryWatcher). Their rows are appended to fit_summary.csv,
+    and only their curves are added to the compare figures, so results appear seconds after acquisition,
+    regardless of the number of samples already in the directory.
+
+    Stop watching with Ctrl+C.
+
+    Parameters
+    ----------
+    data_dir : str
+        Path to directory with the input text files.
+    poll_interval : float
+        Time in seconds between checks of the directory.
+    figs_to_plot : str, list
+        List of figures to plot for each sample. See run_fit.
+    compare : bool
+        If True, the compare figures are updated after each fit.
+    name_dict : dict
+        Dictionary to rename long filenames for plotting in the compare figures.
+    workers : int
+        Number of worker processes, used if several files are ready at once. Default is 1,
+        as usually only a few files arrive at once.
+    settings : calc.FitSettings
+        Settings for the fits. Default is None, which uses FitSettings().
+    fitdata_format : str
+        Format of the output fit data. See run_fit.
+    max_polls : int
+        Stop after this number of polls. Default is None, which watches until interrupted.
+    decimate : str
+        Decimation of long traces before plotting, in the figures of each sample and in the compare figures. See run_fit.
+    render_profile : str or profiles.RenderProfile
+        Format and resolution of the figures, e.g. "preview" or "summary". See run_fit.
+
+    Usage
+    -----
+    import blitzcurve
+    data_dir = r"D:\\data\\20180229_TRdata"
+    blitzcurve.run_watch(data_dir, poll_interval=2, fitdata_format="store")
+    """
+    watcher = DirectoryWatcher(data_dir, figs_to_plot, compare, name_dict, workers, settings, fitdata_format, decimate, render_profile)
+    n_polls = 0
+    sys.stdout.write("Watching {} for new input files. Press Ctrl+C to stop.\n".format(data_dir))
+    try:
+        while max_polls is None or n_polls < max_polls:
+            watcher.poll()
+            n_polls += 1
+            if max_polls is None or n_polls < max_polls:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        sys.stdout.write("\nStopped watching {}.\n".format(data_dir))
+
+class DirectoryWatcher:
+    """
+    State of run_watch, which fits each new or changed input file separately as soon as it has been written.
+
+    At the start, the samples in an existing fit_summary.csv are loaded, together with their fitdata.
+    Files that are unchanged since they were fitted (according to the fit cache, see cache.FitCache) are not fitted again.
+    After that, each file that is ready is fitted on its own (see fit.fit_files), its row is appended to
+    fit_summary.csv with summary.IncrementalSummary, and its curves are added to the compare figures with
+    compare.IncrementalCompare. The other samples are not fitted, loaded or plotted again.
+
+    A file that could not be analysed, or where all strategies of a fit failed (fit_status "failed"), is not recorded
+    as fitted. It is fitted again when it changes, e.g. when a partially written file is completed.
+
+    Parameters
+    ----------
+    See run_watch.
+
+    Usage
+    -----
+    watcher = DirectoryWatcher(data_dir)
+    while True:
+        watcher.poll()
+        time.sleep(5)
+    """
+    def __init__(self, data_dir, figs_to_plot="all", compare=True, name_dict=None, workers=1, settings=None,
+                 fitdata_format="pickle", decimate="minmax", render_profile="standard"):
+        if fitdata_format not in ["pickle", "store", "both"]:
+            raise ValueError("fitdata_format should be 'pickle', 'store' or 'both', not '{}'".format(fitdata_format))
+        self.data_dir = data_dir
+        self.figs_to_plot = figs_to_plot
+        self.workers = workers
+        self.settings = FitSettings() if settings is None else settings
+        self.fitdata_format = fitdata_format
+        self.decimate = decimate
+        self.profile = get_render_profile(render_profile)
+        # figures plotted for each sample as it is fitted. With sample_figures="outliers", only outliers are plotted.
+        self.sample_figs = figs_to_plot if self.profile.sample_figures == "all" else []
+        self.dirs = utils.OutDirPaths(data_dir)
+        summ_dir = os.path.join(data_dir, "summary")
+        os.makedirs(summ_dir, exist_ok=True)
+        self.summary = IncrementalSummary(os.path.join(summ_dir, "fit_summary.csv"))
+        self.cache = FitCache(self.dirs.fitdata_dir)
+
+        # samples that were fitted earlier, and whose fitdata still exists
+        known_summ_dict = self.summary.read()
+        self.fds = self._load_fitdata(known_summ_dict)
+        self.nested_summ_dict = {filename: summ_dict for filename, summ_dict in known_summ_dict.items() if filename in self.fds}
+        self.summary.start(self.nested_summ_dict)
+
+        # size and modification time of each file at the last poll, of the files that were last fitted, and of failed files
+        self.last_seen = {}
+        self.last_fitted = {}
+        self.last_failed = {}
+        for csv, state in _get_file_states(data_dir).items():
+            filename = os.path.basename(csv)
+            if filename in self.nested_summ_dict and self.cache.get(filename, self._get_key(csv)) is not None:
+                self.last_fitted[csv] = state
+
+        self.compare = None
+        if compare:
+            # matplotlib is only imported if the compare figures are updated
+            from blitzcurve.compare import IncrementalCompare
+            self.compare = IncrementalCompare(data_dir, name_dict, decimate, self.profile)
+            self.compare.update(self.nested_summ_dict, list(self.fds.values()))
+
+    def poll(self):
+        """Checks the directory once, and fits the files that are new or changed, and have finished being written."""
+        current = _get_file_states(self.data_dir)
+        ready = [csv for csv, state in current.items()
+                 if self.last_fitted.get(csv) != state and self.last_failed.get(csv) != state and self.last_seen.get(csv) == state]
+        if ready:
+            sys.stdout.write("\n{} new or changed files: {}\n".format(len(ready), ", ".join(os.path.basename(csv) for csv in ready)))
+            self._update(ready, current)
+        self.last_seen = current
+        return ready
+
+    def _update(self, ready, current):
+        fitted_fd = []
+        rewrite_summary = False
+        # several files that are ready at once are fitted in worker processes
+        results = list(fit_files(self.data_dir, ready, self.sample_figs, self.settings, self.fitdata_format, self.workers,
+                                 decimate=self.decimate, render_profile=self.profile))
+        for csv, (filename, summ_dict, fd, error, metrics) in zip(ready, results):
+            if error is not None:
+                sys.stdout.write("ERROR: {} could not be analysed, and is fitted again when it changes.\n{}".format(filename, error))
+                self.last_failed[csv] = current[csv]
+                continue
+            if fd is None:
+                # fd is only returned for the columnar store
+                with open(FitFilePaths(self.data_dir, csv).fitdata_pickle, "rb") as pic:
+                    fd = pickle.load(pic)
+            if filename in self.nested_summ_dict:
+                # a changed file replaces its row, so the whole csv is rewritten
+                rewrite_summary = True
+            else:
+                self.summary.append(filename, summ_dict)
+            self.nested_summ_dict[filename] = summ_dict
+            self.fds[filename] = fd
+            fitted_fd.append(fd)
+            if summ_dict["fit_status"] == "failed":
+                sys.stdout.write("{}: {}. It is fitted again when it changes.\n".format(filename, summ_dict["fit_message"]))
+                self.last_failed[csv] = current[csv]
+            else:
+                self.last_fitted[csv] = current[csv]
+                self.cache.set(filename, self._get_key(csv), summ_dict)
+        if rewrite_summary:
+            self.summary.finish(self.nested_summ_dict)
+        self.cache.save()
+        if self.fitdata_format in ["store", "both"]:
+            # rewriting the store takes a few ms, even for hundreds of samples
+            FitDataStore.write(self.dirs.fitdata_store_dir, list(self.fds.values()))
+        if self.profile.sample_figures == "outliers":
+            plot_outliers(self.data_dir, self.nested_summ_dict, self.figs_to_plot, self.fitdata_format, self.fds, self.profile,
+                           decimate=self.decimate)
+        if self.compare is not None and fitted_fd:
+            self.compare.update(self.nested_summ_dict, fitted_fd)
+
+    def _get_key(self, csv):
+        return self.cache.get_key(csv, self.settings, self.figs_to_plot, self.profile.name, self.decimate)
+
+    def _load_fitdata(self, nested_summ_dict):
+        """Loads the fitdata of samples in an existing summary, from the columnar store if available, otherwise from the pickles."""
+        fds = {}
+        store = FitDataStore(self.dirs.fitdata_store_dir, mmap=False) if os.path.isdir(self.dirs.fitdata_store_dir) else None
+        for filename in nested_summ_dict:
+            if store is not None:
+                if filename in store:
+                    fds[filename] = store.get(filename)
+                continue
+            fitdata_pickle = FitFilePaths(self.data_dir, os.path.join(self.data_dir, filename)).fitdata_pickle
+            if os.path.isfile(fitdata_pickle):
+                with open(fitdata_pickle, "rb") as pic:
+                    fds[filename] = pickle.load(pic)
+        return fds
+
+def _get_file_states(data_dir):
+    """Returns a dictionary of the input files in data_dir, with a (size, modification time) tuple for each file."""
+    states = {}
+    for csv in glob.glob(os.path.join(data_dir, "*.txt")):
+        try:
+            stat = os.stat(csv)
+        except OSError:
+            # file was removed or renamed after the glob
+            continue
+        states[csv] = (stat.st_size, stat.st_mtime_ns)
+    return states
@@ -0,0 +1,79 @@
+import numpy as np
+
+def trace_sigma(anisotropy, weighting="none", y_fit_savgol=None, fit=None, wres=None, window=101):
+    """Standard deviation of the noise of each datapoint, used to weight the fits of a trace.
+
+    The noise of the anisotropy is not constant. Shortly after the excitation pulse, many photons are counted,
+    whereas in the tail the fluorescence has decayed and the noise is several times larger.
+    Weighting each datapoint by 1 / sigma ** 2 gives the early datapoints the influence that their precision deserves.
+    Only the relative size of sigma matters, as curve_fit scales the covariance by the residual variance.
+
+    Parameters
+    ----------
+    anisotropy : np.ndarray
+        Anisotropy of one trace, shape (n_timepoints,), or of many traces, shape (n_samples, n_timepoints).
+    weighting : str
+        "none" gives unweighted fits, and returns None.
+        "noise" estimates the noise from the residuals of the Savitzky-Golay fit (see noise_sigma).
+        "wres" derives the noise from the fit and wres (weighted residual) columns of the input file (see wres_sigma).
+    y_fit_savgol : np.ndarray
+        Savitzky-Golay fit of the anisotropy, same shape as anisotropy. Required for "noise".
+    fit, wres : np.ndarray
+        fit and wres columns of the input file. Required for "wres".
+    window : int
+        Number of datapoints over which the noise is averaged.
+
+    Returns
+    -------
+    sigma : np.ndarray or None
+        Standard deviation of each datapoint, same shape as anisotropy. None for "none".
+    """
+    if weighting == "none":
+        return None
+    if weighting == "noise":
+        return noise_sigma(anisotropy, y_fit_savgol, window)
+    if weighting == "wres":
+        if fit is None or wres is None:
+            raise ValueError("weighting 'wres' requires the fit and wres columns in the input file")
+        return wres_sigma(anisotropy, fit, wres, window)
+    raise ValueError("weighting should be 'none', 'noise' or 'wres', not '{}'".format(weighting))
+
+def noise_sigma(anisotropy, y_fit_savgol, window=101):
+    """Noise model from the residuals of the Savitzky-Golay fit.
+
+    The Savitzky-Golay fit follows the signal closely, so its residuals are mostly noise. sigma is the root mean square
+    of the residuals in a running window, which follows the increase of the noise as the fluorescence decays.
+    Works along the last axis, so that many traces can be processed at once.
+    """
+    residuals = np.asarray(anisotropy, dtype=float) - np.asarray(y_fit_savgol, dtype=float)
+    return _limit(np.sqrt(_running_mean(residuals ** 2, window)))
+
+def wres_sigma(anisotropy, fit, wres, window=101):
+    """Noise of each datapoint from the fit and wres columns of the input file.
+
+    The weighted residuals of the upstream fit are wres = (anisotropy - fit) / sigma, so sigma = (anisotropy - fit) / wres.
+    As the columns are rounded, this is inaccurate for datapoints where wres is close to zero. sigma is therefore
+    the root mean square of (anisotropy - fit) divided by the root mean square of wres, in a running window.
+    """
+    residuals = np.asarray(anisotropy, dtype=float) - np.asarray(fit, dtype=float)
+    wres = np.asarray(wres, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.sqrt(_running_mean(residuals ** 2, window) / _running_mean(wres ** 2, window))
+    return _limit(sigma)
+
+def _running_mean(a, window):
+    """Mean in a centred window along the last axis. The window is truncated at the ends of the trace."""
+    half = window // 2
+    # cumulative sum with a leading zero, so that the sum of a[i:j] is cumsum[j] - cumsum[i]
+    cumsum = np.concatenate([np.zeros(a.shape[:-1] + (1,)), np.cumsum(a, axis=-1)], axis=-1)
+    n = a.shape[-1]
+    start = np.clip(np.arange(n) - half, 0, n)
+    end = np.clip(np.arange(n) + half + 1, 0, n)
+    return (cumsum[..., end] - cumsum[..., start]) / (end - start)
+
+def _limit(sigma):
+    """Replaces values that are not finite, and limits sigma to at least a tenth of the median,
+    so that no datapoint gets an extreme weight (e.g. where the residuals are zero)."""
+    median = np.nanmedian(np.where(np.isfinite(sigma) & (sigma > 0), sigma, np.nan), axis=-1, keepdims=True)
+    sigma = np.where(np.isfinite(sigma), sigma, median)
+    return np.maximum(sigma, 0.1 * median)
@@ -18,15 +18,17 @@ setup(
     url="https://github.com/teese/blitzcurve",
     download_url='https://github.com/teese/blitzcurve/archive/0.0.2.tar.gz',
     license='MIT',
-    classifiers=['Programming Language :: Python :: 3.6',
+    classifiers=['Programming Language :: Python :: 3.7',
                'License :: OSI Approved :: MIT License',
                'Intended Audience :: Science/Research',
                'Topic :: Scientific/Engineering :: Chemistry',
                'Topic :: Scientific/Engineering :: Physics',
                ],
+    python_requires=">=3.7",
     install_requires=["pandas", "numpy", "scipy", "matplotlib"],
     project_urls={'LangoschLab': 'http://cbp.wzw.tum.de/index.php?id=9', "TU_Munich": "https://www.tum.de"},
     keywords="fluorescence FRET rotation curve savitzky golay anisotropy time resolved TRAM single molecule protein bioinformatics biophysics microscopy",
     packages=find_packages(),
+    entry_points={"console_scripts": ["blitzcurve = blitzcurve.cli:main"]},
     version = "0.0.2",
     )
\ No newline at end of file